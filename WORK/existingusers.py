@@ -1,3 +1,5 @@
+import os
+import sys
 import streamlit as st
 import pandas as pd
 import numpy as np
@@ -5,6 +7,10 @@ import pickle
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.neighbors import NearestNeighbors
 
+# Shared modules live in the project root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from popularity_index import load_popularity_index, ranked_products
+
 # Set page configuration
 st.set_page_config(
     page_title="Investment Portfolio Recommender",
@@ -43,12 +49,13 @@ def load_models():
         with open('tfidf.pkl', 'rb') as file:
             tfidf = pickle.load(file)
         df = pd.read_csv('investment_member.csv')
-        return model, tfidf, df
+        popularity_index = load_popularity_index(df, 'investment_member.csv')
+        return model, tfidf, df, popularity_index
     except Exception as e:
         st.error(f"Error loading models: {str(e)}")
-        return None, None, None
+        return None, None, None, None
 
-def get_recommendations_with_messages(member_features, df, member_data, n=5):
+def get_recommendations_with_messages(member_features, popularity_index, member_data, n=5):
     """
     Modified version of get_recommendations_with_messages that works with input data
     instead of looking up from DataFrame
@@ -79,12 +86,7 @@ def get_recommendations_with_messages(member_features, df, member_data, n=5):
             )
 
     # Rule 2: Age group recommendations
-    age_group_products = (
-        df[df['age_group'] == member_age_group]
-        .portfolio_map.value_counts()
-        .index
-        .tolist()
-    )
+    age_group_products = ranked_products(popularity_index, 'age_group', member_age_group)
     for product in age_group_products:
         if product not in member_current_products and product not in recommended_products:
             recommended_products.append(product)
@@ -98,12 +100,7 @@ def get_recommendations_with_messages(member_features, df, member_data, n=5):
         )
 
     # Rule 3: Location-based recommendations
-    town_products = (
-        df[df['town'] == member_town]
-        .portfolio_map.value_counts()
-        .index
-        .tolist()
-    )
+    town_products = ranked_products(popularity_index, 'town', member_town)
     for product in town_products:
         if product not in member_current_products and product not in recommended_products:
             recommended_products.append(product)
@@ -187,7 +184,7 @@ with st.form("recommendation_form"):
 
 # Process form submission
 if submit_button:
-    model, tfidf, df = load_models()
+    model, tfidf, df, popularity_index = load_models()
     
     if model is not None and tfidf is not None and df is not None and not df.empty:
         try:
@@ -217,7 +214,7 @@ if submit_button:
             # Get recommendations
             recommendations, messages = get_recommendations_with_messages(
                 features_tfidf,
-                df,
+                popularity_index,
                 member_data,
                 n=n_recommendations
             )
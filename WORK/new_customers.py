@@ -3,67 +3,17 @@ import pandas as pd
 import numpy as np
 from datetime import datetime
 import plotly.express as px
+import os
+import sys
+
+# Shared modules live in the project root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from advisor import load_new_customer_data
 
 # Loading the data
 def load_data():
-  # Money Market Funds data
-    mmf_data = {
-    'Fund': [
-        'Cytonn Money Market Fund', 
-        'Lofty Corban Money Market Fund', 
-        'Etica Money Market Fund', 
-        'ArvoCap Money Market Fund', 
-        'Kuza Money Market Fund', 
-        'GenAfrica Money Market Fund', 
-        'Nabo Africa Money Market Fund', 
-        'Jubilee Money Market Fund', 
-        'Madison Money Market Fund', 
-        'Co-op Money Market Fund', 
-        'KCB Money Market Fund', 
-        'Sanlam Money Market Fund', 
-        'ABSA Shilling MMF', 
-        'Enwealth Money Market Fund', 
-        'Mail Money Market Fund', 
-        'Mayfair Money Market Fund', 
-        'Faulu Money Market Fund', 
-        'Orient Kasha Money Market Fund', 
-        'Genghis Money Market Fund', 
-        'African Alliance Kenya Money Market Fund', 
-        'Dry Associates Money Market Fund', 
-        'Old Mutual Money Market Fund', 
-        'Apollo Money Market Fund', 
-        'CIC Money Market Fund', 
-        'ICEA Lion Money Market Fund', 
-        'British-American Money Market Fund', 
-        'Equity Money Market Fund'
-    ],
-    'Return': [
-        18.07, 17.96, 17.11, 17.09, 16.88, 16.51, 15.66, 15.61, 15.43, 15.36, 15.17, 
-        15.13, 15.03, 15.00, 15.01, 15.00, 14.86, 14.81, 14.74, 14.56, 14.39, 13.97, 
-        13.91, 13.75, 13.61, 13.29, 13.23
-    ]
-}
-
-  # SACCO data
-    sacco_data = {
-    'Name': [
-        'MWALIMU NATIONAL', 'STIMA DT', 'KENYA NATIONAL POLICE DT', 'HARAMBEE', 'TOWER',
-        'AFYA', 'UNAITAS', 'IMARISHA', 'UNITED NATIONS DT', 'UKULIMA',
-        'HAZINA', 'GUSII MWALIMU', 'INVEST AND GROW', 'MENTOR', 'IMARIKA',
-        'BANDARI DT', 'TRANSNATION', 'SAFARICOM', 'BORESHA', 'WINAS',
-        'NEWFORTIS', 'KIMISITU'
-    ],
-    'Total_Assets': [
-        66.43, 59.15, 54.24, 38.57, 23.23,
-        22.79, 22.70, 21.78, 18.21, 15.18,
-        14.76, 14.30, 14.06, 13.47, 13.11,
-        12.68, 12.02, 11.72, 11.25, 11.28,
-        10.67, 11.07
-    ]
-}
-
-    
-    return pd.DataFrame(mmf_data), pd.DataFrame(sacco_data)
+    mmf_data, sacco_data, _, _ = load_new_customer_data()
+    return mmf_data, sacco_data
 
 def calculate_risk_score(answers):
     score = 0
@@ -0,0 +1,258 @@
+"""
+New-customer advisory logic: market data, questionnaire risk scoring and
+allocation recommendations. Kept free of Streamlit so the app, batch jobs and
+the scoring service share one implementation.
+
+Usage:
+    python advisor.py responses.csv --output risk_scores.csv
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from leaderboards import top_providers
+from market_data import market_snapshot
+
+
+def load_new_customer_data(snapshot=None):
+    """
+    MMF, SACCO, dollar-fund and fixed-deposit tables of the current market snapshot
+    """
+    frames = (snapshot or market_snapshot())['frames']
+    return frames['mmf'], frames['sacco'], frames['dollar_funds'], frames['fixed_deposits']
+
+
+# Questionnaire answer weights; unknown answers weigh 0
+DURATION_WEIGHTS = {
+    'Less than 1 year': 1,
+    '1-3 years': 2,
+    '3-5 years': 3,
+    'More than 5 years': 4
+}
+WITHDRAWAL_WEIGHTS = {
+    'Very frequently (weekly)': 1,
+    'Frequently (monthly)': 2,
+    'Occasionally (quarterly)': 3,
+    'Rarely (yearly or less)': 4
+}
+RISK_WEIGHTS = {
+    'Very Low': 1,
+    'Low': 2,
+    'Medium': 3,
+    'High': 4,
+    'Very High': 5
+}
+EMERGENCY_FUND_PENALTY = 2
+
+# Upper score bound of each risk profile get_investment_recommendations distinguishes
+RISK_PROFILE_BOUNDS = [5, 8, 12]
+RISK_PROFILES = ['Very Conservative', 'Conservative', 'Balanced', 'Aggressive']
+
+
+def calculate_risk_score(answers):
+    """
+    Calculate risk score for new customers based on their answers
+    """
+    score = 0
+    score += DURATION_WEIGHTS.get(answers['investment_duration'], 0)
+    
+    if answers['emergency_fund'] == 'Yes':
+        score -= EMERGENCY_FUND_PENALTY
+    
+    score += WITHDRAWAL_WEIGHTS.get(answers['withdrawal_frequency'], 0)
+    score += RISK_WEIGHTS.get(answers['risk_appetite'], 0) * 2
+    
+    return score
+
+
+def _answer_weights(values, weights):
+    """
+    Weight of every answer in `values`: each distinct answer is looked up
+    once and the weights are gathered through its codes (a missing answer
+    has code -1, which picks the trailing 0)
+    """
+    values = values.array if isinstance(values, pd.Series) else values
+    if isinstance(values, pd.Categorical):
+        codes, uniques = values.codes, values.categories
+    else:
+        codes, uniques = pd.factorize(np.asarray(values, dtype=object))
+    table = np.array([weights.get(value, 0) for value in uniques] + [0], dtype=np.int64)
+    return table[codes]
+
+
+def calculate_risk_scores(answers):
+    """
+    calculate_risk_score for every row of a DataFrame (or dict of columns)
+    of questionnaire answers at once. Returns an int64 array.
+    """
+    scores = _answer_weights(answers['investment_duration'], DURATION_WEIGHTS)
+    scores -= EMERGENCY_FUND_PENALTY * _answer_weights(answers['emergency_fund'], {'Yes': 1})
+    scores += _answer_weights(answers['withdrawal_frequency'], WITHDRAWAL_WEIGHTS)
+    scores += _answer_weights(answers['risk_appetite'], RISK_WEIGHTS) * 2
+    return scores
+
+
+def risk_profiles(scores):
+    """
+    Risk profile name of every score (<=5, <=8, <=12, >12)
+    """
+    buckets = np.searchsorted(RISK_PROFILE_BOUNDS, scores, side='left')
+    return np.array(RISK_PROFILES, dtype=object)[buckets]
+
+
+def get_investment_recommendations(risk_score, investment_amount, currency, loan_access, snapshot=None):
+    """
+    Get investment recommendations based on risk score, investment amount, currency, and loan needs.
+    Providers are read from the leaderboards of `snapshot` (default: the current market snapshot).
+    """
+    leaderboards = (snapshot or market_snapshot())['leaderboards']
+    recommendations = []
+    products_recommended = set()
+    
+    # Top 2 providers per category, ranked once per market snapshot
+    top_2_mmf = top_providers(leaderboards, 'mmf', 'Return')
+    top_2_saccos = top_providers(leaderboards, 'sacco', 'Total_Assets')
+    top_2_fixed_deposits = top_providers(leaderboards, 'fixed_deposits', 'Rate')
+    top_2_dollar_funds = top_providers(leaderboards, 'dollar_funds', 'Rate')
+
+    # Currency-specific recommendations
+    if currency == 'USD' and 'Dollar Funds' not in products_recommended:
+        recommendations.append({
+            'product': 'Dollar Funds',
+            'allocation': 50,
+            'description': 'USD Investment with top-performing providers',
+            'recommended_providers': top_2_dollar_funds
+        })
+        products_recommended.add('Dollar Funds')
+    
+    # Loan access recommendations
+    if loan_access and 'SACCOs' not in products_recommended:
+        recommendations.append({
+            'product': 'SACCOs',
+            'allocation': 30,
+            'description': 'Loan access with top SACCOs',
+            'recommended_providers': top_2_saccos
+        })
+        products_recommended.add('SACCOs')
+    
+    # Very Conservative Risk Profile (risk_score <= 5)
+    if risk_score <= 5:
+        if 'Money Market Funds' not in products_recommended:
+            recommendations.append({
+                'product': 'Money Market Funds',
+                'allocation': 70,
+                'description': 'Low risk, high liquidity with top-performing funds',
+                'recommended_providers': top_2_mmf
+            })
+            products_recommended.add('Money Market Funds')
+        if 'Fixed Deposits' not in products_recommended:
+            recommendations.append({
+                'product': 'Fixed Deposits',
+                'allocation': 30,
+                'description': 'Low risk, stable returns',
+                'recommended_providers': top_2_fixed_deposits
+            })
+            products_recommended.add('Fixed Deposits')
+    
+    # Conservative Risk Profile (5 < risk_score <= 8)
+    elif risk_score <= 8:
+        if 'Money Market Funds' not in products_recommended:
+            recommendations.append({
+                'product': 'Money Market Funds',
+                'allocation': 50,
+                'description': 'Low risk, high liquidity',
+                'recommended_providers': top_2_mmf
+            })
+            products_recommended.add('Money Market Funds')
+        if 'SACCOs' not in products_recommended:
+            recommendations.append({
+                'product': 'SACCOs',
+                'allocation': 30,
+                'description': 'Moderate risk, community-based investments',
+                'recommended_providers': top_2_saccos
+            })
+            products_recommended.add('SACCOs')
+        if 'Government Bonds' not in products_recommended:
+            recommendations.append({
+                'product': 'Government Bonds',
+                'allocation': 20,
+                'description': 'Low risk, fixed income',
+                'recommended_providers': ['Treasury Direct']
+            })
+            products_recommended.add('Government Bonds')
+    
+    # Balanced Risk Profile (8 < risk_score <= 12)
+    elif risk_score <= 12:
+        if 'Money Market Funds' not in products_recommended:
+            recommendations.append({
+                'product': 'Money Market Funds',
+                'allocation': 30,
+                'description': 'Low risk emergency fund allocation',
+                'recommended_providers': top_2_mmf
+            })
+            products_recommended.add('Money Market Funds')
+        if 'SACCOs' not in products_recommended:
+            recommendations.append({
+                'product': 'SACCOs',
+                'allocation': 30,
+                'description': 'Moderate risk community investments, loan access',
+                'recommended_providers': top_2_saccos
+            })
+            products_recommended.add('SACCOs')
+        if 'Equity Funds' not in products_recommended:
+            recommendations.append({
+                'product': 'Equity Funds',
+                'allocation': 40,
+                'description': 'Higher risk, growth potential',
+                'recommended_providers': ['Top performing equity funds']
+            })
+            products_recommended.add('Equity Funds')
+    
+    # Aggressive Risk Profile (risk_score > 12)
+    else:
+        if 'Equity Funds' not in products_recommended:
+            recommendations.append({
+                'product': 'Equity Funds',
+                'allocation': 60,
+                'description': 'High risk, high potential returns',
+                'recommended_providers': ['Leading equity funds']
+            })
+            products_recommended.add('Equity Funds')
+        if 'Fixed Deposits' not in products_recommended:
+            recommendations.append({
+                'product': 'Fixed Deposits',
+                'allocation': 30,
+                'description': 'Liquidity buffer',
+                'recommended_providers': top_2_fixed_deposits
+            })
+            products_recommended.add('Fixed Deposits')
+        if 'Dollar Funds' not in products_recommended:
+            recommendations.append({
+                'product': 'Dollar Funds',
+                'allocation': 10,
+                'description': 'Currency diversification',
+                'recommended_providers': top_2_dollar_funds
+            })
+            products_recommended.add('Dollar Funds')
+    
+    return recommendations
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Risk-score a file of questionnaire responses")
+    parser.add_argument('responses', help="CSV with investment_duration, emergency_fund, withdrawal_frequency and risk_appetite columns")
+    parser.add_argument('--output', default='risk_scores.csv', help="Where to write the scored responses")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    responses = pd.read_csv(args.responses, dtype=str, keep_default_na=False)
+    responses['risk_score'] = calculate_risk_scores(responses)
+    responses['risk_profile'] = risk_profiles(responses['risk_score'].to_numpy())
+    responses.to_csv(args.output, index=False)
+    print(f"Scored {len(responses):,} responses in {time.perf_counter() - start:.1f}s -> {args.output}")
+
+
+if __name__ == "__main__":
+    main()
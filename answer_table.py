@@ -0,0 +1,133 @@
+"""
+Materialized answers for the new-customer questionnaire.
+
+Every input of calculate_risk_score and get_investment_recommendations is a
+choice from a short list (640 combinations in all), so each market snapshot
+is compiled once into a dense array indexed by the answers. Serving is a
+lookup plus scaling the allocations by the amount; answers outside the
+lists fall back to evaluating the rules.
+
+Usage:
+    python answer_table.py      # compile for the current snapshot and print a summary
+"""
+import itertools
+import threading
+
+import numpy as np
+
+from advisor import calculate_risk_score, get_investment_recommendations
+from market_data import market_snapshot
+
+# Questionnaire options in the order the app offers them; the table's axes follow this order
+QUESTIONNAIRE_OPTIONS = {
+    'investment_duration': ['Less than 1 year', '1-3 years', '3-5 years', 'More than 5 years'],
+    'emergency_fund': ['Yes', 'No'],
+    'withdrawal_frequency': [
+        'Very frequently (weekly)', 'Frequently (monthly)',
+        'Occasionally (quarterly)', 'Rarely (yearly or less)'
+    ],
+    'risk_appetite': ['Very Low', 'Low', 'Medium', 'High', 'Very High'],
+    'currency': ['KES', 'USD'],
+    'loan_access': [False, True],
+}
+
+_compiled = None
+_lock = threading.Lock()
+
+
+def compile_answer_table(snapshot):
+    """
+    Evaluate the rules for every combination of answers against `snapshot`.
+
+    Returns {'snapshot', 'axes': {question: {option: position}}, 'risk_scores',
+    'plan_ids'} plus 'plans', the distinct recommendation lists that
+    'plan_ids' points into.
+    """
+    questions = list(QUESTIONNAIRE_OPTIONS)
+    shape = tuple(len(options) for options in QUESTIONNAIRE_OPTIONS.values())
+    risk_scores = np.empty(shape, dtype=np.int16)
+    plan_ids = np.empty(shape, dtype=np.int16)
+    plans = []
+    plan_keys = {}
+
+    for position in itertools.product(*(range(size) for size in shape)):
+        answers = {
+            question: QUESTIONNAIRE_OPTIONS[question][i]
+            for question, i in zip(questions, position)
+        }
+        risk_score = calculate_risk_score(answers)
+        plan = get_investment_recommendations(
+            risk_score, 0, answers['currency'], answers['loan_access'], snapshot=snapshot
+        )
+        key = repr(plan)
+        plan_ids[position] = plan_keys.setdefault(key, len(plans))
+        if plan_ids[position] == len(plans):
+            plans.append(plan)
+        risk_scores[position] = risk_score
+
+    return {
+        'snapshot': snapshot,
+        'axes': {
+            question: {option: i for i, option in enumerate(options)}
+            for question, options in QUESTIONNAIRE_OPTIONS.items()
+        },
+        'risk_scores': risk_scores,
+        'plan_ids': plan_ids,
+        'plans': plans,
+    }
+
+
+def answer_table(snapshot=None):
+    """
+    The compiled table for `snapshot` (default: the current market
+    snapshot), recompiled only when the snapshot changes
+    """
+    global _compiled
+    snapshot = snapshot or market_snapshot()
+    compiled = _compiled
+    if compiled is not None and compiled['snapshot'] is snapshot:
+        return compiled
+
+    with _lock:
+        compiled = _compiled
+        if compiled is None or compiled['snapshot'] is not snapshot:
+            compiled = compile_answer_table(snapshot)
+            _compiled = compiled
+    return compiled
+
+
+def answer_recommendations(answers, investment_amount, currency, loan_access, snapshot=None):
+    """
+    Risk score and allocation plan for one questionnaire, with each
+    recommendation's 'amount' filled in from `investment_amount`
+    """
+    table = answer_table(snapshot)
+    values = dict(answers, currency=currency, loan_access=bool(loan_access))
+    position = tuple(table['axes'][question].get(values.get(question)) for question in QUESTIONNAIRE_OPTIONS)
+
+    if None in position:
+        risk_score = calculate_risk_score(answers)
+        plan = get_investment_recommendations(
+            risk_score, investment_amount, currency, loan_access, snapshot=table['snapshot']
+        )
+    else:
+        risk_score = int(table['risk_scores'][position])
+        plan = table['plans'][table['plan_ids'][position]]
+
+    recommendations = []
+    for recommendation in plan:
+        recommendation = dict(recommendation)
+        recommendation['recommended_providers'] = list(recommendation['recommended_providers'])
+        recommendation['amount'] = investment_amount * recommendation['allocation'] / 100
+        recommendations.append(recommendation)
+    return risk_score, recommendations
+
+
+def main():
+    table = answer_table()
+    print(f"{table['plan_ids'].size} answer combinations, {len(table['plans'])} distinct plans, "
+          f"risk scores {table['risk_scores'].min()}..{table['risk_scores'].max()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,385 @@
+"""
+Versioned artifact bundle for the existing-customer recommender.
+
+A bundle is one directory holding everything the app needs, tied together by
+manifest.json (format version, build time, SHA-256 of every file, feature
+vocabulary and row counts):
+
+    artifacts/
+        CURRENT                 name of the active version
+        20241122T101500/
+            manifest.json
+            idf.npy             TF-IDF weights, vocabulary is in the manifest
+                                (absent when the bundle uses the one-hot feature encoder)
+            profiles_*.npy      distinct-profile CSR matrix (data, indices, indptr)
+            histograms.npy      product histogram per profile
+            row_profiles.npy    profile of every training row, in training order
+            row_labels.npy      product code of every training row
+            members/            columnar member table (see member_table.py)
+            member_store/       one record per member_no (see member_store.py)
+
+Array payloads are plain .npy files loaded with mmap_mode='r', so worker
+processes share the same pages instead of unpickling private copies.
+
+Usage:
+    python artifacts.py build --model model.pkl --tfidf tfidf.pkl --members investment_member.csv
+    python artifacts.py build --features onehot --members investment_member.csv
+    python artifacts.py build --features onehot --members investment_member.csv --events popularity_events.jsonl
+    python artifacts.py verify
+"""
+import argparse
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import threading
+from datetime import datetime, timezone
+
+import numpy as np
+import scipy.sparse as sp
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from feature_encoder import build_encoded_profile_index, fit_feature_encoder
+from knn_recommender import training_labels
+from member_store import STORE_COLUMNS, build_member_store, read_member_store, write_member_store
+from member_table import (
+    RULE_TABLE_COLUMNS, default_member_table, load_member_table, member_table_source,
+    read_member_table, write_member_table
+)
+from popularity_events import log_offset
+from popularity_index import build_popularity_index, load_popularity_index
+from profile_index import build_profile_index, profile_index_from_arrays
+
+BUNDLE_ROOT = 'artifacts'
+CURRENT_FILE = 'CURRENT'
+MANIFEST_FILE = 'manifest.json'
+FORMAT_VERSION = 1
+
+_loaded = None
+_lock = threading.Lock()
+
+# TfidfVectorizer settings needed to rebuild the transform without unpickling it
+TFIDF_PARAMS = [
+    'lowercase', 'token_pattern', 'ngram_range', 'analyzer', 'norm',
+    'use_idf', 'smooth_idf', 'sublinear_tf', 'max_features'
+]
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _bundle_files(bundle_dir):
+    """
+    Every payload file in a bundle, relative to the bundle directory
+    """
+    files = []
+    for directory, _, names in os.walk(bundle_dir):
+        for name in names:
+            relative = os.path.relpath(os.path.join(directory, name), bundle_dir)
+            if relative != MANIFEST_FILE:
+                files.append(relative.replace(os.sep, '/'))
+    return sorted(files)
+
+
+def current_version(root=BUNDLE_ROOT):
+    """
+    Name of the active bundle version, or None when no bundle has been published
+    """
+    try:
+        with open(os.path.join(root, CURRENT_FILE)) as file:
+            return file.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def publish_bundle(tfidf, profile_index, members, root=BUNDLE_ROOT, version=None, feature_encoder=None, lineage=None,
+                   events_offset=None):
+    """
+    Write a new bundle version and make it current. Features come from
+    `feature_encoder` when given (tfidf is then None), otherwise from `tfidf`.
+    `lineage` records which rows of `members` the profile index covers when
+    it was refreshed incrementally (see model_refresh.py). `events_offset`
+    is the purchase event log offset up to which the events are already
+    rows of `members` (see popularity_events.py).
+
+    The bundle is written to a temporary directory and renamed into place,
+    then CURRENT is swapped atomically, so readers only ever see complete
+    bundles. Returns the version name.
+    """
+    built_at = datetime.now(timezone.utc)
+    version = version or built_at.strftime('%Y%m%dT%H%M%S%f')
+    bundle_dir = os.path.join(root, version)
+    tmp_dir = os.path.join(root, f".{version}.tmp")
+    if os.path.exists(bundle_dir):
+        raise ValueError(f"Artifact version {version} already exists")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    profiles = sp.csr_matrix(profile_index['profiles'])
+    if feature_encoder is None:
+        np.save(os.path.join(tmp_dir, 'idf.npy'), np.asarray(tfidf.idf_, dtype=np.float64))
+    np.save(os.path.join(tmp_dir, 'profiles_data.npy'), profiles.data)
+    np.save(os.path.join(tmp_dir, 'profiles_indices.npy'), profiles.indices)
+    np.save(os.path.join(tmp_dir, 'profiles_indptr.npy'), profiles.indptr)
+    np.save(os.path.join(tmp_dir, 'histograms.npy'), np.asarray(profile_index['histograms']))
+    if profile_index.get('row_profiles') is not None:
+        np.save(os.path.join(tmp_dir, 'row_profiles.npy'), np.asarray(profile_index['row_profiles']))
+        np.save(os.path.join(tmp_dir, 'row_labels.npy'), np.asarray(profile_index['row_labels']))
+    write_member_table(members, os.path.join(tmp_dir, 'members'))
+    if all(column in members.columns for column in STORE_COLUMNS):
+        write_member_store(build_member_store(members), os.path.join(tmp_dir, 'member_store'))
+
+    manifest = {
+        'format_version': FORMAT_VERSION,
+        'version': version,
+        'built_at': built_at.isoformat(),
+        'profile_index': {
+            'profiles': profiles.shape[0],
+            'features': profiles.shape[1],
+            'training_rows': int(profile_index['counts'].sum()),
+            'products': [str(product) for product in profile_index['products']],
+        },
+        'member_table': {'rows': len(members)},
+        'files': {name: _sha256(os.path.join(tmp_dir, name)) for name in _bundle_files(tmp_dir)},
+    }
+    if feature_encoder is None:
+        params = {name: getattr(tfidf, name) for name in TFIDF_PARAMS}
+        params['ngram_range'] = list(params['ngram_range'])
+        manifest['feature_vocabulary'] = {
+            'params': params,
+            'vocabulary': {token: int(column) for token, column in tfidf.vocabulary_.items()},
+        }
+    else:
+        manifest['feature_encoder'] = feature_encoder
+    if lineage is not None:
+        manifest['lineage'] = lineage
+    if events_offset is not None:
+        manifest['events_offset'] = int(events_offset)
+    with open(os.path.join(tmp_dir, MANIFEST_FILE), 'w') as file:
+        json.dump(manifest, file, indent=2)
+
+    os.replace(tmp_dir, bundle_dir)
+    current_tmp = os.path.join(root, f"{CURRENT_FILE}.tmp")
+    with open(current_tmp, 'w') as file:
+        file.write(version)
+    os.replace(current_tmp, os.path.join(root, CURRENT_FILE))
+    return version
+
+
+def build_bundle(model, tfidf, members, root=BUNDLE_ROOT, version=None, events_offset=None):
+    """
+    Publish a bundle from the notebook's outputs (fitted NearestNeighbors,
+    TfidfVectorizer and the member table they were trained on)
+    """
+    profile_index = build_profile_index(model, training_labels(model, members))
+    return publish_bundle(tfidf, profile_index, members, root=root, version=version, events_offset=events_offset)
+
+
+def build_encoded_bundle(members, root=BUNDLE_ROOT, version=None, events_offset=None):
+    """
+    Publish a bundle that uses the one-hot feature encoder, fitted and
+    indexed on the notebook's training split of `members`
+    """
+    feature_encoder = fit_feature_encoder(members)
+    profile_index = build_encoded_profile_index(feature_encoder, members)
+    return publish_bundle(
+        None, profile_index, members, root=root, version=version, feature_encoder=feature_encoder,
+        events_offset=events_offset
+    )
+
+
+def restore_tfidf(feature_vocabulary, idf):
+    """
+    TfidfVectorizer from its TFIDF_PARAMS settings and vocabulary
+    ({'params', 'vocabulary'}) and idf weights, without unpickling it
+    """
+    params = dict(feature_vocabulary['params'])
+    params['ngram_range'] = tuple(params['ngram_range'])
+    tfidf = TfidfVectorizer(**params)
+    tfidf.vocabulary_ = dict(feature_vocabulary['vocabulary'])
+    tfidf.idf_ = np.asarray(idf)
+    return tfidf
+
+
+def verify_bundle(bundle_dir, manifest):
+    """
+    Refuse a bundle whose files or components do not match its manifest
+    """
+    if manifest.get('format_version') != FORMAT_VERSION:
+        raise ValueError(f"Unsupported artifact format {manifest.get('format_version')} in {bundle_dir}")
+
+    files = _bundle_files(bundle_dir)
+    if sorted(manifest['files']) != files:
+        raise ValueError(f"Files in {bundle_dir} do not match its manifest")
+    for name, expected in manifest['files'].items():
+        if _sha256(os.path.join(bundle_dir, name)) != expected:
+            raise ValueError(f"Checksum mismatch for {name} in {bundle_dir}")
+
+
+def load_bundle(root=BUNDLE_ROOT, version=None, verify=True):
+    """
+    Load a bundle (default: the current version) with its arrays memory-mapped.
+
+    Raises ValueError when the files fail their checksums or the components
+    disagree with each other: TF-IDF vocabulary or feature encoder vs. profile width, training rows vs.
+    histograms, or member rows vs. the manifest.
+    """
+    version = version or current_version(root)
+    if version is None:
+        raise ValueError(f"No artifact bundle has been published under {root}")
+    bundle_dir = os.path.join(root, version)
+    with open(os.path.join(bundle_dir, MANIFEST_FILE)) as file:
+        manifest = json.load(file)
+    if verify:
+        verify_bundle(bundle_dir, manifest)
+
+    def array(name):
+        return np.load(os.path.join(bundle_dir, f"{name}.npy"), mmap_mode='r')
+
+    spec = manifest['profile_index']
+    profiles = sp.csr_matrix(
+        (array('profiles_data'), array('profiles_indices'), array('profiles_indptr')),
+        shape=(spec['profiles'], spec['features'])
+    )
+    histograms = array('histograms')
+
+    feature_encoder = manifest.get('feature_encoder')
+    if feature_encoder is not None:
+        tfidf = None
+        if spec['features'] != feature_encoder['n_features']:
+            raise ValueError(f"Profile index and feature encoder disagree in {bundle_dir}")
+    else:
+        vocabulary_size = len(manifest['feature_vocabulary']['vocabulary'])
+        idf = array('idf')
+        if spec['features'] != vocabulary_size or len(idf) != vocabulary_size:
+            raise ValueError(f"Profile index and TF-IDF vocabulary disagree in {bundle_dir}")
+        tfidf = restore_tfidf(manifest['feature_vocabulary'], idf)
+
+    if int(histograms.sum()) != spec['training_rows'] or histograms.shape != (spec['profiles'], len(spec['products'])):
+        raise ValueError(f"Profile histograms do not match the manifest in {bundle_dir}")
+    # Bundles published before the per-row arrays were stored rank by expected votes
+    row_profiles = row_labels = None
+    if os.path.exists(os.path.join(bundle_dir, 'row_profiles.npy')):
+        row_profiles, row_labels = array('row_profiles'), array('row_labels')
+        if len(row_profiles) != spec['training_rows'] or len(row_labels) != spec['training_rows']:
+            raise ValueError(f"Per-row profile arrays do not match the manifest in {bundle_dir}")
+
+    members = read_member_table(os.path.join(bundle_dir, 'members'), columns=RULE_TABLE_COLUMNS)
+    if len(members) != manifest['member_table']['rows']:
+        raise ValueError(f"Member table does not match the manifest in {bundle_dir}")
+    # Bundles built from a member table without the profile columns have no store
+    member_store_dir = os.path.join(bundle_dir, 'member_store')
+    member_store = read_member_store(member_store_dir) if os.path.isdir(member_store_dir) else None
+
+    return {
+        'manifest': manifest,
+        'tfidf': tfidf,
+        'feature_encoder': feature_encoder,
+        'profile_index': profile_index_from_arrays(
+            profiles, histograms, spec['products'], row_profiles=row_profiles, row_labels=row_labels
+        ),
+        'members': members,
+        'member_store': member_store,
+        'popularity_index': build_popularity_index(members),
+    }
+
+
+def artifacts_signature(root=BUNDLE_ROOT):
+    """
+    What load_artifacts(root) would load: the current bundle version, or the
+    (path, mtime_ns, size) of the legacy pickles and member table
+    """
+    version = current_version(root)
+    if version is not None:
+        return ('bundle', root, version)
+
+    signature = ['legacy']
+    for path in ('model.pkl', 'tfidf.pkl', member_table_source(default_member_table())):
+        stat = os.stat(path)
+        signature.append((path, stat.st_mtime_ns, stat.st_size))
+    return tuple(signature)
+
+
+def load_artifacts(root=BUNDLE_ROOT):
+    """
+    Everything the existing-customer recommender needs: the current bundle
+    when one is published, otherwise the legacy model.pkl / tfidf.pkl pickles
+    and member table. 'signature' records which of them was loaded.
+    """
+    signature = artifacts_signature(root)
+    if signature[0] == 'bundle':
+        return dict(load_bundle(root, signature[2]), signature=signature)
+
+    with open('model.pkl', 'rb') as file:
+        model = pickle.load(file)
+    with open('tfidf.pkl', 'rb') as file:
+        tfidf = pickle.load(file)
+    member_table = default_member_table()
+    members = load_member_table(member_table, columns=RULE_TABLE_COLUMNS)
+    return {
+        'signature': signature,
+        'manifest': None,
+        'tfidf': tfidf,
+        'feature_encoder': None,
+        'profile_index': build_profile_index(model, training_labels(model, members)),
+        'members': members,
+        'member_store': None,
+        'popularity_index': load_popularity_index(members, member_table_source(member_table)),
+    }
+
+
+def current_artifacts(root=BUNDLE_ROOT):
+    """
+    The loaded artifacts for `root`, reloaded only when a new bundle is
+    published or the legacy files change
+    """
+    global _loaded
+    signature = artifacts_signature(root)
+    loaded = _loaded
+    if loaded is not None and loaded['signature'] == signature:
+        return loaded
+
+    with _lock:
+        loaded = _loaded
+        if loaded is None or loaded['signature'] != artifacts_signature(root):
+            loaded = load_artifacts(root)
+            _loaded = loaded
+    return loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or verify the recommender artifact bundle")
+    parser.add_argument('command', choices=['build', 'verify'])
+    parser.add_argument('--root', default=BUNDLE_ROOT)
+    parser.add_argument('--model', default='model.pkl')
+    parser.add_argument('--tfidf', default='tfidf.pkl')
+    parser.add_argument('--members', default='investment_member.csv')
+    parser.add_argument('--features', choices=['tfidf', 'onehot'], default='tfidf',
+                        help="tfidf: model.pkl/tfidf.pkl as trained by the notebook; onehot: direct feature encoder")
+    parser.add_argument('--events', help="Purchase event log whose events so far are already rows of --members")
+    args = parser.parse_args()
+
+    events_offset = log_offset(args.events) if args.events else None
+    if args.command == 'build' and args.features == 'onehot':
+        version = build_encoded_bundle(load_member_table(args.members), root=args.root, events_offset=events_offset)
+        print(f"Published artifact version {version} under {args.root}/")
+    elif args.command == 'build':
+        with open(args.model, 'rb') as file:
+            model = pickle.load(file)
+        with open(args.tfidf, 'rb') as file:
+            tfidf = pickle.load(file)
+        version = build_bundle(model, tfidf, load_member_table(args.members), root=args.root, events_offset=events_offset)
+        print(f"Published artifact version {version} under {args.root}/")
+    else:
+        bundle = load_bundle(args.root)
+        print(f"Artifact version {bundle['manifest']['version']} verified")
+
+
+if __name__ == "__main__":
+    main()
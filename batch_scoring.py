@@ -0,0 +1,352 @@
+"""
+Headless batch scoring for existing customers.
+
+Usage:
+    python batch_scoring.py --members investment_member.csv --output recommendations.csv --n 3
+    python batch_scoring.py --knn   # also fill open slots from the KNN neighbour vote
+    python batch_scoring.py --workers 0 --shard-by town   # score shards in a process pool, one worker per core
+    python batch_scoring.py --per-member   # one row per member, over all of its beneficiaries
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from multiprocessing import get_context, shared_memory
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from artifacts import BUNDLE_ROOT, TFIDF_PARAMS, load_artifacts, restore_tfidf
+from feature_encoder import member_features
+from knn_recommender import FEATURE_COLUMNS, knn_rank_members
+from member_store import STORE_COLUMNS, build_member_store
+from member_table import code_dtype, load_member_table
+from profile_index import profile_index_from_arrays, profile_rank_products
+from recommender import RULE_COLUMNS, recommend_batch, recommend_store
+
+# Separators used to flatten the list columns into a single CSV cell
+PRODUCT_SEPARATOR = '; '
+MESSAGE_SEPARATOR = ' | '
+
+SHARD_KEYS = ['town', 'member']
+# Popularity segments the rules read
+RULE_SEGMENTS = ['age_group', 'town']
+
+# Per-process state of a parallel scoring worker, set by _init_worker
+_worker = {}
+
+
+def _score_frame(members, artifacts, n, use_knn):
+    """
+    recommend_batch on a loaded member table, with the list columns flattened for CSV
+    """
+    knn_products = None
+    if use_knn:
+        rank_features = partial(profile_rank_products, artifacts['profile_index'])
+        knn_products = knn_rank_members(rank_features, partial(member_features, artifacts), members)
+
+    scored = recommend_batch(members, artifacts['popularity_index'], n=n, knn_products=knn_products)
+    scored['recommended_products'] = scored['recommended_products'].str.join(PRODUCT_SEPARATOR)
+    scored['messages'] = scored['messages'].str.join(MESSAGE_SEPARATOR)
+    return scored
+
+
+def _scoring_columns(use_knn):
+    return RULE_COLUMNS + [c for c in FEATURE_COLUMNS if use_knn and c not in RULE_COLUMNS]
+
+
+def score_members(members_path, output_path, n=5, use_knn=False, artifacts_root=BUNDLE_ROOT):
+    """
+    Write recommendations and messages for every row of `members_path`
+    (a CSV file or a columnar member table directory). Popularity rankings
+    and the KNN stage come from the same artifacts the app loads.
+    """
+    members = load_member_table(members_path, columns=_scoring_columns(use_knn))
+    artifacts = load_artifacts(artifacts_root)
+    scored = _score_frame(members, artifacts, n, use_knn)
+    scored.to_csv(output_path, index=False)
+    return scored
+
+
+def score_member_records(members_path, output_path, n=5, artifacts_root=BUNDLE_ROOT):
+    """
+    Write one row of recommendations per member of `members_path`, with the
+    member's rows collapsed into a member store record first (see
+    recommender.recommend_store). Returns the number of members written.
+    """
+    store = build_member_store(load_member_table(members_path, columns=STORE_COLUMNS))
+    artifacts = load_artifacts(artifacts_root)
+    scored = recommend_store(store, artifacts['popularity_index'], n=n)
+    scored['recommended_products'] = scored['recommended_products'].str.join(PRODUCT_SEPARATOR)
+    scored['messages'] = scored['messages'].str.join(MESSAGE_SEPARATOR)
+    scored.to_csv(output_path, index=False)
+    return len(scored)
+
+
+def shard_members(members, shards, by='town'):
+    """
+    Row order and boundaries that split `members` into about `shards`
+    contiguous pieces of similar size, never splitting a member's rows.
+
+    by='town' orders members by the town of their first row, so each shard
+    holds a few whole towns (large towns span several shards); by='member'
+    orders them by a hash of member_no. Returns (order, bounds) with shard
+    i covering members.iloc[order[bounds[i]:bounds[i + 1]]].
+    """
+    if by not in SHARD_KEYS:
+        raise ValueError(f"Unknown shard key {by!r}, expected one of {SHARD_KEYS}")
+    member_codes = pd.factorize(members['member_no'])[0]
+    if by == 'town':
+        town_codes = pd.factorize(members['town'], use_na_sentinel=False)[0]
+        first_rows = np.unique(member_codes, return_index=True)[1]
+        key = town_codes[first_rows][member_codes]
+    else:
+        key = pd.util.hash_array(np.asarray(members['member_no']))
+
+    order = np.lexsort((member_codes, key))
+    ordered = member_codes[order]
+    member_starts = np.flatnonzero(np.concatenate([[True], ordered[1:] != ordered[:-1]]))
+    targets = np.linspace(0, len(order), shards + 1)[1:-1]
+    cuts = np.concatenate([member_starts, [len(order)]])[np.searchsorted(member_starts, targets)]
+    bounds = np.unique(np.concatenate([[0], cuts, [len(order)]]))
+    return order, bounds
+
+
+def _share_arrays(arrays):
+    """
+    Copy `arrays` (name -> ndarray) into one shared memory block. Returns the
+    block and the layout workers need to map views onto it.
+    """
+    arrays = {name: np.ascontiguousarray(values) for name, values in arrays.items()}
+    layout = {}
+    size = 0
+    for name, values in arrays.items():
+        size = -(-size // 64) * 64
+        layout[name] = (size, values.dtype.str, values.shape)
+        size += values.nbytes
+    block = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    for name, values in arrays.items():
+        offset, dtype, shape = layout[name]
+        np.ndarray(shape, dtype=dtype, buffer=block.buf, offset=offset)[...] = values
+    return block, layout
+
+
+def _attach_arrays(block_name, layout):
+    block = shared_memory.SharedMemory(name=block_name)
+    arrays = {
+        name: np.ndarray(shape, dtype=dtype, buffer=block.buf, offset=offset)
+        for name, (offset, dtype, shape) in layout.items()
+    }
+    return block, arrays
+
+
+class _SharedRankings:
+    """
+    Ranked products per key of one popularity segment, read straight from
+    shared arrays: the keys sorted as fixed-width strings and each key's
+    ranking as product codes padded with -1. Answers the .get() that
+    popularity_index.ranked_products makes, without building the dict.
+    """
+
+    def __init__(self, keys, ranks, products):
+        self._keys = keys
+        self._ranks = ranks
+        self._products = products
+
+    def get(self, key, default=None):
+        if not isinstance(key, str):
+            return default
+        row = int(np.searchsorted(self._keys, key))
+        if row == len(self._keys) or self._keys[row] != key:
+            return default
+        return [self._products[code] for code in self._ranks[row] if code >= 0]
+
+
+def _shared_tables(members, order, artifacts, use_knn):
+    """
+    Arrays to place in shared memory (member columns in shard order as
+    codes or numbers, popularity keys and rankings as product codes, the
+    profile index and TF-IDF vocabulary and weights) plus the small
+    metadata needed to read them back
+    """
+    arrays = {}
+    columns = {}
+    for column in members.columns:
+        values = members[column]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            codes, categories = values.cat.codes.to_numpy(), values.cat.categories.tolist()
+        elif values.dtype.kind in 'iufb':
+            codes, categories = values.to_numpy(), None
+        else:
+            codes, categories = pd.factorize(values)
+            categories = categories.tolist()
+        if categories is not None:
+            codes = codes.astype(code_dtype(categories))
+        arrays[f"column_{column}"] = codes[order]
+        columns[column] = categories
+
+    popularity_index = artifacts['popularity_index']
+    products = sorted({p for segment in RULE_SEGMENTS for ranked in popularity_index[segment].values() for p in ranked})
+    positions = {product: code for code, product in enumerate(products)}
+    for segment in RULE_SEGMENTS:
+        keys = sorted(popularity_index[segment])
+        ranks = np.full((len(keys), len(products)), -1, dtype=np.int8)
+        for row, key in enumerate(keys):
+            ranked = [positions[product] for product in popularity_index[segment][key]]
+            ranks[row, :len(ranked)] = ranked
+        arrays[f"popularity_keys_{segment}"] = np.array(keys, dtype=str)
+        arrays[f"popularity_{segment}"] = ranks
+
+    tables = {
+        'columns': columns,
+        'popularity': {'products': products},
+        'feature_encoder': artifacts.get('feature_encoder'),
+        'tfidf': None,
+    }
+    if use_knn:
+        profile_index = artifacts['profile_index']
+        profiles = sp.csr_matrix(profile_index['profiles'])
+        arrays.update(
+            profiles_data=profiles.data, profiles_indices=profiles.indices, profiles_indptr=profiles.indptr,
+            histograms=np.asarray(profile_index['histograms']),
+        )
+        if profile_index.get('row_profiles') is not None:
+            arrays.update(row_profiles=profile_index['row_profiles'], row_labels=profile_index['row_labels'])
+        tables['profile_index'] = {'shape': profiles.shape, 'products': list(profile_index['products'])}
+        if artifacts.get('feature_encoder') is None:
+            tfidf = artifacts['tfidf']
+            tokens = np.empty(len(tfidf.vocabulary_), dtype=object)
+            for token, column in tfidf.vocabulary_.items():
+                tokens[column] = token
+            arrays.update(tfidf_tokens=np.array(tokens.tolist(), dtype=str), tfidf_idf=np.asarray(tfidf.idf_))
+            tables['tfidf'] = {name: getattr(tfidf, name) for name in TFIDF_PARAMS}
+    return arrays, tables
+
+
+def _init_worker(block_name, layout, tables, n, use_knn):
+    block, arrays = _attach_arrays(block_name, layout)
+    products = tables['popularity']['products']
+    popularity_index = {
+        segment: _SharedRankings(arrays[f"popularity_keys_{segment}"], arrays[f"popularity_{segment}"], products)
+        for segment in RULE_SEGMENTS
+    }
+    artifacts = {
+        'popularity_index': popularity_index,
+        'feature_encoder': tables['feature_encoder'],
+        'tfidf': None,
+    }
+    if tables['tfidf'] is not None:
+        vocabulary = {token: column for column, token in enumerate(arrays['tfidf_tokens'].tolist())}
+        artifacts['tfidf'] = restore_tfidf({'params': tables['tfidf'], 'vocabulary': vocabulary}, arrays['tfidf_idf'])
+    if use_knn:
+        spec = tables['profile_index']
+        profiles = sp.csr_matrix(
+            (arrays['profiles_data'], arrays['profiles_indices'], arrays['profiles_indptr']), shape=spec['shape']
+        )
+        artifacts['profile_index'] = profile_index_from_arrays(
+            profiles, arrays['histograms'], spec['products'],
+            row_profiles=arrays.get('row_profiles'), row_labels=arrays.get('row_labels')
+        )
+    # The block must stay open for as long as the views onto it are in use
+    _worker.update(block=block, arrays=arrays, columns=tables['columns'], artifacts=artifacts, n=n, use_knn=use_knn)
+
+
+def _score_shard(start, end, part_path):
+    arrays = _worker['arrays']
+    data = {}
+    for column, categories in _worker['columns'].items():
+        values = arrays[f"column_{column}"][start:end]
+        data[column] = values if categories is None else pd.Categorical.from_codes(values, categories=categories)
+    scored = _score_frame(pd.DataFrame(data), _worker['artifacts'], _worker['n'], _worker['use_knn'])
+    scored.to_csv(part_path, header=False, index=False)
+    return len(scored)
+
+
+def score_members_parallel(members_path, output_path, n=5, use_knn=False, artifacts_root=BUNDLE_ROOT,
+                           workers=None, shards=None, shard_by='town'):
+    """
+    score_members across a pool of `workers` processes (default, and at
+    most: one per core), with the member table split by shard_members into
+    `shards` pieces (default: one per worker).
+
+    The member columns and lookup tables are copied into shared memory once
+    and every worker maps them, rather than receiving pickled copies. Each
+    shard is written to its own part file and the parts are concatenated
+    into `output_path`, so rows come out grouped by shard rather than in
+    file order. Returns the number of rows written.
+    """
+    cores = os.cpu_count() or 1
+    workers = min(workers or cores, cores)
+    shards = shards or workers
+    members = load_member_table(members_path, columns=_scoring_columns(use_knn))
+    artifacts = load_artifacts(artifacts_root)
+    order, bounds = shard_members(members, shards, by=shard_by)
+    arrays, tables = _shared_tables(members, order, artifacts, use_knn)
+    header = pd.DataFrame(columns=list(members.columns) + ['recommended_products', 'messages'])
+    del members, order
+
+    block, layout = _share_arrays(arrays)
+    del arrays
+    part_dir = tempfile.mkdtemp(prefix='.scoring-', dir=os.path.dirname(os.path.abspath(output_path)))
+    try:
+        part_paths = [os.path.join(part_dir, f"part-{i:05d}.csv") for i in range(len(bounds) - 1)]
+        with ProcessPoolExecutor(
+            max_workers=workers, mp_context=get_context('spawn'),
+            initializer=_init_worker, initargs=(block.name, layout, tables, n, use_knn)
+        ) as pool:
+            futures = [
+                pool.submit(_score_shard, int(start), int(end), part_path)
+                for start, end, part_path in zip(bounds[:-1], bounds[1:], part_paths)
+            ]
+            rows = sum(future.result() for future in futures)
+
+        tmp_path = f"{output_path}.tmp"
+        header.to_csv(tmp_path, index=False)
+        with open(tmp_path, 'ab') as output:
+            for part_path in part_paths:
+                with open(part_path, 'rb') as part:
+                    shutil.copyfileobj(part, output, 1 << 20)
+        os.replace(tmp_path, output_path)
+    finally:
+        block.close()
+        block.unlink()
+        shutil.rmtree(part_dir, ignore_errors=True)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score every member in a member file")
+    parser.add_argument('--members', default='investment_member.csv', help="Member file to score")
+    parser.add_argument('--output', default='recommendations.csv', help="Where to write the results")
+    parser.add_argument('--artifacts', default=BUNDLE_ROOT, help="Artifact bundle root")
+    parser.add_argument('--n', type=int, default=5, help="Number of recommendations per member")
+    parser.add_argument('--knn', action='store_true', help="Fill open slots from the KNN model")
+    parser.add_argument('--per-member', action='store_true',
+                        help="One row per member, with the beneficiary rule over all of its beneficiaries")
+    parser.add_argument('--workers', type=int, default=1, help="Worker processes (0: one per core; capped at the core count)")
+    parser.add_argument('--shards', type=int, help="Shards to split the members into (default: one per worker)")
+    parser.add_argument('--shard-by', choices=SHARD_KEYS, default='town', help="How members are split into shards")
+    args = parser.parse_args()
+
+    if args.per_member and (args.knn or args.workers != 1):
+        parser.error("--per-member does not support --knn or --workers")
+
+    start = time.perf_counter()
+    if args.per_member:
+        rows = score_member_records(args.members, args.output, n=args.n, artifacts_root=args.artifacts)
+    elif args.workers == 1:
+        rows = len(score_members(args.members, args.output, n=args.n, use_knn=args.knn, artifacts_root=args.artifacts))
+    else:
+        rows = score_members_parallel(
+            args.members, args.output, n=args.n, use_knn=args.knn, artifacts_root=args.artifacts,
+            workers=args.workers or None, shards=args.shards, shard_by=args.shard_by
+        )
+    print(f"Scored {rows:,} rows in {time.perf_counter() - start:.1f}s -> {args.output}")
+
+
+if __name__ == "__main__":
+    main()
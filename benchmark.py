@@ -0,0 +1,320 @@
+"""
+Benchmarks for the recommender hot paths.
+
+Every member-table size runs in a fresh process against a synthetic table
+(synthetic_data.py) and a one-off artifact bundle built from it, so peak
+RSS is per size:
+
+    load_artifacts                  load_existing_customer_models (bundle load + checks)
+    get_recommendations_with_messages   one member through the rules
+    knn_query / tfidf_knn_query     one member through featurize + profile-index search
+    knn_batch                       4,096 members per call
+    calculate_risk_score, get_investment_recommendations, answer_recommendations
+                                    (independent of the member table, run once)
+
+Each benchmark is timed as several samples, each a batch of calls long
+enough for the timer and scheduler noise to wash out; the per-call time of
+a sample is its wall time over its calls. One more pass over the inputs
+times every call on its own for the latency distribution. Results are
+written as JSON (best and median batched time per call, p50/p99 single-call
+latency, throughput, peak RSS per benchmark) so runs can be compared across
+commits; --compare fails when a benchmark's batched median slowed down by
+more than --threshold percent and by more than --noise-floor milliseconds
+per call, or when the baseline has no median to compare against.
+
+Usage:
+    python benchmark.py --sizes 10000 120000 1000000 10000000 --output bench.json
+    python benchmark.py --sizes 10000 --compare bench.json --threshold 10 --noise-floor 0.05
+"""
+import argparse
+import json
+import math
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from multiprocessing import get_context
+
+import numpy as np
+import pandas as pd
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.model_selection import train_test_split
+
+from advisor import calculate_risk_score, calculate_risk_scores, get_investment_recommendations
+from answer_table import QUESTIONNAIRE_OPTIONS, answer_recommendations
+from artifacts import build_encoded_bundle, load_bundle
+from feature_encoder import member_data_features
+from knn_recommender import member_feature_strings
+from market_data import market_snapshot
+from profile_index import profile_index_from_features, profile_rank_products
+from recommender import get_recommendations_with_messages
+from synthetic_data import PRODUCTS, synthetic_members
+
+DEFAULT_SIZES = [10_000, 120_000, 1_000_000, 10_000_000]
+# Distinct inputs sampled per benchmark; timed batches cycle through them
+DEFAULT_CALLS = 2000
+# Timed samples per benchmark, and the shortest wall time of one sample
+DEFAULT_REPEATS = 5
+MIN_SAMPLE_SECONDS = 0.2
+# Per-call slowdowns below this are treated as noise by --compare
+NOISE_FLOOR_MS = 0.05
+KNN_BATCH_SIZE = 4096
+# Rows the benchmark TF-IDF vocabulary is fitted on
+TFIDF_SAMPLE_ROWS = 100_000
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _time_calls(fn, inputs, start, calls):
+    """
+    Wall time of `calls` calls of fn, cycling through `inputs` from position `start`
+    """
+    began = time.perf_counter()
+    for i in range(start, start + calls):
+        fn(inputs[i % len(inputs)])
+    return time.perf_counter() - began
+
+
+def _call_latencies(fn, inputs):
+    """
+    Wall time of every call of fn over one pass of `inputs`, in seconds
+    """
+    latencies = np.empty(len(inputs))
+    for i, value in enumerate(inputs):
+        began = time.perf_counter()
+        fn(value)
+        latencies[i] = time.perf_counter() - began
+    return latencies
+
+
+def measure(name, rows, fn, inputs, items_per_call=1, repeats=DEFAULT_REPEATS):
+    """
+    Time fn over `inputs`: one untimed warm-up call, then `repeats` samples
+    of a batch of calls sized to take at least MIN_SAMPLE_SECONDS, then one
+    pass timing each call. Returns the benchmark's result row with the best
+    and median batched time per call and the p50/p99 single-call latency.
+    """
+    inputs = list(inputs)
+    fn(inputs[0])
+    probe = min(len(inputs), 10)
+    per_call = _time_calls(fn, inputs, 0, probe) / probe
+    batch = max(1, math.ceil(MIN_SAMPLE_SECONDS / max(per_call, 1e-9)))
+    samples = np.array([_time_calls(fn, inputs, i * batch, batch) / batch for i in range(repeats)])
+    latencies = _call_latencies(fn, inputs)
+
+    result = {
+        'benchmark': name,
+        'rows': rows,
+        'batch': batch,
+        'repeats': repeats,
+        'best_ms': float(samples.min() * 1000),
+        'median_ms': float(np.median(samples) * 1000),
+        'p50_ms': float(np.percentile(latencies, 50) * 1000),
+        'p99_ms': float(np.percentile(latencies, 99) * 1000),
+        'throughput_per_s': float(items_per_call / np.median(samples)),
+        'peak_rss_mb': _peak_rss_mb(),
+    }
+    print(f"{name:<36} {str(rows or '-'):>10}  best {result['best_ms']:9.4f} ms  median {result['median_ms']:9.4f} ms  "
+          f"p50 {result['p50_ms']:9.4f} ms  p99 {result['p99_ms']:9.4f} ms  "
+          f"{result['throughput_per_s']:14,.0f}/s  rss {result['peak_rss_mb']:8.0f} MB", flush=True)
+    return result
+
+
+def _sample_member_data(members, calls, seed):
+    rng = random.Random(seed)
+    rows = members.sample(n=min(calls, len(members)), replace=calls > len(members), random_state=seed)
+    return [
+        {
+            'age_group': row.age_group,
+            'beneficiary_age': None if np.isnan(row.beneficiery_age) else row.beneficiery_age,
+            'town': row.town,
+            'gender': row.gender_mapped,
+            'current_products': rng.sample(PRODUCTS, rng.randint(0, 2)),
+        }
+        for row in rows.itertuples(index=False)
+    ]
+
+
+def run_member_benchmarks(rows, calls=DEFAULT_CALLS, seed=0):
+    """
+    Benchmarks that depend on the member table, for a synthetic table of `rows` rows
+    """
+    members = synthetic_members(rows, seed)
+    members_data = _sample_member_data(members, calls, seed)
+    results = []
+
+    with tempfile.TemporaryDirectory() as root:
+        build_encoded_bundle(members, root=root)
+        results.append(measure('load_artifacts', rows, lambda _: load_bundle(root), range(3)))
+        artifacts = load_bundle(root)
+
+        popularity_index = artifacts['popularity_index']
+        results.append(measure(
+            'get_recommendations_with_messages', rows,
+            lambda member_data: get_recommendations_with_messages(None, popularity_index, member_data, n=5),
+            members_data
+        ))
+        results.append(measure(
+            'knn_query', rows,
+            lambda member_data: profile_rank_products(
+                artifacts['profile_index'], member_data_features(artifacts, [member_data])
+            ),
+            members_data
+        ))
+        batches = [members_data[start:start + KNN_BATCH_SIZE] for start in range(0, len(members_data), KNN_BATCH_SIZE)]
+        results.append(measure(
+            'knn_batch', rows,
+            lambda batch: profile_rank_products(artifacts['profile_index'], member_data_features(artifacts, batch)),
+            batches, items_per_call=np.mean([len(batch) for batch in batches])
+        ))
+
+    # The notebook's TF-IDF features, indexed on its training split
+    strings = member_feature_strings(members)
+    sample = strings.sample(n=min(TFIDF_SAMPLE_ROWS, len(strings)), random_state=seed)
+    tfidf = TfidfVectorizer(max_features=1000).fit(sample)
+    train_rows, _ = train_test_split(np.arange(len(members)), test_size=0.2, random_state=42)
+    codes, unique_strings = strings.iloc[train_rows].factorize()
+    tfidf_artifacts = {
+        'tfidf': tfidf,
+        'profile_index': profile_index_from_features(
+            tfidf.transform(unique_strings)[codes], members['portfolio_map'].to_numpy()[train_rows]
+        ),
+    }
+    results.append(measure(
+        'tfidf_knn_query', rows,
+        lambda member_data: profile_rank_products(
+            tfidf_artifacts['profile_index'], member_data_features(tfidf_artifacts, [member_data])
+        ),
+        members_data
+    ))
+    return results
+
+
+def run_market_benchmarks(calls=DEFAULT_CALLS, seed=0):
+    """
+    New-customer benchmarks, which do not depend on the member table
+    """
+    rng = random.Random(seed)
+    questionnaires = [
+        {question: rng.choice(options) for question, options in QUESTIONNAIRE_OPTIONS.items()}
+        for _ in range(calls)
+    ]
+    snapshot = market_snapshot()
+    answer_recommendations(questionnaires[0], 10000, 'KES', False, snapshot=snapshot)
+
+    responses = pd.DataFrame(questionnaires * max(1, 1_000_000 // calls))
+    return [
+        measure('calculate_risk_score', None, calculate_risk_score, questionnaires),
+        measure('calculate_risk_scores', None, calculate_risk_scores, [responses] * 5, items_per_call=len(responses)),
+        measure(
+            'get_investment_recommendations', None,
+            lambda answers: get_investment_recommendations(
+                calculate_risk_score(answers), 10000, answers['currency'], answers['loan_access'], snapshot=snapshot
+            ),
+            questionnaires
+        ),
+        measure(
+            'answer_recommendations', None,
+            lambda answers: answer_recommendations(
+                answers, 10000, answers['currency'], answers['loan_access'], snapshot=snapshot
+            ),
+            questionnaires
+        ),
+    ]
+
+
+def _in_fresh_process(fn, *args):
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as pool:
+        return pool.submit(fn, *args).result()
+
+
+def _commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold, noise_floor=NOISE_FLOOR_MS):
+    """
+    Benchmarks whose median per-call time is more than `threshold` percent
+    and more than `noise_floor` ms above the baseline run's. Raises
+    ValueError when a benchmark in the baseline has no median_ms (a run from
+    before batched timing), rather than comparing nothing.
+    """
+    baseline_rows = {(row['benchmark'], row['rows']): row for row in baseline['results']}
+    unmeasured = [
+        f"{row['benchmark']} ({row['rows'] or '-'} rows)" for row in results['results']
+        if 'median_ms' not in baseline_rows.get((row['benchmark'], row['rows']), {'median_ms': None})
+    ]
+    if unmeasured:
+        raise ValueError(f"Baseline has no median_ms for: {', '.join(unmeasured)}")
+
+    regressions = []
+    for row in results['results']:
+        if (row['benchmark'], row['rows']) not in baseline_rows:
+            print(f"WARNING {row['benchmark']} ({row['rows'] or '-'} rows) is not in the baseline")
+            continue
+        before = baseline_rows[(row['benchmark'], row['rows'])]['median_ms']
+        if row['median_ms'] - before > noise_floor and row['median_ms'] > before * (1 + threshold / 100):
+            regressions.append(dict(row, baseline_median_ms=before, change_pct=(row['median_ms'] / before - 1) * 100))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the recommender hot paths")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help="Synthetic member table sizes")
+    parser.add_argument('--calls', type=int, default=DEFAULT_CALLS, help="Distinct inputs per benchmark")
+    parser.add_argument('--repeats', type=int, default=DEFAULT_REPEATS, help="Timed samples per benchmark")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmark.json', help="Where to write the JSON results")
+    parser.add_argument('--compare', help="Baseline JSON results to check for regressions")
+    parser.add_argument('--threshold', type=float, default=10.0, help="Allowed median slowdown, in percent")
+    parser.add_argument('--noise-floor', type=float, default=NOISE_FLOOR_MS,
+                        help="Per-call slowdowns below this many ms are never regressions")
+    args = parser.parse_args()
+
+    rows = _in_fresh_process(run_market_benchmarks, args.calls, args.seed)
+    for size in args.sizes:
+        rows.extend(_in_fresh_process(run_member_benchmarks, size, args.calls, args.seed))
+
+    results = {
+        'commit': _commit(),
+        'run_at': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'calls': args.calls,
+        'seed': args.seed,
+        'results': rows,
+    }
+    with open(args.output, 'w') as file:
+        json.dump(results, file, indent=2)
+    print(f"Wrote {len(rows)} results to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        try:
+            regressions = compare(results, baseline, args.threshold, args.noise_floor)
+        except ValueError as error:
+            sys.exit(f"Cannot compare against {args.compare}: {error}")
+        for row in regressions:
+            print(f"REGRESSION {row['benchmark']} ({row['rows'] or '-'} rows): "
+                  f"median {row['baseline_median_ms']:.4f} -> {row['median_ms']:.4f} ms (+{row['change_pct']:.1f}%)")
+        if regressions:
+            sys.exit(1)
+        print(f"No benchmark slowed down by more than {args.threshold:g}% against {args.compare}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+Offline evaluation of the existing-customer KNN recommender.
+
+Replays the notebook's split (test_size=0.2, random_state=42), ranks the
+test rows in chunked batch queries on the sparse TF-IDF matrix and reports
+accuracy, hit-rate@k and MAP@k, with the time and peak memory of every stage.
+tracemalloc slows allocation-heavy stages down several times over, so the
+stages are timed in one run and their peak memory traced in a second.
+
+Usage:
+    python evaluation.py --k 3
+    python evaluation.py --method brute --chunk-size 2048
+    python evaluation.py --features onehot   # direct feature encoder instead of model.pkl/tfidf.pkl
+    python evaluation.py --no-memory         # timings only, skip the traced run
+"""
+import argparse
+import pickle
+import time
+import tracemalloc
+from contextlib import contextmanager
+from functools import partial
+
+import numpy as np
+import pandas as pd
+from sklearn.model_selection import train_test_split
+
+from feature_encoder import build_encoded_profile_index, encode_members, fit_feature_encoder
+from knn_recommender import FEATURE_COLUMNS, knn_rank_products, member_feature_strings, training_labels
+from profile_index import build_profile_index, profile_rank_products
+
+
+@contextmanager
+def stage(name, timings, trace_memory=False):
+    """
+    Record a stage's wall time in `timings`, or with trace_memory its peak
+    traced memory instead (tracemalloc would distort the time)
+    """
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if trace_memory:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            timings.append({'stage': name, 'peak_mb': peak / 2**20})
+            print(f"{name:<20} peak {peak / 2**20:8.1f} MB")
+        else:
+            seconds = time.perf_counter() - start
+            timings.append({'stage': name, 'seconds': seconds})
+            print(f"{name:<20} {seconds:8.2f}s")
+
+
+def ranking_metrics(rankings, actual, k=3):
+    """
+    Accuracy of the top product, hit-rate@k and MAP@k against one actual product per row.
+    With a single relevant product, average precision is 1/rank when it ranks within k.
+    """
+    ranks = np.array([
+        ranking.index(product) + 1 if product in ranking[:k] else 0
+        for ranking, product in zip(rankings, actual)
+    ])
+    return {
+        'accuracy': float(np.mean(ranks == 1)),
+        f'hit_rate@{k}': float(np.mean(ranks > 0)),
+        f'map@{k}': float(np.mean(np.where(ranks > 0, 1 / np.maximum(ranks, 1), 0))),
+    }
+
+
+def evaluate(model, tfidf, df, method='profile', k=3, n_neighbors=20, chunk_size=4096, features='tfidf',
+             trace_memory=False):
+    """
+    Rank every test row in chunks of `chunk_size` and score the rankings.
+    `method` is 'profile' (distinct-profile index) or 'brute' (brute-force
+    search over the rows model was fitted on).
+    With features='onehot' the rows are encoded by the direct feature encoder
+    and ranked on a profile index built from it; model and tfidf are unused.
+    Stages are timed, or with trace_memory their peak memory traced (see stage).
+    """
+    timings = []
+    if features == 'onehot' and method != 'profile':
+        raise ValueError("The one-hot features are only indexed with method='profile'")
+
+    with stage('features', timings, trace_memory):
+        if features == 'onehot':
+            feature_encoder = fit_feature_encoder(df)
+            encoded = encode_members(feature_encoder, df)
+        else:
+            # Transform each distinct feature string once, then expand back to rows
+            codes, unique_features = member_feature_strings(df).factorize()
+            encoded = tfidf.transform(unique_features)[codes]
+        _, test_rows = train_test_split(np.arange(len(df)), test_size=0.2, random_state=42)
+        X_test = encoded[test_rows]
+        y_test = df['portfolio_map'].to_numpy()[test_rows]
+
+    with stage('index', timings, trace_memory):
+        if features == 'onehot':
+            rank = partial(profile_rank_products, build_encoded_profile_index(feature_encoder, df), n_neighbors=n_neighbors)
+        elif method == 'profile':
+            labels = training_labels(model, df)
+            rank = partial(profile_rank_products, build_profile_index(model, labels), n_neighbors=n_neighbors)
+        else:
+            labels = training_labels(model, df)
+            rank = partial(knn_rank_products, model, labels=labels, n_neighbors=n_neighbors)
+
+    with stage('query', timings, trace_memory):
+        rankings = []
+        for start in range(0, X_test.shape[0], chunk_size):
+            rankings.extend(rank(X_test[start:start + chunk_size]))
+
+    with stage('metrics', timings, trace_memory):
+        metrics = ranking_metrics(rankings, y_test, k=k)
+
+    return metrics, timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate the KNN recommender on the notebook's test split")
+    parser.add_argument('--members', default='investment_member.csv')
+    parser.add_argument('--model', default='model.pkl')
+    parser.add_argument('--tfidf', default='tfidf.pkl')
+    parser.add_argument('--method', choices=['profile', 'brute'], default='profile')
+    parser.add_argument('--k', type=int, default=3)
+    parser.add_argument('--n-neighbors', type=int, default=20)
+    parser.add_argument('--chunk-size', type=int, default=4096)
+    parser.add_argument('--features', choices=['tfidf', 'onehot'], default='tfidf')
+    parser.add_argument('--no-memory', action='store_true', help="Skip the second run that traces peak memory")
+    args = parser.parse_args()
+
+    def run(trace_memory):
+        timings = []
+        model = tfidf = None
+        with stage('load', timings, trace_memory):
+            if args.features == 'tfidf':
+                with open(args.model, 'rb') as file:
+                    model = pickle.load(file)
+                with open(args.tfidf, 'rb') as file:
+                    tfidf = pickle.load(file)
+            df = pd.read_csv(args.members, usecols=FEATURE_COLUMNS + ['portfolio_map'])
+        return evaluate(
+            model, tfidf, df, method=args.method, k=args.k, n_neighbors=args.n_neighbors,
+            chunk_size=args.chunk_size, features=args.features, trace_memory=trace_memory
+        )[0]
+
+    metrics = run(trace_memory=False)
+    if not args.no_memory:
+        print("Peak memory, traced in a second run:")
+        run(trace_memory=True)
+    for name, value in metrics.items():
+        print(f"{name:<12} {value:.4f}")
+
+if __name__ == "__main__":
+    main()
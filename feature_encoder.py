@@ -0,0 +1,159 @@
+"""
+Direct one-hot encoder for the KNN member features.
+
+Instead of gluing member_age, beneficiery_age, age_group and gender_mapped
+into one string for TfidfVectorizer to re-tokenize, every field maps
+straight to its own block of sparse columns: ages go into fixed-width bins
+(plus a 'missing' column), labels into one column per category. A batch is
+encoded from integer codes into a CSR matrix in one pass, with each row
+L2-normalised so the profile index can keep using dot products as cosine
+similarity.
+
+The encoder is a plain dict, stored as JSON in the artifact manifest.
+"""
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from sklearn.model_selection import train_test_split
+
+from knn_recommender import FEATURE_COLUMNS, member_data_feature_strings, member_feature_strings
+from profile_index import profile_index_from_features
+
+# Width of the member and beneficiary age bins, in years
+AGE_BIN_WIDTH = 5
+# Ages at or above this fall in the last bin
+AGE_BIN_LIMIT = 100
+
+# Feature columns encoded as age bins; the rest are encoded as categories
+BINNED_COLUMNS = ['member_age', 'beneficiery_age']
+
+
+def fit_feature_encoder(members):
+    """
+    Column layout for the features of `members`: one block of age bins per
+    binned column and one column per category seen in each label column
+    """
+    fields = []
+    offset = 0
+    for column in FEATURE_COLUMNS:
+        if column in BINNED_COLUMNS:
+            # Bins 0 .. AGE_BIN_LIMIT // AGE_BIN_WIDTH, then one column for a missing age
+            size = AGE_BIN_LIMIT // AGE_BIN_WIDTH + 2
+            fields.append({'column': column, 'kind': 'binned', 'offset': offset, 'size': size})
+        else:
+            categories = sorted(pd.Series(members[column]).dropna().astype(str).unique())
+            size = len(categories)
+            fields.append({'column': column, 'kind': 'categorical', 'offset': offset, 'size': size,
+                           'categories': categories})
+        offset += size
+    return {'fields': fields, 'n_features': offset}
+
+
+def extend_feature_encoder(encoder, members):
+    """
+    `encoder` with the categories of `members` it has not seen appended to
+    their fields, and the new column of every old column (an array indexed
+    by old column). Fields keep their order, so remapped rows stay sorted.
+    """
+    fields = []
+    column_map = []
+    offset = 0
+    for field in encoder['fields']:
+        field = dict(field)
+        column_map.append(np.arange(offset, offset + field['size']))
+        if field['kind'] == 'categorical':
+            seen = set(field['categories'])
+            values = pd.Series(members[field['column']]).dropna().astype(str).unique()
+            field['categories'] = field['categories'] + sorted(set(values) - seen)
+            field['size'] = len(field['categories'])
+        field['offset'] = offset
+        fields.append(field)
+        offset += field['size']
+    return {'fields': fields, 'n_features': offset}, np.concatenate(column_map)
+
+
+def _field_columns(field, values):
+    """
+    Feature column of every value for one field, -1 where the value has none
+    (a category not seen when the encoder was fitted)
+    """
+    if field['kind'] == 'binned':
+        ages = np.asarray(values)
+        if ages.dtype.kind not in 'iuf':
+            ages = pd.to_numeric(values, errors='coerce')
+        ages = np.asarray(ages, dtype=np.float64)
+        missing = np.isnan(ages)
+        bins = np.clip(np.nan_to_num(ages) // AGE_BIN_WIDTH, 0, field['size'] - 2).astype(np.int64)
+        return field['offset'] + np.where(missing, field['size'] - 1, bins)
+
+    # Look up each distinct value once; a missing value has code -1 and picks the trailing -1
+    codes, uniques = pd.factorize(values)
+    positions = {category: field['offset'] + i for i, category in enumerate(field['categories'])}
+    columns = np.array([positions.get(str(value), -1) for value in uniques] + [-1], dtype=np.int64)
+    return columns[codes]
+
+
+def encode_members(encoder, members):
+    """
+    CSR feature matrix for every row of a member table (or dict of column
+    arrays) holding FEATURE_COLUMNS, one unit-norm row per member
+    """
+    rows = len(members[encoder['fields'][0]['column']])
+    columns = np.column_stack([
+        _field_columns(field, members[field['column']]) for field in encoder['fields']
+    ]) if rows else np.empty((0, len(encoder['fields'])), dtype=np.int64)
+
+    present = columns >= 0
+    counts = present.sum(axis=1)
+    indptr = np.concatenate([[0], np.cumsum(counts)])
+    indices = columns[present]
+    data = np.repeat(1 / np.sqrt(np.maximum(counts, 1)), counts)
+    return sp.csr_matrix((data, indices, indptr), shape=(rows, encoder['n_features']))
+
+
+def member_data_columns(members_data):
+    """
+    FEATURE_COLUMNS arrays for member_data dicts as entered in the app. The
+    app asks for no member age, so that field is left missing.
+    """
+    def ages(key):
+        return np.array([
+            np.nan if member_data.get(key) is None else member_data[key] for member_data in members_data
+        ], dtype=np.float64)
+
+    return {
+        'member_age': ages('member_age'),
+        'beneficiery_age': ages('beneficiary_age'),
+        'age_group': np.array([member_data['age_group'] for member_data in members_data], dtype=object),
+        'gender_mapped': np.array([member_data['gender'] for member_data in members_data], dtype=object),
+    }
+
+
+def member_features(artifacts, members):
+    """
+    Feature matrix for a member table with whichever featurizer `artifacts`
+    carries: the one-hot encoder, or the notebook's TF-IDF on feature strings
+    """
+    if artifacts.get('feature_encoder') is not None:
+        return encode_members(artifacts['feature_encoder'], members)
+    codes, unique_features = member_feature_strings(members).factorize()
+    return artifacts['tfidf'].transform(unique_features)[codes]
+
+
+def member_data_features(artifacts, members_data):
+    """
+    Feature matrix for member_data dicts as entered in the app (see member_features)
+    """
+    if artifacts.get('feature_encoder') is not None:
+        return encode_members(artifacts['feature_encoder'], member_data_columns(members_data))
+    return artifacts['tfidf'].transform(member_data_feature_strings(members_data))
+
+
+def build_encoded_profile_index(encoder, members, test_size=0.2, random_state=42):
+    """
+    Profile index over the notebook's training split of `members`, encoded
+    with `encoder` instead of TF-IDF
+    """
+    train_rows, _ = train_test_split(np.arange(len(members)), test_size=test_size, random_state=random_state)
+    training = members.iloc[train_rows]
+    return profile_index_from_features(encode_members(encoder, training), training['portfolio_map'].to_numpy())
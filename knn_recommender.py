@@ -0,0 +1,154 @@
+import numpy as np
+import pandas as pd
+from sklearn.metrics import pairwise_distances_chunked
+from sklearn.model_selection import train_test_split
+
+# Columns the notebook concatenates into the TF-IDF feature string
+FEATURE_COLUMNS = ['member_age', 'beneficiery_age', 'age_group', 'gender_mapped']
+
+
+def member_feature_strings(members):
+    """
+    Build the notebook's feature string (member_age + beneficiery_age + age_group + gender_mapped)
+    for every row, as tfidf.pkl was fitted on
+    """
+    features = _as_text(members[FEATURE_COLUMNS[0]])
+    for column in FEATURE_COLUMNS[1:]:
+        features = features + _as_text(members[column])
+    return pd.Series(features, index=members.index)
+
+
+def _as_text(values):
+    """
+    str() of every value, as the notebook's astype(str) gave it (a missing
+    value becomes 'nan'), converting each distinct value once
+    """
+    codes, uniques = pd.factorize(values, use_na_sentinel=False)
+    return np.array([str(value) for value in uniques], dtype=object)[codes]
+
+
+def member_data_feature_strings(members_data):
+    """
+    Feature strings for member_data dicts as entered in the app (age_group,
+    beneficiary_age, gender). The app has no member age, so age_group stands
+    in for member_age; a missing beneficiary age becomes 'nan'.
+    """
+    features = []
+    for member_data in members_data:
+        beneficiary_age = member_data.get('beneficiary_age')
+        values = (
+            member_data['age_group'],
+            np.nan if beneficiary_age is None else beneficiary_age,
+            member_data['age_group'],
+            member_data['gender'],
+        )
+        features.append(''.join(str(value) for value in values))
+    return features
+
+
+def training_labels(model, df, test_size=0.2, random_state=42):
+    """
+    Recover the portfolio_map label of every row model.pkl was fitted on.
+
+    The notebook fits the model on the training half of
+    train_test_split(X_tfidf, new_df['portfolio_map'], test_size=0.2, random_state=42),
+    and the split only depends on the number of rows, so re-running it on
+    the saved member table gives back the same rows in the same order.
+    """
+    train_rows, _ = train_test_split(np.arange(len(df)), test_size=test_size, random_state=random_state)
+    if len(train_rows) != model.n_samples_fit_:
+        raise ValueError(
+            f"model.pkl was fitted on {model.n_samples_fit_} rows but the member table "
+            f"gives a training split of {len(train_rows)} rows"
+        )
+    return df['portfolio_map'].to_numpy()[train_rows]
+
+
+def _nearest_rows(distances, n_neighbors):
+    """
+    Column indices of the n_neighbors smallest entries in every row of
+    `distances`, nearest first. Equidistant columns are taken and ordered
+    by column, so rows tied at the n_neighbors boundary are the earliest.
+    """
+    kth = np.partition(distances, n_neighbors - 1, axis=1)[:, n_neighbors - 1:n_neighbors]
+    closer = distances < kth
+    tied = distances == kth
+    needed = n_neighbors - closer.sum(axis=1, keepdims=True)
+    picked = closer | (tied & (np.cumsum(tied, axis=1) <= needed))
+    columns = np.nonzero(picked)[1].reshape(len(distances), n_neighbors)
+    order = np.argsort(np.take_along_axis(distances, columns, axis=1), axis=1, kind='stable')
+    return np.take_along_axis(columns, order, axis=1)
+
+
+def knn_rank_products(model, features, labels, n_neighbors=20):
+    """
+    Rank products for every row of the sparse matrix `features` by a vote
+    over its nearest neighbours among the rows `model` was fitted on,
+    found by brute force in chunks of the distance matrix.
+
+    The neighbours are those model.kneighbors(algorithm='brute') returns,
+    except at the n_neighbors boundary: kneighbors leaves the pick among
+    equidistant rows to np.argpartition, whose choice differs between CPUs
+    (AVX-512 or not); here the earliest training rows are taken.
+
+    Products are ordered by how many neighbours hold them, ties broken by
+    the neighbours' total cosine similarity. Returns one ranked list per row.
+    """
+    if features.shape[0] == 0:
+        return []
+
+    n_neighbors = min(n_neighbors, model.n_samples_fit_)
+
+    def reduce(distances, start):
+        neighbours = _nearest_rows(distances, n_neighbors)
+        return neighbours, np.take_along_axis(distances, neighbours, axis=1)
+
+    chunks = list(pairwise_distances_chunked(
+        features, model._fit_X, reduce_func=reduce,
+        metric=model.effective_metric_, **model.effective_metric_params_
+    ))
+    indices = np.vstack([neighbours for neighbours, _ in chunks])
+    distances = np.vstack([distances for _, distances in chunks])
+
+    products, codes = np.unique(labels, return_inverse=True)
+    neighbor_codes = codes[indices]
+    rows = np.repeat(np.arange(features.shape[0]), n_neighbors)
+
+    votes = np.zeros((features.shape[0], len(products)))
+    similarity = np.zeros((features.shape[0], len(products)))
+    np.add.at(votes, (rows, neighbor_codes.ravel()), 1)
+    np.add.at(similarity, (rows, neighbor_codes.ravel()), 1 - distances.ravel())
+
+    return rank_votes(votes, similarity, products)
+
+
+def rank_votes(votes, similarity, products):
+    """
+    Turn per-row product vote and similarity totals into ranked product lists
+    (most votes first, ties broken by total similarity)
+    """
+    rankings = []
+    for row_votes, row_similarity in zip(votes, similarity):
+        order = np.lexsort((-row_similarity, -row_votes))
+        rankings.append([products[code] for code in order if row_votes[code] > 0])
+    return rankings
+
+
+def knn_rank_members(rank_features, featurize, members):
+    """
+    Neighbour-vote product ranking for every row of a member table.
+    Rows with identical FEATURE_COLUMNS are featurized (by `featurize`, a
+    member table -> feature matrix function such as a partial of
+    feature_encoder.member_features) and ranked only once, by
+    `rank_features` (e.g. a partial of knn_rank_products or
+    profile_index.profile_rank_products).
+    Returns an object array holding one tuple of products per row.
+    """
+    codes = members.groupby(FEATURE_COLUMNS, sort=False, dropna=False, observed=True).ngroup().to_numpy()
+    first_rows = np.unique(codes, return_index=True)[1]
+    rankings = rank_features(featurize(members.iloc[first_rows]))
+
+    ranked = np.empty(len(rankings), dtype=object)
+    for i, ranking in enumerate(rankings):
+        ranked[i] = tuple(ranking)
+    return ranked[codes]
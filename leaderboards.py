@@ -0,0 +1,38 @@
+import numpy as np
+
+
+def rank_providers(names, values):
+    """
+    Provider names ordered by `values`, highest first. Ties keep file order
+    and missing values are left out, as DataFrame.nlargest does.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    order = np.argsort(-values, kind='stable')
+    return tuple(names[i] for i in order if not np.isnan(values[i]))
+
+
+def build_leaderboards(tables):
+    """
+    Ranked provider lists for every numeric column of every market table:
+    {table: {metric: (provider, ...)}}. The provider name is each table's
+    first column.
+    """
+    leaderboards = {}
+    for table, columns in tables.items():
+        names = next(iter(columns.values()))
+        leaderboards[table] = {
+            metric: rank_providers(names, values)
+            for metric, values in columns.items()
+            if values.dtype.kind == 'f'
+        }
+    return leaderboards
+
+
+def top_providers(leaderboards, table, metric, k=2):
+    """
+    The k best providers of `table` by `metric`
+    """
+    try:
+        return list(leaderboards[table][metric][:k])
+    except KeyError:
+        raise ValueError(f"No leaderboard for {table} by {metric}")
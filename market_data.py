@@ -0,0 +1,191 @@
+"""
+Market-data store for the new-customer advisor.
+
+Provider tables are parsed from the CSVs in DATA/ into typed numpy columns
+once, and the parsed snapshot is kept in memory keyed on the files'
+modification times. market_snapshot() re-checks those times (a few stat
+calls) and, when a file has changed, parses the new files and swaps the
+snapshot in with a single reference assignment. Callers hold on to the
+snapshot they were given, so a request never sees half of an update.
+A changed file that fails to parse (malformed, or caught half-written) is
+logged and the previous snapshot stays in service until the files change
+again.
+
+    DATA/money market.csv       Rank, Fund Manager, Nominal / After Tax / Real Return%
+    DATA/Saccos.csv             Ranking, Sacco, assets / deposits / loans / income 2022-2023
+    DATA/dollar funds.csv       Provider, Rate   (optional, defaults below)
+    DATA/fixed deposits.csv     Provider, Rate   (optional, defaults below)
+
+Usage:
+    python market_data.py       # print the current snapshot
+"""
+import logging
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from leaderboards import build_leaderboards
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'DATA')
+
+MARKET_FILES = {
+    'mmf': 'money market.csv',
+    'sacco': 'Saccos.csv',
+    'dollar_funds': 'dollar funds.csv',
+    'fixed_deposits': 'fixed deposits.csv',
+}
+
+# Published rates used while no CSV exists for these tables
+DEFAULT_DOLLAR_FUNDS = {
+    'Provider': ['NCBA', 'CIC', 'Jubilee'],
+    'Rate': [3.98, 5.0, 5.79]
+}
+DEFAULT_FIXED_DEPOSITS = {
+    'Provider': ['NCBA', 'CIC', 'Jubilee', 'Madison', 'Sanlam'],
+    'Rate': [11.65, 12.0, 15.56, 13.0, 17.6]
+}
+
+# CSV header -> table column; the first column of every table is its provider name
+MMF_COLUMNS = {
+    'Fund Manager': 'Fund',
+    'Nominal Rate%': 'Return',
+    'After Tax Return%': 'After_Tax_Return',
+    'Real Return%': 'Real_Return',
+}
+SACCO_COLUMNS = {
+    'Sacco': 'Name',
+    'Total Assets 2023 (Kshs. Billions)': 'Total_Assets',
+    'Total Assets 2022 (Kshs. Billions)': 'Total_Assets_2022',
+    'Total Deposits 2023 (Kshs. Billions)': 'Total_Deposits',
+    'Total Deposits 2022 (Kshs. Billions)': 'Total_Deposits_2022',
+    'Gross Loans 2023 (Kshs. Billions)': 'Gross_Loans',
+    'Gross Loans 2022 (Kshs. Billions)': 'Gross_Loans_2022',
+    'Total Income 2023 (Kshs. Billions)': 'Total_Income',
+    'Total Income 2022 (Kshs. Billions)': 'Total_Income_2022',
+}
+RATE_COLUMNS = {'Provider': 'Provider', 'Rate': 'Rate'}
+
+_snapshot = None
+# (data_dir, signature) of the last files that failed to parse
+_failed = None
+_lock = threading.Lock()
+
+logger = logging.getLogger(__name__)
+
+
+def _read_table(path, columns, defaults=None):
+    """
+    Parse one CSV into a dict of typed columns: the provider name as an
+    object array, every other column as float64 ('18.07%' -> 18.07).
+    Raises ValueError when a column is missing or has blank cells.
+    """
+    if defaults is not None and not os.path.exists(path):
+        df = pd.DataFrame(defaults)
+    else:
+        df = pd.read_csv(path, dtype=str, skipinitialspace=True)
+        missing = set(columns) - set(df.columns)
+        if missing:
+            raise ValueError(f"{path} is missing columns: {', '.join(sorted(missing))}")
+        blank = [column for column in columns if df[column].isna().any()]
+        if blank:
+            raise ValueError(f"{path} has blank cells in: {', '.join(blank)}")
+        df = df[list(columns)].rename(columns=columns)
+
+    names = list(columns.values())
+    table = {names[0]: df[names[0]].str.strip().to_numpy(dtype=object)}
+    for name in names[1:]:
+        values = df[name].astype(str).str.replace(r'[%,\s]', '', regex=True)
+        table[name] = pd.to_numeric(values).to_numpy(dtype=np.float64)
+    return table
+
+
+def _signature(data_dir):
+    """
+    (file, mtime_ns, size) of every market file present in `data_dir`
+    """
+    signature = []
+    for name in MARKET_FILES.values():
+        try:
+            stat = os.stat(os.path.join(data_dir, name))
+        except FileNotFoundError:
+            continue
+        signature.append((name, stat.st_mtime_ns, stat.st_size))
+    return tuple(signature)
+
+
+def load_market_snapshot(data_dir=DATA_DIR):
+    """
+    Parse every market table in `data_dir` into a new snapshot:
+    {'signature', 'tables': {table: {column: array}}, 'frames': {table: DataFrame},
+    'leaderboards': {table: {metric: ranked providers}}}
+    """
+    signature = _signature(data_dir)
+
+    def path(table):
+        return os.path.join(data_dir, MARKET_FILES[table])
+
+    tables = {
+        'mmf': _read_table(path('mmf'), MMF_COLUMNS),
+        'sacco': _read_table(path('sacco'), SACCO_COLUMNS),
+        'dollar_funds': _read_table(path('dollar_funds'), RATE_COLUMNS, DEFAULT_DOLLAR_FUNDS),
+        'fixed_deposits': _read_table(path('fixed_deposits'), RATE_COLUMNS, DEFAULT_FIXED_DEPOSITS),
+    }
+    return {
+        'data_dir': data_dir,
+        'signature': signature,
+        'tables': tables,
+        'frames': {name: pd.DataFrame(table, copy=False) for name, table in tables.items()},
+        'leaderboards': build_leaderboards(tables),
+    }
+
+
+def _is_current(snapshot, data_dir, signature):
+    """
+    Whether `snapshot` is the one to serve for files with `signature`: it was
+    parsed from them, or they are the ones that last failed to parse
+    """
+    if snapshot is None or snapshot['data_dir'] != data_dir:
+        return False
+    return snapshot['signature'] == signature or _failed == (data_dir, signature)
+
+
+def market_snapshot(data_dir=DATA_DIR):
+    """
+    The current market snapshot, re-parsed only when a file in `data_dir`
+    has changed since it was loaded. When the changed files fail to parse
+    the previous snapshot is returned, or the error raised if there is none.
+    """
+    global _snapshot, _failed
+    snapshot = _snapshot
+    if _is_current(snapshot, data_dir, _signature(data_dir)):
+        return snapshot
+
+    with _lock:
+        # Another thread may have reloaded while this one waited
+        snapshot = _snapshot
+        signature = _signature(data_dir)
+        if not _is_current(snapshot, data_dir, signature):
+            try:
+                snapshot = load_market_snapshot(data_dir)
+            except (OSError, ValueError):
+                if snapshot is None or snapshot['data_dir'] != data_dir:
+                    raise
+                logger.exception("Keeping the previous market snapshot: %s failed to parse", data_dir)
+                _failed = (data_dir, signature)
+            else:
+                _snapshot = snapshot
+    return snapshot
+
+
+def main():
+    snapshot = market_snapshot()
+    for name, frame in snapshot['frames'].items():
+        print(f"{name} ({len(frame)} providers)")
+        print(frame.to_string(index=False))
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+"""
+Member store keyed by member_no.
+
+The notebook finds a member with new_df.loc[new_df['member_no'] == member_no],
+a scan of the whole table, once for the profile and again for the current
+products. The store collapses the member table, where a member spans one
+row per beneficiary and product, into one compact record per member:
+
+    age_group, town, gender_mapped  category codes (int8/int16)
+    member_age                      int16, -1 when missing or out of range
+    products                        bitmask of every product the member holds
+    beneficiary_ages                the member's distinct beneficiary ages
+                                    (int8, -1 when missing or out of range)
+                                    in first-seen order, sliced by
+                                    beneficiary_offsets
+
+and indexes the records with an open-addressing hash table on member_no, so
+a lookup is a few array reads however many members there are.
+
+Like the member table, a store is a directory of .npy files plus
+schema.json, loaded memory-mapped; artifact bundles carry one under
+member_store/.
+
+Usage:
+    python member_store.py investment_member.csv member_store
+    python member_store.py --lookup 1042        # print one member's record
+"""
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from member_table import code_dtype, load_member_table
+
+MEMBER_STORE_PATH = 'member_store'
+SCHEMA_FILE = 'schema.json'
+
+# Profile fields stored as category codes, and the member_data key each one fills
+CODED_FIELDS = {'age_group': 'age_group', 'town': 'town', 'gender_mapped': 'gender'}
+STORE_COLUMNS = ['member_no', 'age_group', 'town', 'gender_mapped', 'member_age', 'beneficiery_age', 'portfolio_map']
+
+# Multiplier of the member_no hash (Fibonacci hashing)
+HASH_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+UINT64_MASK = (1 << 64) - 1
+# Hash table slots per member, at least; keeps linear probes short
+LOAD_FACTOR = 0.5
+# Stand-in for a missing age in the integer age arrays
+MISSING_AGE = -1
+# member_no values the store's int64 keys can hold
+MEMBER_NO_RANGE = (-2**63, 2**63 - 1)
+
+
+def _hash(member_nos):
+    hashed = np.asarray(member_nos, dtype=np.int64).astype(np.uint64) * HASH_MULTIPLIER
+    return hashed ^ (hashed >> np.uint64(29))
+
+
+def build_slots(member_nos):
+    """
+    Linear-probing hash table over `member_nos` (distinct int64 keys): an
+    array of positions into member_nos, -1 for empty slots, whose length is
+    a power of two
+    """
+    capacity = 1 << max(4, int(np.ceil(np.log2(max(len(member_nos), 1) / LOAD_FACTOR))))
+    mask = capacity - 1
+    slots = np.full(capacity, -1, dtype=np.int32 if len(member_nos) < 2**31 else np.int64)
+    home = (_hash(member_nos) & np.uint64(mask)).astype(np.int64)
+
+    # Round r places every still-pending key whose slot home + r is free;
+    # keys colliding on the same free slot are placed one per round
+    pending = np.arange(len(member_nos), dtype=np.int64)
+    probe = 0
+    while len(pending):
+        candidates = (home[pending] + probe) & mask
+        free = slots[candidates] < 0
+        winners = np.unique(candidates[free], return_index=True)[1]
+        placed = pending[free][winners]
+        slots[candidates[free][winners]] = placed
+        pending = np.setdiff1d(pending, placed, assume_unique=True)
+        probe += 1
+    return slots
+
+
+def _integer_ages(ages, dtype):
+    """
+    Ages as `dtype` integers with MISSING_AGE for NaN. Preprocessing leaves
+    implausible ages in the table (negative ones from future birth dates,
+    ones in the hundreds from placeholder dates); those that fit are kept
+    as they are, those that do not fit `dtype` become MISSING_AGE.
+    """
+    ages = np.rint(np.asarray(ages, dtype=np.float64))
+    limits = np.iinfo(dtype)
+    missing = np.isnan(ages) | (ages < limits.min) | (ages > limits.max)
+    return np.where(missing, MISSING_AGE, np.nan_to_num(ages)).astype(dtype)
+
+
+def build_member_store(members):
+    """
+    One record per member_no of a member table, in order of first appearance
+    """
+    member_codes, member_nos = pd.factorize(members['member_no'])
+    if (member_codes < 0).any():
+        raise ValueError("member_no has missing values")
+    member_nos = np.asarray(member_nos, dtype=np.int64)
+    first_rows = np.unique(member_codes, return_index=True)[1]
+
+    products = pd.Categorical(members['portfolio_map'])
+    if len(products.categories) > 64:
+        raise ValueError("At most 64 distinct products fit in a product bitmask")
+    mask_dtype = np.uint8 if len(products.categories) <= 8 else np.uint16 if len(products.categories) <= 16 else np.uint64
+    held = products.codes >= 0
+    product_masks = np.zeros(len(member_nos), dtype=mask_dtype)
+    bits = np.left_shift(np.uint64(1), products.codes[held].astype(np.uint64)).astype(mask_dtype)
+    np.bitwise_or.at(product_masks, member_codes[held], bits)
+
+    # Distinct (member, beneficiary age) pairs, grouped by member in first-seen order
+    ages = _integer_ages(members['beneficiery_age'], np.int8)
+    pairs, first_seen = np.unique(member_codes * 256 + (ages.astype(np.int64) + 128), return_index=True)
+    pair_members = pairs // 256
+    order = np.lexsort((first_seen, pair_members))
+    beneficiary_offsets = np.concatenate([[0], np.cumsum(np.bincount(pair_members, minlength=len(member_nos)))])
+
+    store = {
+        'member_no': member_nos,
+        'slots': build_slots(member_nos),
+        'member_age': _integer_ages(members['member_age'].to_numpy()[first_rows], np.int16),
+        'products': product_masks,
+        'beneficiary_offsets': beneficiary_offsets.astype(np.int32 if len(pairs) < 2**31 else np.int64),
+        'beneficiary_ages': (pairs[order] % 256 - 128).astype(np.int8),
+        'categories': {'portfolio_map': [str(product) for product in products.categories]},
+    }
+    for column in CODED_FIELDS:
+        values = pd.Categorical(members[column].to_numpy()[first_rows])
+        categories = [str(category) for category in values.categories]
+        store[column] = values.codes.astype(code_dtype(categories))
+        store['categories'][column] = categories
+    return store
+
+
+def member_store_nbytes(store):
+    """
+    Bytes held by the store's arrays
+    """
+    return sum(store[name].nbytes for name in _store_arrays(store))
+
+
+def beneficiary_flags(store):
+    """
+    Rule 1 over every beneficiary of every member at once: whether each
+    member has a beneficiary aged 18-25 (student) and one under 18 (junior)
+    """
+    ages = np.asarray(store['beneficiary_ages'])
+    members = np.repeat(np.arange(len(store['member_no'])), np.diff(store['beneficiary_offsets']))
+    student = np.zeros(len(store['member_no']), dtype=bool)
+    junior = np.zeros(len(store['member_no']), dtype=bool)
+    student[members[(ages >= 18) & (ages <= 25)]] = True
+    junior[members[(ages != MISSING_AGE) & (ages < 18)]] = True
+    return student, junior
+
+
+def _store_arrays(store):
+    return [name for name, values in store.items() if isinstance(values, np.ndarray)]
+
+
+def write_member_store(store, path=MEMBER_STORE_PATH):
+    """
+    Write `store` as a directory of .npy files; schema.json is written last
+    """
+    os.makedirs(path, exist_ok=True)
+    for name in _store_arrays(store):
+        np.save(os.path.join(path, f"{name}.npy"), store[name])
+    schema = {'members': len(store['member_no']), 'arrays': _store_arrays(store), 'categories': store['categories']}
+    tmp_path = os.path.join(path, f"{SCHEMA_FILE}.tmp")
+    with open(tmp_path, 'w') as file:
+        json.dump(schema, file)
+    os.replace(tmp_path, os.path.join(path, SCHEMA_FILE))
+
+
+def read_member_store(path=MEMBER_STORE_PATH):
+    """
+    Load a member store directory with its arrays memory-mapped
+    """
+    with open(os.path.join(path, SCHEMA_FILE)) as file:
+        schema = json.load(file)
+    store = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r') for name in schema['arrays']}
+    store['categories'] = schema['categories']
+    if len(store['member_no']) != schema['members']:
+        raise ValueError(f"Member store at {path} does not match its schema")
+    return store
+
+
+def parse_member_no(value):
+    """
+    A member_no from a request or a form, as an int the store can look up;
+    raises ValueError for anything else (floats, booleans, non-numeric
+    strings, out-of-range numbers)
+    """
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ValueError(f"member_no must be an integer, got {value!r}")
+    try:
+        member_no = int(value)
+    except ValueError:
+        raise ValueError(f"member_no must be an integer, got {value!r}") from None
+    if not MEMBER_NO_RANGE[0] <= member_no <= MEMBER_NO_RANGE[1]:
+        raise ValueError(f"member_no {member_no} is out of range")
+    return member_no
+
+
+def member_position(store, member_no):
+    """
+    Record position of `member_no` in the store, or None when it is not a member
+    """
+    slots = store['slots']
+    mask = len(slots) - 1
+    member_no = int(member_no)
+    # _hash on one Python int, without the numpy scalar overhead
+    hashed = (member_no & UINT64_MASK) * int(HASH_MULTIPLIER) & UINT64_MASK
+    slot = (hashed ^ hashed >> 29) & mask
+    while True:
+        position = int(slots[slot])
+        if position < 0:
+            return None
+        if store['member_no'][position] == member_no:
+            return position
+        slot = (slot + 1) & mask
+
+
+def member_positions(store, member_nos):
+    """
+    member_position for an array of member numbers at once, -1 where not found
+    """
+    member_nos = np.asarray(member_nos, dtype=np.int64)
+    slots = store['slots']
+    mask = len(slots) - 1
+    candidates = (_hash(member_nos) & np.uint64(mask)).astype(np.int64)
+    positions = np.full(len(member_nos), -1, dtype=np.int64)
+    pending = np.arange(len(member_nos))
+    while len(pending):
+        found = slots[candidates[pending]]
+        empty = found < 0
+        match = ~empty & (store['member_no'][np.maximum(found, 0)] == member_nos[pending])
+        positions[pending[match]] = found[match]
+        pending = pending[~empty & ~match]
+        candidates[pending] = (candidates[pending] + 1) & mask
+    return positions
+
+
+def member_data(store, position):
+    """
+    The member_data dict the recommenders take, for the record at `position`
+    """
+    categories = store['categories']
+    data = {'member_no': int(store['member_no'][position])}
+    for column, key in CODED_FIELDS.items():
+        code = int(store[column][position])
+        data[key] = categories[column][code] if code >= 0 else None
+    member_age = int(store['member_age'][position])
+    data['member_age'] = None if member_age == MISSING_AGE else float(member_age)
+
+    start, end = store['beneficiary_offsets'][position:position + 2]
+    ages = [int(age) for age in store['beneficiary_ages'][start:end]]
+    # The first row's age, as the notebook reads it, and every known beneficiary age
+    data['beneficiary_age'] = float(ages[0]) if ages and ages[0] != MISSING_AGE else None
+    data['beneficiary_ages'] = [float(age) for age in ages if age != MISSING_AGE]
+    mask = int(store['products'][position])
+    data['current_products'] = [
+        product for bit, product in enumerate(categories['portfolio_map']) if mask >> bit & 1
+    ]
+    return data
+
+
+def lookup_member(store, member_no):
+    """
+    member_data for `member_no`, or None when it is not a member
+    """
+    position = member_position(store, member_no)
+    return None if position is None else member_data(store, position)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or query the member_no keyed member store")
+    parser.add_argument('members', nargs='?', default='investment_member.csv', help="Member file to build from")
+    parser.add_argument('store', nargs='?', default=MEMBER_STORE_PATH)
+    parser.add_argument('--lookup', type=int, help="Print the record of this member number instead of building")
+    args = parser.parse_args()
+
+    if args.lookup is not None:
+        print(lookup_member(read_member_store(args.store), args.lookup))
+        return
+    members = load_member_table(args.members, columns=STORE_COLUMNS)
+    store = build_member_store(members)
+    write_member_store(store, args.store)
+    print(f"Wrote {len(store['member_no']):,} members to {args.store}/: {member_store_nbytes(store) / 2**20:,.1f} MB "
+          f"against {members.memory_usage(deep=True).sum() / 2**20:,.1f} MB for the {len(members):,} rows")
+
+
+if __name__ == "__main__":
+    main()
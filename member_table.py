@@ -0,0 +1,126 @@
+"""
+Typed, columnar on-disk format for the prepared member table.
+
+The table is a directory holding one .npy file per column plus schema.json.
+Text columns are stored as categorical codes (int8/int16) with their
+categories listed in the schema, so loading them never parses strings, and
+files are memory-mapped so a reader only pages in the columns it asks for.
+
+Usage:
+    python member_table.py investment_member.csv investment_member
+"""
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+MEMBER_TABLE_PATH = 'investment_member'
+SCHEMA_FILE = 'schema.json'
+
+CATEGORICAL_COLUMNS = ['town', 'relationship', 'gender_mapped', 'portfolio_map', 'age_group']
+NUMERIC_DTYPES = {
+    'member_no': 'int64',
+    'member_age': 'int16',
+    'beneficiery_age': 'float64',
+}
+
+# Columns the rule-based recommendations need
+RULE_TABLE_COLUMNS = ['age_group', 'town', 'portfolio_map']
+
+
+def schema_path(path=MEMBER_TABLE_PATH):
+    return os.path.join(path, SCHEMA_FILE)
+
+
+def code_dtype(categories):
+    """
+    Smallest integer dtype that holds codes for `categories` (plus -1 for missing)
+    """
+    return np.int8 if len(categories) < 127 else np.int16 if len(categories) < 32767 else np.int32
+
+
+def write_member_table(df, path=MEMBER_TABLE_PATH):
+    """
+    Write `df` as a columnar member table directory. The schema is written
+    last, so its modification time marks a complete table.
+    """
+    os.makedirs(path, exist_ok=True)
+    schema = {'rows': len(df), 'columns': {}}
+
+    for column in df.columns:
+        if column in CATEGORICAL_COLUMNS:
+            values = df[column].astype('category')
+            categories = values.cat.categories
+            codes = values.cat.codes.to_numpy().astype(code_dtype(categories))
+            np.save(os.path.join(path, f"{column}.npy"), codes)
+            schema['columns'][column] = {'kind': 'categorical', 'categories': categories.tolist()}
+        else:
+            dtype = NUMERIC_DTYPES.get(column, df[column].dtype.str)
+            np.save(os.path.join(path, f"{column}.npy"), df[column].to_numpy(dtype=dtype))
+            schema['columns'][column] = {'kind': 'numeric', 'dtype': np.dtype(dtype).str}
+
+    tmp_path = f"{schema_path(path)}.tmp"
+    with open(tmp_path, 'w') as file:
+        json.dump(schema, file)
+    os.replace(tmp_path, schema_path(path))
+
+
+def read_member_table(path=MEMBER_TABLE_PATH, columns=None):
+    """
+    Load the requested `columns` (default: all) of a member table directory.
+    Numeric columns stay memory-mapped; text columns come back as categoricals.
+    """
+    with open(schema_path(path)) as file:
+        schema = json.load(file)
+
+    columns = list(schema['columns']) if columns is None else columns
+    data = {}
+    for column in columns:
+        spec = schema['columns'][column]
+        values = np.load(os.path.join(path, f"{column}.npy"), mmap_mode='r')
+        if spec['kind'] == 'categorical':
+            data[column] = pd.Categorical.from_codes(values, categories=spec['categories'])
+        else:
+            data[column] = values
+    return pd.DataFrame(data, copy=False)
+
+
+def load_member_table(path, columns=None):
+    """
+    Load a member table from either a columnar table directory or a CSV file,
+    reading only `columns` (default: all)
+    """
+    if os.path.isdir(path):
+        return read_member_table(path, columns=columns)
+    return pd.read_csv(path, usecols=columns)
+
+
+def member_table_source(path):
+    """
+    File whose modification time versions the table at `path`, for cache signatures
+    """
+    return schema_path(path) if os.path.isdir(path) else path
+
+
+def default_member_table():
+    """
+    The columnar table when it has been built, otherwise investment_member.csv
+    """
+    return MEMBER_TABLE_PATH if os.path.exists(schema_path()) else 'investment_member.csv'
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert a member CSV into the columnar member table format")
+    parser.add_argument('csv', nargs='?', default='investment_member.csv')
+    parser.add_argument('table', nargs='?', default=MEMBER_TABLE_PATH)
+    args = parser.parse_args()
+
+    df = pd.read_csv(args.csv)
+    write_member_table(df, args.table)
+    print(f"Wrote {len(df):,} rows to {args.table}/")
+
+
+if __name__ == "__main__":
+    main()
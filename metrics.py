@@ -0,0 +1,152 @@
+"""
+Per-stage latency histograms and cache counters for the recommenders.
+
+Stages are timed with `timed('stage')` and recorded into fixed-bucket
+histograms shared by the whole process. Registered caches (anything with a
+stats() method returning hits/misses/size) are read at export time.
+Everything can be rendered in the Prometheus text exposition format, served
+by the scoring service on /metrics or written to a file for the
+node_exporter textfile collector.
+"""
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+METRICS_PATH = 'recommender.prom'
+METRIC_PREFIX = 'recommender'
+
+# Histogram bucket upper bounds, in seconds
+LATENCY_BUCKETS = [0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+
+_stages = {}
+_caches = {}
+_lock = threading.Lock()
+_last_export = 0.0
+
+
+def observe(stage, seconds):
+    """
+    Record one latency sample for `stage`
+    """
+    bucket = bisect.bisect_left(LATENCY_BUCKETS, seconds)
+    with _lock:
+        histogram = _stages.get(stage)
+        if histogram is None:
+            histogram = _stages[stage] = {'buckets': [0] * (len(LATENCY_BUCKETS) + 1), 'count': 0, 'sum': 0.0}
+        histogram['buckets'][bucket] += 1
+        histogram['count'] += 1
+        histogram['sum'] += seconds
+
+
+@contextmanager
+def timed(stage):
+    """
+    Record the wall time of the block as one sample for `stage`
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - start)
+
+
+def register_cache(name, cache):
+    """
+    Export `cache`'s hit/miss counters under `name`
+    """
+    with _lock:
+        _caches[name] = cache
+
+
+def reset():
+    with _lock:
+        _stages.clear()
+
+
+def _quantile(buckets, count, q):
+    """
+    Upper bound of the bucket holding the q-quantile sample
+    """
+    rank = np.searchsorted(np.cumsum(buckets), q * count, side='left')
+    return LATENCY_BUCKETS[rank] if rank < len(LATENCY_BUCKETS) else float('inf')
+
+
+def stage_summary():
+    """
+    Count, mean and bucketed p50/p99 (seconds) of every stage, for display
+    """
+    with _lock:
+        stages = {stage: dict(histogram, buckets=list(histogram['buckets'])) for stage, histogram in _stages.items()}
+    return [
+        {
+            'stage': stage,
+            'count': histogram['count'],
+            'mean': histogram['sum'] / histogram['count'],
+            'p50': _quantile(histogram['buckets'], histogram['count'], 0.5),
+            'p99': _quantile(histogram['buckets'], histogram['count'], 0.99),
+        }
+        for stage, histogram in sorted(stages.items())
+    ]
+
+
+def cache_summary():
+    with _lock:
+        caches = dict(_caches)
+    return [dict(cache.stats(), cache=name) for name, cache in sorted(caches.items())]
+
+
+def prometheus_text():
+    """
+    All stage histograms and cache counters in the Prometheus text format
+    """
+    with _lock:
+        stages = {stage: dict(histogram, buckets=list(histogram['buckets'])) for stage, histogram in _stages.items()}
+
+    lines = [
+        f"# HELP {METRIC_PREFIX}_stage_seconds Latency of each recommendation stage.",
+        f"# TYPE {METRIC_PREFIX}_stage_seconds histogram",
+    ]
+    for stage, histogram in sorted(stages.items()):
+        cumulative = np.cumsum(histogram['buckets'])
+        for bound, total in zip(LATENCY_BUCKETS + ['+Inf'], cumulative):
+            lines.append(f'{METRIC_PREFIX}_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {total}')
+        lines.append(f'{METRIC_PREFIX}_stage_seconds_sum{{stage="{stage}"}} {histogram["sum"]:.9f}')
+        lines.append(f'{METRIC_PREFIX}_stage_seconds_count{{stage="{stage}"}} {histogram["count"]}')
+
+    caches = cache_summary()
+    for metric, kind, text in [
+        ('hits', 'counter', 'Cache lookups answered from the cache.'),
+        ('misses', 'counter', 'Cache lookups that had to be computed.'),
+        ('size', 'gauge', 'Entries currently cached.'),
+    ]:
+        name = f"{METRIC_PREFIX}_cache_{metric}{'_total' if kind == 'counter' else ''}"
+        lines.append(f"# HELP {name} {text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for cache in caches:
+            lines.append(f'{name}{{cache="{cache["cache"]}"}} {cache[metric]}')
+    return '\n'.join(lines) + '\n'
+
+
+def write_prometheus(path=METRICS_PATH):
+    """
+    Write prometheus_text() to `path` atomically, so a collector never reads a partial file
+    """
+    global _last_export
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as file:
+        file.write(prometheus_text())
+    os.replace(tmp_path, path)
+    _last_export = time.monotonic()
+
+
+def export_if_due(path=METRICS_PATH, interval=15.0):
+    """
+    write_prometheus at most once every `interval` seconds
+    """
+    if time.monotonic() - _last_export >= interval:
+        write_prometheus(path)
+
@@ -0,0 +1,364 @@
+"""
+Incremental refresh of the KNN profile index.
+
+Retraining model.pkl means re-running the notebook: TfidfVectorizer
+fit_transform over every member, train_test_split and NearestNeighbors.fit,
+even when only a few thousand members joined since the last run.
+refresh_bundle starts from the current artifact bundle instead and
+
+  - encodes only the new members' rows. The featurizer grows only when they
+    bring tokens (TF-IDF) or categories (one-hot encoder) it has not seen:
+    new columns are appended, existing columns and idf weights are kept, so
+    every indexed profile keeps its vector;
+  - adds the rows to the profile index: a row whose profile is indexed
+    bumps that profile's histogram, a new profile is appended;
+  - publishes a new bundle version with the rows appended to its member table.
+    It covers the purchase event log up to the parent's offset, or up to
+    the log's current end with --events when the new rows include the
+    events so far (see popularity_events.py).
+
+New rows all go into the index (none are held out), so the manifest's
+lineage records what the index covers: the notebook's training split of
+the first `split_rows` member rows, plus the `appended_rows` after them.
+
+For the one-hot encoder the refreshed index is exactly what a rebuild over
+the same rows gives. For TF-IDF the kept idf weights drift from a refit as
+documents accumulate, and a vocabulary already at max_features takes no new
+tokens. check_consistency rebuilds the index from scratch over the same
+rows and compares the two; run it periodically and publish the rebuild
+when it reports drift.
+
+Usage:
+    python model_refresh.py refresh new_members.csv
+    python model_refresh.py refresh new_members.csv --events popularity_events.jsonl
+    python model_refresh.py check
+    python model_refresh.py check --publish     # publish the full rebuild when the check fails
+"""
+import argparse
+import os
+import time
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from sklearn.base import clone
+from sklearn.model_selection import train_test_split
+
+from artifacts import BUNDLE_ROOT, load_bundle, publish_bundle
+from feature_encoder import encode_members, extend_feature_encoder, fit_feature_encoder, member_features
+from knn_recommender import FEATURE_COLUMNS, knn_rank_members, member_feature_strings
+from member_table import load_member_table, read_member_table
+from popularity_events import log_offset
+from profile_index import (
+    append_to_profile_index, profile_index_from_arrays, profile_index_from_features, profile_rank_products
+)
+
+# Member rows ranked by both indexes in check_consistency
+CONSISTENCY_PROBES = 5000
+# Share of probes that must get the same top-n ranking from both indexes
+MIN_RANKING_AGREEMENT = 0.99
+
+
+def bundle_lineage(manifest):
+    """
+    Rows of the bundle's member table its profile index covers; a bundle
+    built in full covers the training split of its whole table
+    """
+    return manifest.get('lineage') or {
+        'split_rows': manifest['member_table']['rows'], 'appended_rows': 0, 'parent': None,
+    }
+
+
+def training_rows(lineage, test_size=0.2, random_state=42):
+    """
+    Member table positions of the rows the profile index was built from
+    """
+    split_rows = lineage['split_rows']
+    train_rows, _ = train_test_split(np.arange(split_rows), test_size=test_size, random_state=random_state)
+    return np.concatenate([train_rows, np.arange(split_rows, split_rows + lineage['appended_rows'])])
+
+
+def _bundle_members(root, manifest):
+    """
+    The whole member table of a bundle, which must hold the feature columns to be refreshed or rebuilt
+    """
+    members = read_member_table(os.path.join(root, manifest['version'], 'members'))
+    missing = [column for column in FEATURE_COLUMNS + ['portfolio_map'] if column not in members.columns]
+    if missing:
+        raise ValueError(
+            f"Member table of bundle {manifest['version']} has no {missing} columns; "
+            f"publish it from the full member table to refresh it"
+        )
+    return members
+
+
+def extend_tfidf(tfidf, feature_strings, documents):
+    """
+    `tfidf` with the tokens of `feature_strings` missing from its vocabulary
+    appended, most frequent first and only as far as max_features allows,
+    each weighted by the smoothed idf a refit over `documents` documents
+    would give it. Existing tokens keep their columns and weights.
+    Returns (vectorizer, tokens added, tokens left out).
+    """
+    analyze = tfidf.build_analyzer()
+    codes, uniques = pd.factorize(pd.Series(feature_strings))
+    frequencies = Counter()
+    for string, count in zip(uniques, np.bincount(codes, minlength=len(uniques))):
+        for token in set(analyze(string)):
+            if token not in tfidf.vocabulary_:
+                frequencies[token] += int(count)
+
+    tokens = sorted(frequencies, key=lambda token: (-frequencies[token], token))
+    room = len(tokens) if tfidf.max_features is None else max(tfidf.max_features - len(tfidf.vocabulary_), 0)
+    added, left_out = tokens[:room], tokens[room:]
+    if not added:
+        return tfidf, added, left_out
+
+    extended = clone(tfidf)
+    extended.vocabulary_ = dict(tfidf.vocabulary_)
+    for token in added:
+        extended.vocabulary_[token] = len(extended.vocabulary_)
+    smooth = int(tfidf.smooth_idf)
+    frequency = np.array([frequencies[token] for token in added], dtype=np.float64)
+    extended.idf_ = np.concatenate([np.asarray(tfidf.idf_), np.log((documents + smooth) / (frequency + smooth)) + 1])
+    return extended, added, left_out
+
+
+def _widen(profiles, n_features, column_map=None):
+    """
+    Profile vectors moved to `n_features` columns, old column j landing on column_map[j]
+    """
+    indices = profiles.indices if column_map is None else column_map[profiles.indices].astype(profiles.indices.dtype)
+    return sp.csr_matrix((profiles.data, indices, profiles.indptr), shape=(profiles.shape[0], n_features))
+
+
+def refresh_bundle(new_members, root=BUNDLE_ROOT, version=None, events_offset=None):
+    """
+    Publish a new bundle version with the rows of `new_members` (a member
+    table with the bundle's columns) added to the current bundle's profile
+    index and member table, covering the event log up to `events_offset`
+    (default: the parent's). Returns a summary of the refresh.
+    """
+    started = time.perf_counter()
+    bundle = load_bundle(root)
+    manifest = bundle['manifest']
+    members = _bundle_members(root, manifest)
+    missing = [column for column in members.columns if column not in new_members.columns]
+    if missing:
+        raise ValueError(f"New members are missing columns: {missing}")
+    if not len(new_members):
+        raise ValueError("No new member rows to add")
+    new_members = new_members[list(members.columns)].reset_index(drop=True)
+
+    index = bundle['profile_index']
+    summary = {'parent': manifest['version'], 'rows': len(new_members)}
+    if bundle['feature_encoder'] is not None:
+        tfidf = None
+        feature_encoder, column_map = extend_feature_encoder(bundle['feature_encoder'], new_members)
+        profiles = _widen(index['profiles'], feature_encoder['n_features'], column_map)
+        features = encode_members(feature_encoder, new_members)
+        summary['new_columns'] = feature_encoder['n_features'] - bundle['feature_encoder']['n_features']
+    else:
+        feature_encoder = None
+        documents = len(members) + len(new_members)
+        tfidf, added, left_out = extend_tfidf(bundle['tfidf'], member_feature_strings(new_members), documents)
+        profiles = _widen(index['profiles'], len(tfidf.vocabulary_))
+        features = member_features({'tfidf': tfidf}, new_members)
+        summary['new_columns'] = len(added)
+        summary['tokens_left_out'] = len(left_out)
+
+    widened = profile_index_from_arrays(
+        profiles, index['histograms'], index['products'],
+        row_profiles=index['row_profiles'], row_labels=index['row_labels']
+    )
+    profile_index = append_to_profile_index(widened, features, new_members['portfolio_map'].to_numpy())
+    summary['new_profiles'] = len(profile_index['counts']) - len(index['counts'])
+
+    lineage = bundle_lineage(manifest)
+    lineage = {
+        'split_rows': lineage['split_rows'],
+        'appended_rows': lineage['appended_rows'] + len(new_members),
+        'parent': manifest['version'],
+    }
+    if events_offset is None:
+        events_offset = manifest.get('events_offset')
+    summary['version'] = publish_bundle(
+        tfidf, profile_index, pd.concat([members, new_members], ignore_index=True),
+        root=root, version=version, feature_encoder=feature_encoder, lineage=lineage, events_offset=events_offset
+    )
+    summary['seconds'] = time.perf_counter() - started
+    return summary
+
+
+def full_rebuild(bundle, members):
+    """
+    Featurizer and profile index fitted from scratch on `members` (the
+    bundle's whole member table) and the rows the bundle's index covers,
+    as re-running the notebook would. Returns (tfidf, feature_encoder, profile_index).
+    """
+    rows = training_rows(bundle_lineage(bundle['manifest']))
+    training = members.iloc[rows]
+    if bundle['feature_encoder'] is not None:
+        tfidf = None
+        feature_encoder = fit_feature_encoder(members)
+        features = encode_members(feature_encoder, training)
+    else:
+        feature_encoder = None
+        # The notebook fits TF-IDF on every row, not just the training split
+        tfidf = clone(bundle['tfidf']).fit(member_feature_strings(members))
+        features = member_features({'tfidf': tfidf}, training)
+    return tfidf, feature_encoder, profile_index_from_features(features, training['portfolio_map'].to_numpy())
+
+
+def _column_labels(tfidf, feature_encoder):
+    """
+    A name for every feature column that does not depend on column order:
+    the token, or the encoder field and category / age bin
+    """
+    if feature_encoder is None:
+        labels = np.empty(len(tfidf.vocabulary_), dtype=object)
+        for token, column in tfidf.vocabulary_.items():
+            labels[column] = token
+        return labels
+    labels = []
+    for field in feature_encoder['fields']:
+        if field['kind'] == 'categorical':
+            labels.extend(f"{field['column']}={category}" for category in field['categories'])
+        else:
+            labels.extend(f"{field['column']}:{position}" for position in range(field['size']))
+    return np.array(labels, dtype=object)
+
+
+def _labelled_histograms(profile_index, column_labels):
+    """
+    Product counts per profile, keyed by the profile's sorted column labels
+    instead of its position and vector, so indexes with differently ordered
+    (or, for TF-IDF, differently weighted) columns can be compared
+    """
+    profiles = sp.csr_matrix(profile_index['profiles'])
+    histograms = np.asarray(profile_index['histograms'])
+    labelled = {}
+    for profile, (start, end) in enumerate(zip(profiles.indptr[:-1], profiles.indptr[1:])):
+        key = tuple(sorted(column_labels[profiles.indices[start:end]]))
+        counts = labelled.setdefault(key, Counter())
+        for product, count in zip(profile_index['products'], histograms[profile]):
+            if count:
+                counts[str(product)] += int(count)
+    return labelled
+
+
+def check_consistency(root=BUNDLE_ROOT, probes=CONSISTENCY_PROBES, n=5, seed=0):
+    """
+    Compare the current bundle's profile index with a full rebuild over the
+    same rows: the product counts per profile, and the top-`n` KNN ranking
+    of `probes` member rows sampled with `seed`. Returns a report whose
+    'consistent' is False when the counts differ or the rankings agree on
+    fewer than MIN_RANKING_AGREEMENT of the probes; 'rebuild' holds the
+    rebuilt (tfidf, feature_encoder, profile_index).
+    """
+    bundle = load_bundle(root)
+    manifest = bundle['manifest']
+    members = _bundle_members(root, manifest)
+    tfidf, feature_encoder, rebuilt = full_rebuild(bundle, members)
+
+    current = _labelled_histograms(bundle['profile_index'], _column_labels(bundle['tfidf'], bundle['feature_encoder']))
+    expected = _labelled_histograms(rebuilt, _column_labels(tfidf, feature_encoder))
+    mismatched = sum(current.get(key) != expected.get(key) for key in set(current) | set(expected))
+
+    rng = np.random.default_rng(seed)
+    sample = members.iloc[np.sort(rng.choice(len(members), size=min(probes, len(members)), replace=False))]
+
+    def rankings(artifacts, profile_index):
+        ranked = knn_rank_members(
+            lambda features: profile_rank_products(profile_index, features),
+            lambda rows: member_features(artifacts, rows),
+            sample,
+        )
+        return [ranking[:n] for ranking in ranked]
+
+    agreement = np.mean([
+        left == right for left, right in zip(
+            rankings(bundle, bundle['profile_index']),
+            rankings({'tfidf': tfidf, 'feature_encoder': feature_encoder}, rebuilt),
+        )
+    ]) if len(sample) else 1.0
+
+    report = {
+        'version': manifest['version'],
+        'lineage': bundle_lineage(manifest),
+        'events_offset': manifest.get('events_offset'),
+        'profiles': len(bundle['profile_index']['counts']),
+        'rebuilt_profiles': len(rebuilt['counts']),
+        'mismatched_profiles': mismatched,
+        'probes': len(sample),
+        'ranking_agreement': float(agreement),
+        'rebuild': (tfidf, feature_encoder, rebuilt),
+    }
+    if feature_encoder is None:
+        # idf drift of the tokens both vocabularies hold
+        shared = [token for token in bundle['tfidf'].vocabulary_ if token in tfidf.vocabulary_]
+        current_idf = np.asarray(bundle['tfidf'].idf_)[[bundle['tfidf'].vocabulary_[token] for token in shared]]
+        rebuilt_idf = tfidf.idf_[[tfidf.vocabulary_[token] for token in shared]]
+        report['vocabulary'] = len(bundle['tfidf'].vocabulary_)
+        report['rebuilt_vocabulary'] = len(tfidf.vocabulary_)
+        report['max_idf_drift'] = float(np.abs(current_idf - rebuilt_idf).max()) if shared else 0.0
+    report['consistent'] = mismatched == 0 and report['ranking_agreement'] >= MIN_RANKING_AGREEMENT
+    return report
+
+
+def publish_rebuild(report, root=BUNDLE_ROOT, version=None):
+    """
+    Publish the full rebuild from a check_consistency report as a new
+    version over the same member table and rows
+    """
+    tfidf, feature_encoder, profile_index = report['rebuild']
+    bundle_dir = os.path.join(root, report['version'])
+    lineage = dict(report['lineage'], parent=report['version'])
+    return publish_bundle(
+        tfidf, profile_index, read_member_table(os.path.join(bundle_dir, 'members')),
+        root=root, version=version, feature_encoder=feature_encoder, lineage=lineage,
+        events_offset=report['events_offset']
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Refresh the profile index with new members, or check it against a full rebuild")
+    parser.add_argument('command', choices=['refresh', 'check'])
+    parser.add_argument('members', nargs='?', help="refresh: member rows to add (CSV or member table directory)")
+    parser.add_argument('--root', default=BUNDLE_ROOT)
+    parser.add_argument('--probes', type=int, default=CONSISTENCY_PROBES, help="Member rows ranked by both indexes")
+    parser.add_argument('--publish', action='store_true', help="check: publish the full rebuild when the check fails")
+    parser.add_argument('--events', help="refresh: purchase event log whose events so far are among the new rows")
+    args = parser.parse_args()
+
+    if args.command == 'refresh':
+        if not args.members:
+            parser.error("refresh needs the file of new member rows")
+        events_offset = log_offset(args.events) if args.events else None
+        summary = refresh_bundle(load_member_table(args.members), root=args.root, events_offset=events_offset)
+        print(f"Published {summary['version']} from {summary['parent']} in {summary['seconds']:.2f}s: "
+              f"{summary['rows']:,} rows, {summary['new_profiles']:,} new profiles, "
+              f"{summary['new_columns']:,} new feature columns")
+        if summary.get('tokens_left_out'):
+            print(f"{summary['tokens_left_out']:,} new tokens left out at max_features; run check to see the drift")
+        return
+
+    report = check_consistency(args.root, probes=args.probes)
+    print(f"Version {report['version']}: {report['profiles']:,} profiles against {report['rebuilt_profiles']:,} "
+          f"rebuilt, {report['mismatched_profiles']:,} with different counts; "
+          f"{report['ranking_agreement']:.2%} of {report['probes']:,} probes ranked alike")
+    if 'max_idf_drift' in report:
+        print(f"Vocabulary {report['vocabulary']:,} against {report['rebuilt_vocabulary']:,} rebuilt, "
+              f"max idf drift {report['max_idf_drift']:.4f}")
+    if report['consistent']:
+        print("Consistent with a full rebuild")
+    elif args.publish:
+        print(f"Published full rebuild {publish_rebuild(report, root=args.root)}")
+    else:
+        print("Drifted from a full rebuild; re-run with --publish to replace it")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,304 @@
+"""
+Incremental popularity counters fed by an append-only event log.
+
+The age-group and town rankings the rules read are product counts per
+segment. Instead of re-exporting the member table and rebuilding the
+popularity index, PopularityCounters is seeded once from a member table and
+then applies purchase events ("member X bought product P") as they are
+appended to a JSON-lines log, which stands in for a queue:
+
+    {"member_no": 1042, "product": "Equity Fund"}
+    {"member_no": 77, "product": "Dollar Fund", "age_group": "31-45", "town": "NAKURU"}
+
+An event counts as one more member-table row. Its age group and town come
+from the event or, when it only names the member, from the member store.
+Each segment key keeps a dict of product -> (count, first seen), so an
+event is a constant-time update that marks its keys changed; nothing is
+re-ranked then. The next read of `index` ranks each changed key once, by
+count and then first seen, so a burst of events between two reads costs
+one sort per key it touched (a few dozen products) rather than one per
+event, and the ranked lists always equal build_popularity_index over the
+table with the events appended.
+
+The counters are seeded at a log offset: the events before it are already
+rows of the seeding member table. An artifact bundle whose member table was
+exported after some events records the log offset it covers
+(publish_bundle's events_offset), and counters seeded from it resume there
+instead of counting those events twice. Snapshots hold the compacted counts
+and the log offset they cover, so a restart loads the snapshot and replays
+only the events after it.
+
+Usage:
+    python popularity_events.py append --member 1042 --product "Equity Fund"
+    python popularity_events.py snapshot --members investment_member.csv   # consume the log and snapshot
+"""
+import argparse
+import json
+import os
+import pickle
+import threading
+import time
+
+import numpy as np
+
+from member_store import lookup_member, read_member_store
+from member_table import RULE_TABLE_COLUMNS, load_member_table
+from popularity_index import SEGMENTS
+
+EVENTS_PATH = 'popularity_events.jsonl'
+SNAPSHOT_PATH = 'popularity_snapshot.pkl'
+SNAPSHOT_FORMAT = 1
+# Seconds between snapshots written by snapshot_if_due
+SNAPSHOT_INTERVAL = 300.0
+
+
+def append_event(event, path=EVENTS_PATH):
+    """
+    Append one event to the log as a single JSON line
+    """
+    line = json.dumps(event) + '\n'
+    with open(path, 'a') as file:
+        file.write(line)
+        file.flush()
+        os.fsync(file.fileno())
+
+
+def log_offset(path=EVENTS_PATH):
+    """
+    Byte offset just past the last complete line of the log (0 when there is
+    none): where a reader that has seen every event so far resumes
+    """
+    if not os.path.exists(path):
+        return 0
+    with open(path, 'rb') as file:
+        end = file.seek(0, os.SEEK_END)
+        while end > 0:
+            start = max(0, end - 65536)
+            file.seek(start)
+            newline = file.read(end - start).rfind(b'\n')
+            if newline >= 0:
+                return start + newline + 1
+            end = start
+    return 0
+
+
+def read_events(path=EVENTS_PATH, offset=0):
+    """
+    Yield (event, offset after it) for every complete line of the log from
+    byte `offset` on, with None for a line that is not valid JSON. A
+    trailing line still being written is left for the next read.
+    """
+    if not os.path.exists(path):
+        return
+    with open(path, 'rb') as file:
+        file.seek(offset)
+        for line in file:
+            if not line.endswith(b'\n'):
+                break
+            offset += len(line)
+            if not line.strip():
+                continue
+            try:
+                event = json.loads(line)
+            except ValueError:
+                event = None
+            yield event, offset
+
+
+class PopularityCounters:
+    """
+    Per-segment product counts kept ranked as events arrive.
+
+    `index` has the layout of popularity_index.build_popularity_index and
+    can be passed anywhere a popularity index is expected. Reading it
+    re-ranks the keys counted since the last read, replacing their lists
+    rather than mutating them, so a reader holding a list never sees it
+    change. `offset` is the log position the events in `members` run up
+    to; consume starts there.
+    """
+
+    def __init__(self, members, seed=None, offset=0):
+        self.seed = seed
+        self.offset = offset
+        self.events = 0
+        self._next_seen = len(members)
+        self.rejected = 0
+        self._counts = {segment: {} for segment in SEGMENTS}
+        self._last_snapshot = time.monotonic()
+        self._lock = threading.Lock()
+
+        rows = np.arange(len(members))
+        for segment, keys in SEGMENTS.items():
+            grouped = (
+                members[keys + ['portfolio_map']].assign(_row=rows)
+                .groupby(keys + ['portfolio_map'], sort=False, observed=True)['_row']
+                .agg(['size', 'min'])
+            )
+            for group, count, first_seen in zip(grouped.index, grouped['size'], grouped['min']):
+                key = group[0] if len(keys) == 1 else tuple(group[:-1])
+                self._counts[segment].setdefault(key, {})[group[-1]] = (int(count), int(first_seen))
+        self._rank_all()
+
+    def _rank_all(self):
+        """
+        Mark every key changed, so the first read ranks them all
+        """
+        self._ranked = {segment: {} for segment in SEGMENTS}
+        self._changed = {(segment, key) for segment, keyed in self._counts.items() for key in keyed}
+
+    @property
+    def index(self):
+        """
+        Ranked product lists in build_popularity_index's layout, with the
+        keys counted since the last read re-ranked first
+        """
+        with self._lock:
+            changed, self._changed = self._changed, set()
+            for segment, key in changed:
+                products = self._counts[segment][key]
+                self._ranked[segment][key] = sorted(
+                    products, key=lambda product: (-products[product][0], products[product][1])
+                )
+            return self._ranked
+
+    def _increment(self, segment, key, product):
+        products = self._counts[segment].setdefault(key, {})
+        count, first_seen = products.get(product, (0, self._next_seen))
+        products[product] = (count + 1, first_seen)
+        self._changed.add((segment, key))
+
+    def apply(self, event, store=None):
+        """
+        Count one purchase event. Segments missing from the event are looked
+        up by its member_no in `store`; raises ValueError when neither has them.
+        """
+        product = event.get('product')
+        if not product:
+            raise ValueError("Event has no product")
+        segments = {'age_group': event.get('age_group'), 'town': event.get('town')}
+        if None in segments.values() and store is not None and event.get('member_no') is not None:
+            member_data = lookup_member(store, event['member_no']) or {}
+            for field in segments:
+                segments[field] = segments[field] or member_data.get(field)
+        if None in segments.values():
+            raise ValueError(f"Cannot place event in a segment: {event}")
+
+        with self._lock:
+            for segment, keys in SEGMENTS.items():
+                key = tuple(segments[field] for field in keys)
+                self._increment(segment, key[0] if len(keys) == 1 else key, product)
+            self._next_seen += 1
+            self.events += 1
+
+    def consume(self, path=EVENTS_PATH, store=None):
+        """
+        Apply every event appended to the log since the last call. Events
+        that cannot be applied are counted in `rejected` and skipped, so one
+        bad line does not stall the log. Returns the number of events applied.
+        """
+        applied = 0
+        for event, offset in read_events(path, self.offset):
+            try:
+                if not isinstance(event, dict):
+                    raise ValueError("Event is not a JSON object")
+                self.apply(event, store=store)
+                applied += 1
+            except (ValueError, TypeError):
+                self.rejected += 1
+            self.offset = offset
+        return applied
+
+    def snapshot(self, path=SNAPSHOT_PATH):
+        """
+        Write the compacted counts and log offset to `path` atomically
+        """
+        state = {
+            'format': SNAPSHOT_FORMAT,
+            'seed': self.seed,
+            'offset': self.offset,
+            'events': self.events,
+            'next_seen': self._next_seen,
+            'counts': self._counts,
+        }
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as file:
+            pickle.dump(state, file)
+        os.replace(tmp_path, path)
+        self._last_snapshot = time.monotonic()
+
+    def snapshot_if_due(self, path=SNAPSHOT_PATH, interval=SNAPSHOT_INTERVAL):
+        """
+        snapshot at most once every `interval` seconds
+        """
+        if time.monotonic() - self._last_snapshot >= interval:
+            self.snapshot(path)
+
+    @classmethod
+    def from_snapshot(cls, path=SNAPSHOT_PATH):
+        """
+        Counters restored from a snapshot, ready to consume the log from its offset
+        """
+        with open(path, 'rb') as file:
+            state = pickle.load(file)
+        if state.get('format') != SNAPSHOT_FORMAT:
+            raise ValueError(f"Unsupported popularity snapshot format in {path}")
+        counters = cls.__new__(cls)
+        counters.seed = state['seed']
+        counters.offset = state['offset']
+        counters.events = state['events']
+        counters.rejected = 0
+        counters._next_seen = state['next_seen']
+        counters._counts = state['counts']
+        counters._last_snapshot = time.monotonic()
+        counters._lock = threading.Lock()
+        counters._rank_all()
+        return counters
+
+
+def load_counters(members, seed, snapshot_path=SNAPSHOT_PATH, offset=0):
+    """
+    Counters from `snapshot_path` when it was taken over the same `seed`
+    (e.g. an artifacts signature), otherwise freshly seeded from `members`
+    at log `offset`
+    """
+    if os.path.exists(snapshot_path):
+        try:
+            counters = PopularityCounters.from_snapshot(snapshot_path)
+            if counters.seed == seed:
+                return counters
+        except (OSError, pickle.UnpicklingError, EOFError, KeyError, ValueError):
+            pass
+    return PopularityCounters(members, seed=seed, offset=offset)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Append purchase events or snapshot the popularity counters")
+    parser.add_argument('command', choices=['append', 'snapshot'])
+    parser.add_argument('--events', default=EVENTS_PATH)
+    parser.add_argument('--snapshot', default=SNAPSHOT_PATH)
+    parser.add_argument('--member', type=int, help="Member number of the event")
+    parser.add_argument('--product', help="Product bought")
+    parser.add_argument('--age-group', help="Age group, when the member is not in the member store")
+    parser.add_argument('--town', help="Town, when the member is not in the member store")
+    parser.add_argument('--members', default='investment_member.csv', help="Member table the counters are seeded from")
+    parser.add_argument('--store', help="Member store for events that only name the member")
+    args = parser.parse_args()
+
+    if args.command == 'append':
+        if not args.product:
+            parser.error("append needs --product")
+        event = {'member_no': args.member, 'product': args.product}
+        event.update({field: value for field, value in [('age_group', args.age_group), ('town', args.town)] if value})
+        append_event(event, args.events)
+        return
+
+    store = read_member_store(args.store) if args.store else None
+    members = load_member_table(args.members, columns=RULE_TABLE_COLUMNS)
+    counters = load_counters(members, seed=os.path.abspath(args.members), snapshot_path=args.snapshot)
+    applied = counters.consume(args.events, store=store)
+    counters.snapshot(args.snapshot)
+    print(f"Applied {applied:,} new events ({counters.events:,} in all); snapshot at offset {counters.offset} -> {args.snapshot}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+import os
+import pickle
+
+# Cached next to model.pkl / tfidf.pkl
+POPULARITY_INDEX_PATH = 'popularity_index.pkl'
+
+# Segments the rule-based recommendations rank products over
+SEGMENTS = {
+    'age_group': ['age_group'],
+    'town': ['town'],
+    'age_group_town': ['age_group', 'town'],
+}
+
+
+def _rank_products(df, keys):
+    """
+    Rank portfolio_map by member count within each group of `keys`.
+    Ties keep first-seen order, the same ordering value_counts() gives.
+    """
+    counts = (
+        df.groupby(keys + ['portfolio_map'], sort=False, observed=True)
+        .size()
+        .reset_index(name='count')
+        .sort_values('count', ascending=False, kind='stable')
+    )
+
+    ranked = {}
+    for key, group in counts.groupby(keys, sort=False, observed=True):
+        if len(keys) == 1 and isinstance(key, tuple):
+            key = key[0]
+        ranked[key] = group['portfolio_map'].tolist()
+    return ranked
+
+
+def build_popularity_index(df):
+    """
+    Build the ranked product lists for every age group, town and
+    (age group, town) pair in one pass over the member table
+    """
+    return {segment: _rank_products(df, keys) for segment, keys in SEGMENTS.items()}
+
+
+def _source_signature(source_path):
+    stat = os.stat(source_path)
+    return {'path': os.path.abspath(source_path), 'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}
+
+
+def load_popularity_index(df, source_path, cache_path=POPULARITY_INDEX_PATH):
+    """
+    Load the popularity index from `cache_path`, rebuilding it from `df`
+    whenever the member table at `source_path` has changed since it was cached
+    """
+    signature = _source_signature(source_path)
+
+    if os.path.exists(cache_path):
+        try:
+            with open(cache_path, 'rb') as file:
+                cached = pickle.load(file)
+            if cached.get('source') == signature:
+                return cached['index']
+        except (OSError, pickle.UnpicklingError, EOFError, KeyError, AttributeError):
+            pass
+
+    index = build_popularity_index(df)
+
+    tmp_path = f"{cache_path}.tmp"
+    with open(tmp_path, 'wb') as file:
+        pickle.dump({'source': signature, 'index': index}, file)
+    os.replace(tmp_path, cache_path)
+
+    return index
+
+
+def ranked_products(index, segment, key):
+    """
+    Ranked product list for one segment key, e.g. ranked_products(index, 'town', 'NAIROBI')
+    """
+    return index[segment].get(key, [])
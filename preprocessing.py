@@ -0,0 +1,341 @@
+"""
+Streaming preprocessing of the raw member extract (single_member.csv) into
+investment_member.csv, following the cleaning steps in the notebook.
+
+The raw file is read in chunks; rows are deduplicated across chunks with a set
+of 64-bit row hashes, so memory is bounded by the chunk size plus one hash per
+distinct row rather than by the ~7.5M raw rows.
+
+Usage:
+    python preprocessing.py --raw single_member.csv --output investment_member.csv
+    python preprocessing.py --table investment_member   # also write the columnar member table
+"""
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from member_table import write_member_table
+
+RAW_COLUMNS = [
+    'member_no', 'reg_date', 'dob', 'hse_no', 'gender', 'town',
+    'relationship', 'beneficiery_dob', 'portfolio'
+]
+OUTPUT_COLUMNS = [
+    'member_no', 'town', 'relationship', 'gender_mapped', 'member_age',
+    'beneficiery_age', 'portfolio_map', 'age_group'
+]
+
+# Mapping dictionary
+relationship_map = {
+    'partner': [
+        'partner', 'spouse', 'sp0use','husband', 'wife', 'fiancee', 'ex-wife', 'spouce', 'fiancé',
+        'husband ', 'sponse', 'spouse ', 'wiFe', 'wifE', 'wife ', 'spouse', 'married', 'marriage',
+        'husband/spouse', 'ex-wife', 'fiance ', 'fiance', 'married ', 'myson', 'baby mama ',
+        'fiancee ', 'souse', 'hubby', 'dating', 'boyfriend', 'girlfriend', 'ex wife', 'boyfriend ',
+        'girlfriend ', 'wife/guardian', 'ex husband', 'girl friend', 'fiancée', 'sopouse', 'spoudse',
+        'soPOUSE', 'spause', 'sposue', 'ex husband', 'love', 'b/f', 'g/f', 'divorcee', 'ex spouse',
+        'bf', 'gf', 'b/f', 'g/f', 'fiancé ', 'domesticpartner', 'domestic partner', 'dating', 'exwife',
+        'exhusband', 'wive', 'husb', 'exspouse', 'partner ', 'significant other', 'fiancee','companion','Partner',
+        'Husband ', 'Husband',  'Wife',   'SPOUSE' , 'Spouse ', 'WIfe', 'Spouse',  'wife', 'Wife ', 'spouse', 'partner',
+        'HUSBAND', 'husband', 'husband ',  'SP0USE' , 'SPOUSE ',  'wife ',
+        'spouse ', 'Partner ' , 'FIANCEE', 'Fiancee',  'HUSBAND ',  'FIANCE', 
+        'wIFE', 'PARTNER',  'Domestic Partner', 'PATNER', 'Fiance ', 'PARTNER ',  'hUSBAND',  'Boyfriend ',
+        'WIFE ', 'fiancee', 'JOINT PARTNER', 'Fiancé ' , 'Husband/spouse', 'SPOUCE',  'Patner', 'Spouce',  
+        'Fiance', 'BOYFRIEND', 'EX-WIFE',  'PARNT',  'GIRLFRIED'
+    ],
+    'child': [
+        'child', 'kid', 'daughter', 'son', 'children', 'daughter33', 'doughter', 'daugther', 'doughter ',
+        'daugther', 'son ', 'daughter ', 'child minor', 'kids', 'baby', 'infant', 'toddler', 'sonS',
+        'minor', 'child ', 'son/sister', 'chid', 'newborn', 'son/brother', 'childnephew',
+        'chils', 'chiLD', 'kID', 'dau`', 'daugher', 'childnephew', 'my son','child', 'son', 'dau', 
+        'daughter', 'daughter33', 'my son', 'infant', 'childnephew', 'kids', 'baby', 'ChiLD', 'CHID',
+        'sON', 'cHILS', 'CHID', 'CHIILD', 'KID', 'FOSTER' 'DAUGHTER', 'CHILD MINOR', 'MINOR', 'CHILDREN', 
+        'SOM', 'CHILDREN', 'JUNIOR', 'BABY',  'CHIL', 'DAUGHTER/CHILDDAUGHER', 'CHILF', 'DOUGHTER', 'DAIGHTER', 
+        'DAUGHTE', 'DAUGHETR', 'S0N','MYSON','child','CHILD','Child ','DAUGHTER/CHILD','child ','CHILD MINOR',
+        'CHILD ','children','CHILDREN','ChILD','ChiLD'
+    ],
+    'parent': [
+        'mother', 'mom', 'mum', 'father', 'dad', 'parent', 'parents', 'mother ', 'father ', 'mOTHER',
+        'dad ', 'mum ', 'mom ', 'mummy', 'daddy', 'papa', 'mama', 'mother in law', 'father in law',
+        'mothers', 'fathers', 'moms', 'mums', 'father-in-law', 'mother-in-law', 'mommy', 'dadi', 'momi',
+        'parent ', 'mother to son', 'mother of child', 'parents', 'mother- guardian', 'father - guardian',
+        'parentchild', 'parental', 'parenthood', 'parenting', 'mother IN LAW', 'mom in law', 'dad in law',
+        'mum in law', 'parenting', 'fatherhood', 'motherhood', 'parent ', 'grandparent', 'step mother',
+        'step father', 'step-mother', 'step-father','Parent', 'Parents', 'Mother', 'Mothers', 'Mom', 'Mum', 
+        'Father', 'DAD', 'Dad', 'Guardian', 'Grandmother', 'Grandfather', 'Step-mother', 'Step-father', 'Foster parent',
+        'Mother-in-law', 'Father-in-law', 'ParentChild', 'Mama', 'Mummy', 'Dadi', 'Mother TO SON', 'PARENT', 'MOther'
+    ],
+    'self': [
+        'self', 'owner', 'me', 'myself', 'self ', 'owner ', 'i', 'myself ', 'personal', 'individual',
+        'own', 'my own', 'self-employed', 'proprietor', 'me ', 'self employed', 'self own', 'personal account',
+        'my account', 'own account'
+    ],
+    'guardian': [
+        'guardian', 'custodian', 'trustee', 'guard', 'guardian ', 'custodian ', 'trustee ', 'guard ',
+        'legal guardian', 'guardianship', 'custodianship', 'trusteeship', 'protector', 'caregiver',
+        'conservator','conservator', 'foster parent', 'foster guardian', 'legal custodian', 'guardian-mother', 'guardian father'
+    ],
+    'sibling': [
+        'siblings', 'brother', 'sister', 'sibling', 'brother ', 'sister ', 'bro', 'sis', 'brothers', 'sisters',
+        'sibling ', 'brother-in-law', 'sister-in-law', 'sibling in law', 'brother and sister', 'sibbling',
+        'siBLING', 'sibblings', 'sister in law', 'brother in law', 'sister/guardian', 'sister - guardian',
+        'sister-guardian', 'bros', 'sisses', 'step-sister', 'step-brother', 'half-sister', 'half-brother', 'broski','Sister', 'Brother ','brother', 'sister',
+       'Sister ', 'SISTER','Sibling', 'brother ','Sibling ','SISTER ','Sistet', 'Bro', 'Sis', 'SiBLING',
+        'SIBLING',  's0n', 'sister ''sISTER', 'sisiter', ' BROTHER','BRother', 'SisteR', 'SIS', 
+       'som',
+       'Sister- Custodian', 
+       'SIIBLING', 'SIBLINGS','Brother and sister',
+       'Sibbling'
+    ],
+    'relative': [
+        'cousin', 'nephew', 'grand child', 'niece', 'grandmother', 'granddaughter', 'grandson', 'grandfather', 'uncles', 'aunties',
+        'aunt', 'uncle', 'granny', 'grandparent', 'grand child', 'relative', 'relatives', 'cousins', 'uncles',
+        'aunties', 'aunts', 'grandparents', 'great grandmother', 'great grandfather', 'grand children', 'extended family',
+        'grandmother ', 'grandfather ', 'nephew ', 'niece ', 'cousin ', 'aunt ', 'uncle ', 'granny ', 'granddaughter ',
+        'grandson ', 'grandchild', 'grandchild ', 'grandchildren', 'grandkids', 'great grandparent', 'ancestors', 'descendants',
+        'kin', 'kinship', 'next of kin', 'in-laws', 'inlaw', 'in laws', 'extended relatives', 'b inlaw', 'in law','family tree', 'Cousin', ' Grand daughter', 'Nephew', 'NIECE', 'Niece', 'AUNT', 'relative', 'AUNTIE', 'B INLAW', 'COUSIN', 'aunt', 'UNCLE', 'GRAND SON', 'Nephew ', 'Cousin ', 'nephew', 'GRAND DAUGHTER', 'Niece ', 'granddaughter', 'grandson', 'RELATIVE', 'Daughter-in-law ', 'GRANDMOTHER', 'Relative ', 'uncle',
+'NEPHEW', 'Grand daughter', 'DAUGHTER-IN-LAW', 'COUSN', 'Uncle', 'Granddaughter ', 'Aunt ', 'cousin', 'GRANDSON ', 'uncle ', 'AUNTY', 'FATHER-IN-LAW', 'GRAND FATHER', 'DGRAND DAUGHTER', 'GRAND MOTHER', 'UN,CLE', 'GRAND CHILD', 'Sister in law', 'Grand Daughter', 'GRANDDAUGTER', 'NiecE', 'Brother-IN-LAW', 'Grand mother', 'GRANDFATHER', 'Daughter in law', 'Sister-IN-LAW', 'GRAND-DAUGHTER', 'GRANNY', 
+'GRANDCHILD', 'Aunty', 'Cousins', 'Cousins ', 'Auntie', 'GRANDPA', 'Brother in Law', 'IN LAW', 'Granddaughter', 'niece', 'Grand Son', 'Sister-in law', 'CLOUSIN', 'GRANSON', 'Sister IN LAW', 'Brother-in-law', 'Sister-Inlaw', 'Brother in law', 'GRAND-MOTHER', 'Grand-mother', 'Mother-in-law', 'SISTER IN LAW ', 'Grand mother ', 'Childnephew', 'Grand daughter ', 'auntie', 'In law', 'Sister in-law', 'Aunty '
+    ],
+    'friends': ['friend','closefriend', 'confidant', 'friend ',
+        'peers', 'acquaintance', 'comrade', 'pal', 'buddy', 'mate', 'fellow', 'ally', 'supporter',
+        'confidante', 'friend of the family', 'family friend',
+        'peer', 'companion', 'companions'
+    ],
+    'professional':['colleague', 'coworker', 'partner in law',
+        'associate', 'advisor', 'mentor', 'colleague ', 'coworker ',
+        'associate ', 'colleague', 'professional', 'mentor', 'adviser', 'counselor', 'legal representative', 'executor', 'business partner',
+        'co-worker', 'workmate', 'teammate',
+        'partner in business', 'business associate', 'collaborator', 'collegue','estate'
+    ],
+    'other': ['spiritual advisor','sponsor'
+    ]
+}
+
+gender_map = {
+    'Female':'Female','F':'Female','FEMALE':'Female',
+    'Male':'Male','M':'Male','MALE':'Male',
+}
+
+portfolio_map ={
+    'Money Mrket':'Money Market','MoneyMarket':'Money Market',
+    'Equity Fund':'Equity Fund',
+    'Dollar Fund':'Dollar Fund',
+    'Balanced Fund':'Balanced Fund',
+    'Fixed Income':'Fixed Income',
+    'Wealth Fund':'Wealth Fund',
+}
+
+age_bins = [0, 18, 30, 45, 60, 100]
+age_labels = ['0-18', '19-30', '31-45', '46-60', '60+']
+
+# Beneficiary ages outside these bounds are clipped
+AGE_LOWER_BOUND = 0
+AGE_UPPER_BOUND = 100
+
+DEFAULT_CHUNK_SIZE = 500_000
+
+
+def invert_map(category_map):
+    """
+    Compile a {category: [spellings]} map into a {spelling: category} lookup.
+    A spelling listed under several categories keeps the first one, as the
+    notebook's linear search did.
+    """
+    lookup = {}
+    for category, keywords in category_map.items():
+        for keyword in keywords:
+            lookup.setdefault(keyword, category)
+    return lookup
+
+
+# Compiled once at import
+relationship_lookup = invert_map(relationship_map)
+
+
+def map_relationship(value):
+    return relationship_lookup.get(value.lower().strip(), 'other')  # Default category if no matches found
+
+
+def normalize_column(series, transform):
+    """
+    Apply `transform` to the distinct values of `series` only and broadcast the
+    results back through category codes. Returns a categorical Series;
+    missing values stay missing.
+    """
+    column = series.astype('category')
+    mapped = pd.Index([transform(value) for value in column.cat.categories])
+    # Several raw spellings can map to one label, so re-factorize the mapped categories
+    mapped_codes, categories = pd.factorize(mapped)
+
+    codes = column.cat.codes.to_numpy()
+    codes = np.where(codes >= 0, mapped_codes[codes], -1)
+    return pd.Series(pd.Categorical.from_codes(codes, categories=categories), index=series.index)
+
+
+def calculate_ages(birth_dates, today):
+    """
+    Age in whole years on `today` for a datetime64 Series, NaN where the date is missing.
+    Same rule as the notebook's calculate_age, evaluated on the whole column at once.
+    """
+    days = birth_dates.to_numpy(dtype='datetime64[D]')
+    years, months, month_days = _civil_from_days(days.astype(np.int64))
+
+    # Birthdays compared as month * 100 + day, e.g. 6 April -> 406
+    birthday_to_come = months * 100 + month_days > today.month * 100 + today.day
+
+    ages = (today.year - years - birthday_to_come).astype(float)
+    ages[np.isnat(days)] = np.nan
+    return pd.Series(ages, index=birth_dates.index)
+
+
+def _civil_from_days(days):
+    """
+    (year, month, day) arrays from days since 1970-01-01, in integer arithmetic
+    (H. Hinnant's civil_from_days), which is several times faster than numpy's
+    datetime64[M]/[Y] casts
+    """
+    z = days + 719468
+    era = np.floor_divide(z, 146097)
+    day_of_era = z - era * 146097
+    year_of_era = (day_of_era - day_of_era // 1460 + day_of_era // 36524 - day_of_era // 146096) // 365
+    day_of_year = day_of_era - (365 * year_of_era + year_of_era // 4 - year_of_era // 100)
+    shifted_month = (5 * day_of_year + 2) // 153
+    month_days = day_of_year - (153 * shifted_month + 2) // 5 + 1
+    months = np.where(shifted_month < 10, shifted_month + 3, shifted_month - 9)
+    years = year_of_era + era * 400 + (months <= 2)
+    return years, months, month_days
+
+
+def deduplicate_chunk(chunk, seen):
+    """
+    Drop rows of `chunk` already seen in this chunk or an earlier one.
+    `seen` is the running set of row hashes and is updated in place.
+    """
+    hashes = pd.util.hash_pandas_object(chunk, index=False)
+    first_in_chunk = ~hashes.duplicated().to_numpy()
+
+    keep = np.zeros(len(chunk), dtype=bool)
+    for position in np.flatnonzero(first_in_chunk):
+        row_hash = int(hashes.iat[position])
+        if row_hash not in seen:
+            seen.add(row_hash)
+            keep[position] = True
+    return chunk[keep]
+
+
+def clean_chunk(df, today):
+    """
+    Apply the notebook's cleaning steps to a block of deduplicated raw rows,
+    with ages taken on the fixed reference date `today`.
+    Missing ages are left for fill_missing_ages, which needs the whole-file mode.
+    """
+    df = df.drop(columns=['reg_date', 'hse_no'])
+
+    # Relationship: fill missing with 'son', then lower-case and map onto categories
+    df['relationship'] = normalize_column(df['relationship'].fillna('son'), map_relationship)
+
+    # Gender
+    df['gender_mapped'] = normalize_column(df.gender.fillna('Female'), lambda value: gender_map.get(value, value))
+
+    # Ages from dates of birth (dob filled with the modal date)
+    df['dob'] = pd.to_datetime(df.dob.fillna('1962-01-01'), errors='coerce', format='ISO8601')
+    df['member_age'] = calculate_ages(df['dob'], today)
+    df['beneficiery_dob'] = pd.to_datetime(df['beneficiery_dob'], errors='coerce', format='ISO8601')
+    df['beneficiery_age'] = calculate_ages(df['beneficiery_dob'], today)
+
+    # Portfolio and town
+    df['portfolio_map'] = normalize_column(
+        df.portfolio.fillna('Money Market'), lambda value: portfolio_map.get(value, value)
+    )
+    df['town'] = df.town.fillna('Unknown').astype('category')
+
+    return df.drop(columns=['dob', 'gender', 'portfolio', 'beneficiery_dob'])
+
+
+def fill_missing_ages(df, member_age_mode, beneficiary_age_mode):
+    """
+    Fill missing ages with the whole-file mode, clip beneficiary ages and bin member ages
+    """
+    df['member_age'] = df['member_age'].fillna(member_age_mode).astype('int64')
+    df['beneficiery_age'] = df['beneficiery_age'].fillna(beneficiary_age_mode).astype(float)
+    df['beneficiery_age'] = df['beneficiery_age'].clip(lower=AGE_LOWER_BOUND, upper=AGE_UPPER_BOUND)
+    df['age_group'] = pd.cut(df['member_age'], bins=age_bins, labels=age_labels)
+    return df[OUTPUT_COLUMNS]
+
+
+def _mode(counts):
+    """
+    Most frequent value of a value_counts-style Series (smallest value on ties, like Series.mode()[0])
+    """
+    return counts[counts == counts.max()].index.min()
+
+
+def preprocess(raw_path, output_path, chunksize=DEFAULT_CHUNK_SIZE, reference_date=None):
+    """
+    Stream `raw_path` into a cleaned member table at `output_path`.
+
+    Pass 1 deduplicates and cleans each chunk into a part file while counting
+    ages; pass 2 streams the part file back, filling missing ages with the
+    mode over the whole file. Ages are taken on `reference_date` (default:
+    today, fixed once for the whole run). Returns the number of rows written.
+    """
+    today = pd.Timestamp(reference_date) if reference_date is not None else pd.Timestamp.today()
+    part_path = f"{output_path}.part"
+    seen = set()
+    member_age_counts = pd.Series(dtype='int64')
+    beneficiary_age_counts = pd.Series(dtype='int64')
+
+    header = True
+    for chunk in pd.read_csv(raw_path, usecols=RAW_COLUMNS, dtype=str, chunksize=chunksize):
+        chunk = deduplicate_chunk(chunk[RAW_COLUMNS], seen)
+        if chunk.empty:
+            continue
+        cleaned = clean_chunk(chunk, today)
+        member_age_counts = member_age_counts.add(cleaned['member_age'].value_counts(), fill_value=0)
+        beneficiary_age_counts = beneficiary_age_counts.add(cleaned['beneficiery_age'].value_counts(), fill_value=0)
+        cleaned.to_csv(part_path, mode='w' if header else 'a', header=header, index=False)
+        header = False
+
+    if header:
+        raise ValueError(f"No rows found in {raw_path}")
+
+    member_age_mode = _mode(member_age_counts)
+    beneficiary_age_mode = _mode(beneficiary_age_counts)
+
+    rows = 0
+    header = True
+    part_reader = pd.read_csv(
+        part_path, dtype={'member_no': str}, keep_default_na=False, na_values=[''], chunksize=chunksize
+    )
+    for chunk in part_reader:
+        chunk = fill_missing_ages(chunk, member_age_mode, beneficiary_age_mode)
+        chunk.to_csv(output_path, mode='w' if header else 'a', header=header, index=False)
+        header = False
+        rows += len(chunk)
+
+    os.remove(part_path)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build investment_member.csv from the raw member extract")
+    parser.add_argument('--raw', default='single_member.csv')
+    parser.add_argument('--output', default='investment_member.csv')
+    parser.add_argument('--chunksize', type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument('--reference-date', help="Date ages are computed on (YYYY-MM-DD, default today)")
+    parser.add_argument('--table', help="Also write the columnar member table to this directory")
+    args = parser.parse_args()
+
+    rows = preprocess(args.raw, args.output, chunksize=args.chunksize, reference_date=args.reference_date)
+    print(f"Wrote {rows:,} rows to {args.output}")
+
+    if args.table:
+        write_member_table(pd.read_csv(args.output), args.table)
+        print(f"Wrote columnar member table to {args.table}/")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,293 @@
+import numpy as np
+import scipy.sparse as sp
+from sklearn.preprocessing import normalize
+
+from knn_recommender import rank_votes
+
+# Queries scored against the distinct profiles per block, bounding the dense similarity matrix
+QUERY_CHUNK_SIZE = 1024
+
+
+def _row_keys(matrix):
+    """
+    Byte key of every CSR row (column indices + values), equal for identical rows
+    """
+    matrix = matrix.tocsr(copy=True)
+    matrix.sort_indices()
+    # scipy picks int32 or int64 indices by size; keys must not depend on which
+    indices = matrix.indices.astype(np.int64, copy=False)
+    keys = []
+    for start, end in zip(matrix.indptr[:-1], matrix.indptr[1:]):
+        keys.append(indices[start:end].tobytes() + matrix.data[start:end].tobytes())
+    return keys
+
+
+def build_profile_index(model, labels):
+    """
+    Collapse the rows model.pkl was fitted on into distinct feature profiles.
+
+    The TF-IDF features only take a few thousand distinct values, so the
+    ~100k training rows are stored as one vector per profile plus a
+    histogram of the products held by the rows sharing it. Each row's
+    profile and product are kept too (a few bytes per row), so the profile
+    straddling the n_neighbors boundary can give up its earliest rows, the
+    ones brute force takes.
+    """
+    return profile_index_from_features(model._fit_X, labels)
+
+
+def profile_index_from_features(features, labels):
+    """
+    Profile index over the rows of an L2-normalised feature matrix and
+    their product labels (see build_profile_index)
+    """
+    products, label_codes = np.unique(labels, return_inverse=True)
+    features = sp.csr_matrix(features)
+    keys = _row_keys(features)
+
+    key_to_profile = {}
+    row_profiles = np.empty(len(keys), dtype=np.int64)
+    first_rows = []
+    for row, key in enumerate(keys):
+        profile = key_to_profile.setdefault(key, len(first_rows))
+        if profile == len(first_rows):
+            first_rows.append(row)
+        row_profiles[row] = profile
+
+    histograms = np.zeros((len(first_rows), len(products)), dtype=np.int64)
+    np.add.at(histograms, (row_profiles, label_codes), 1)
+
+    return profile_index_from_arrays(
+        features[first_rows], histograms, products,
+        row_profiles=row_profiles.astype(np.int32), row_labels=label_codes.astype(np.int16)
+    )
+
+
+def profile_index_from_arrays(profiles, histograms, products, row_profiles=None, row_labels=None):
+    """
+    Assemble a profile index from its stored arrays (distinct profile vectors,
+    per-profile product histograms and the product names the columns refer
+    to), plus the profile and product code of every training row in
+    training order when known
+    """
+    profiles = sp.csr_matrix(profiles)
+    counts = np.asarray(histograms.sum(axis=1))
+    profile_rows = profile_starts = None
+    if row_profiles is not None:
+        # Every profile's training rows, in training order, one profile after the other
+        profile_rows = np.argsort(row_profiles, kind='stable')
+        profile_starts = np.concatenate([[0], np.cumsum(counts)])
+    return {
+        'profiles': profiles,
+        'histograms': histograms,
+        'counts': counts,
+        'products': np.asarray(products, dtype=object),
+        'keys': {key: profile for profile, key in enumerate(_row_keys(profiles))},
+        'row_profiles': row_profiles,
+        'row_labels': row_labels,
+        'profile_rows': profile_rows,
+        'profile_starts': profile_starts,
+    }
+
+
+def append_to_profile_index(index, features, labels):
+    """
+    Profile index with the rows of `features` and their labels added to
+    `index`, whose profiles must already have the width of `features`.
+    Rows whose profile is indexed add to its histogram; new profiles are
+    appended after the existing ones. Products stay sorted, as
+    profile_index_from_features orders them.
+    """
+    added = profile_index_from_features(features, labels)
+    products = np.union1d(np.asarray(index['products'], dtype=object), added['products'])
+    old_columns = np.searchsorted(products, index['products'])
+    added_columns = np.searchsorted(products, added['products'])
+
+    new_profiles = []
+    targets = np.empty(len(added['counts']), dtype=np.int64)
+    for key, profile in added['keys'].items():
+        target = index['keys'].get(key)
+        if target is None:
+            target = len(index['counts']) + len(new_profiles)
+            new_profiles.append(profile)
+        targets[profile] = target
+
+    histograms = np.zeros((len(index['counts']) + len(new_profiles), len(products)), dtype=np.int64)
+    histograms[:len(index['counts']), old_columns] = index['histograms']
+    np.add.at(histograms, (targets[:, None], added_columns[None, :]), added['histograms'])
+    profiles = sp.vstack([sp.csr_matrix(index['profiles']), added['profiles'][new_profiles]], format='csr')
+
+    # The added rows follow the indexed ones in training order
+    row_profiles = row_labels = None
+    if index.get('row_profiles') is not None:
+        row_profiles = np.concatenate([index['row_profiles'], targets[added['row_profiles']]]).astype(np.int32)
+        row_labels = np.concatenate([
+            old_columns[index['row_labels']], added_columns[added['row_labels']]
+        ]).astype(np.int16)
+    return profile_index_from_arrays(profiles, histograms, products, row_profiles=row_profiles, row_labels=row_labels)
+
+
+def _earliest_rows(index, queries, profiles, needed):
+    """
+    The needed[i] earliest training rows over the profiles tied at query
+    i's boundary, for every (queries[j], profiles[j]) pair. Returns the
+    (query, row) of each, grouped by query in training order.
+    """
+    profile_rows, starts = index['profile_rows'], index['profile_starts']
+    # A profile whose first row is not among the query's needed earliest first rows gives none
+    first_rows = profile_rows[starts[profiles]]
+    order = np.lexsort((first_rows, queries))
+    queries, profiles = queries[order], profiles[order]
+    rank = np.arange(len(queries)) - np.searchsorted(queries, queries)
+    keep = rank < needed[queries]
+    queries, profiles = queries[keep], profiles[keep]
+
+    taken = np.minimum(index['counts'][profiles], needed[queries])
+    pairs = np.repeat(np.arange(len(queries)), taken)
+    offsets = np.arange(len(pairs)) - np.repeat(np.cumsum(taken) - taken, taken)
+    queries, rows = queries[pairs], profile_rows[starts[profiles[pairs]] + offsets]
+
+    order = np.lexsort((rows, queries))
+    queries, rows = queries[order], rows[order]
+    keep = np.arange(len(queries)) - np.searchsorted(queries, queries) < needed[queries]
+    return queries[keep], rows[keep]
+
+
+def _neighbour_votes(index, features, keys, n_neighbors):
+    """
+    Vote and similarity totals per product over the n_neighbors nearest
+    training rows, equidistant rows at the boundary taken in training order
+    as knn_recommender.knn_rank_products takes them.
+
+    A query whose own profile (`keys` are its row keys) holds n_neighbors
+    rows takes that profile's earliest rows. Other queries rank the
+    distinct profiles by cosine distance: profiles nearer than the
+    n_neighbors-th row count with their whole histograms, and only the
+    profiles at that row's distance are split, by their stored row order.
+    Each row's similarity is added in distance order, as brute force adds
+    it, so the totals agree to the last bit.
+    """
+    votes = np.zeros((features.shape[0], len(index['products'])))
+    vote_similarity = np.zeros_like(votes)
+    histograms, counts, row_labels = index['histograms'], index['counts'], index['row_labels']
+    profile_rows, starts = index['profile_rows'], index['profile_starts']
+    profiles = normalize(index['profiles'])
+
+    def add(rows, codes, similarity):
+        np.add.at(votes, (rows, codes), 1)
+        np.add.at(vote_similarity, (rows, codes), similarity)
+
+    # Exact key hits: no profile is nearer than the query's own
+    own = np.array([index['keys'].get(key, -1) for key in keys], dtype=np.int64)
+    hits = np.flatnonzero((own >= 0) & (counts[np.maximum(own, 0)] >= n_neighbors))
+    if len(hits):
+        similarity = np.asarray(normalize(features[hits]).multiply(profiles[own[hits]]).sum(axis=1)).ravel()
+        similarity = 1 - np.clip(1 - similarity, 0, 2)
+        rows = profile_rows[starts[own[hits]][:, None] + np.arange(n_neighbors)]
+        add(np.repeat(hits, n_neighbors), row_labels[rows].ravel(), np.repeat(similarity, n_neighbors))
+
+    searched = np.setdiff1d(np.arange(features.shape[0]), hits)
+    nearest = min(n_neighbors, profiles.shape[0])
+    for start in range(0, len(searched), QUERY_CHUNK_SIZE):
+        rows = searched[start:start + QUERY_CHUNK_SIZE]
+        queries = np.arange(len(rows))[:, None]
+        distances = 1 - (normalize(features[rows]) @ profiles.T).toarray()
+        np.clip(distances, 0, 2, out=distances)
+
+        # The n_neighbors nearest profiles hold at least n_neighbors rows
+        candidates = np.argpartition(distances, nearest - 1, axis=1)[:, :nearest]
+        candidates = candidates[queries, np.argsort(distances[queries, candidates], axis=1, kind='stable')]
+        candidate_distances = distances[queries, candidates]
+        boundary = (np.cumsum(counts[candidates], axis=1) < n_neighbors).sum(axis=1)
+        boundary_distances = candidate_distances[queries[:, 0], boundary]
+
+        # Nearer profiles count in full, nearest first
+        query, position = np.nonzero(candidate_distances < boundary_distances[:, None])
+        nearer = candidates[query, position]
+        products = np.tile(np.arange(histograms.shape[1]), len(nearer))
+        copies = np.asarray(histograms[nearer]).ravel()
+        add(
+            np.repeat(np.repeat(rows[query], histograms.shape[1]), copies),
+            np.repeat(products, copies),
+            np.repeat(np.repeat(1 - candidate_distances[query, position], histograms.shape[1]), copies),
+        )
+
+        # The rest come from the profiles at the boundary distance, earliest rows first
+        needed = n_neighbors - np.bincount(query, weights=counts[nearer], minlength=len(rows)).astype(np.int64)
+        query, tied = np.nonzero(distances == boundary_distances[:, None])
+        query, tied_rows = _earliest_rows(index, query, tied, needed)
+        add(rows[query], row_labels[tied_rows], 1 - boundary_distances[query])
+    return votes, vote_similarity
+
+
+def _profile_votes(index, similarity, n_neighbors):
+    """
+    Vote and similarity totals per product when the n_neighbors nearest
+    training rows are taken profile by profile, closest first, for indexes
+    without per-row arrays (see _neighbour_votes for those with them).
+
+    A profile straddling the n_neighbors boundary contributes in proportion
+    to the rows still needed, its expected vote if brute force picked the
+    equidistant rows at random. Brute force picks specific rows, so the
+    products after the first can be ranked differently.
+    """
+    counts = index['counts']
+    order = np.argsort(-similarity, axis=1, kind='stable')
+    sorted_counts = counts[order]
+    taken_before = np.cumsum(sorted_counts, axis=1) - sorted_counts
+    fraction = np.clip((n_neighbors - taken_before) / sorted_counts, 0, 1)
+
+    weights = np.zeros_like(similarity)
+    np.put_along_axis(weights, order, fraction, axis=1)
+    votes = weights @ index['histograms']
+    vote_similarity = (weights * similarity) @ index['histograms']
+    return votes, vote_similarity
+
+
+def profile_rank_products(index, features, n_neighbors=20):
+    """
+    Neighbour-vote product ranking for every row of `features`.
+
+    With the index's per-row arrays the rankings are those of
+    knn_rank_products on a brute-force cosine NearestNeighbors fitted on the
+    same rows, ties included (see _neighbour_votes), while each query is
+    only compared with the distinct profiles. Indexes without them
+    (bundles published before they were stored) fall back to expected votes
+    over whole profiles (see _profile_votes), answering queries whose
+    profile holds at least n_neighbors rows straight from its histogram.
+    """
+    n_neighbors = min(n_neighbors, int(index['counts'].sum()))
+    features = sp.csr_matrix(features)
+    keys = _row_keys(features)
+    if index.get('row_profiles') is not None:
+        if features.shape[0] == 0:
+            return []
+        # Identical rows have identical neighbours: pick them once per distinct row
+        distinct = {}
+        codes = np.array([distinct.setdefault(key, len(distinct)) for key in keys])
+        first_rows = np.unique(codes, return_index=True)[1]
+        votes = _neighbour_votes(index, features[first_rows], list(distinct), n_neighbors)
+        rankings = rank_votes(*votes, index['products'])
+        return [list(rankings[code]) for code in codes]
+
+    votes = np.zeros((features.shape[0], len(index['products'])))
+    vote_similarity = np.zeros_like(votes)
+
+    # Direct key hits: all neighbours sit at distance 0 in the query's own profile
+    searched = []
+    for row, key in enumerate(keys):
+        profile = index['keys'].get(key)
+        if profile is not None and index['counts'][profile] >= n_neighbors:
+            votes[row] = index['histograms'][profile] * (n_neighbors / index['counts'][profile])
+            vote_similarity[row] = votes[row]
+        else:
+            searched.append(row)
+
+    searched = np.asarray(searched, dtype=np.int64)
+    for start in range(0, len(searched), QUERY_CHUNK_SIZE):
+        rows = searched[start:start + QUERY_CHUNK_SIZE]
+        # Rows are L2-normalised TF-IDF vectors, so the dot product is the cosine similarity
+        similarity = (features[rows] @ index['profiles'].T).toarray()
+        votes[rows], vote_similarity[rows] = _profile_votes(index, similarity, n_neighbors)
+
+    return rank_votes(votes, vote_similarity, index['products'])
@@ -0,0 +1,252 @@
+import numpy as np
+import pandas as pd
+
+from feature_encoder import member_data_features
+from member_store import beneficiary_flags
+from metrics import timed
+from popularity_index import ranked_products
+from profile_index import profile_rank_products
+from result_cache import profile_key
+
+# Columns of investment_member.csv the rules read
+RULE_COLUMNS = ['member_no', 'beneficiery_age', 'age_group', 'town', 'portfolio_map']
+
+
+def get_recommendations_with_messages(member_features, popularity_index, member_data, n=5, knn_products=None):
+    """
+    Get recommendations with personalized messages for existing customers.
+    Age-group and town rankings are looked up in the precomputed popularity index;
+    `knn_products` is the member's neighbour-vote ranking from the KNN model,
+    used to fill any slots the rules leave open. When member_data carries
+    'beneficiary_ages' (every beneficiary, as the member store holds them),
+    the beneficiary rule covers all of them instead of 'beneficiary_age' alone.
+    """
+    recommended_products = []
+    messages = []
+    
+    member_beneficiery_age = member_data.get('beneficiary_age')
+    member_age_group = member_data.get('age_group')
+    member_town = member_data.get('town')
+    member_gender = member_data.get('gender')
+    member_current_products = set(member_data.get('current_products', []))
+    beneficiary_ages = member_data.get('beneficiary_ages')
+    if beneficiary_ages is None:
+        beneficiary_ages = [] if member_beneficiery_age is None else [member_beneficiery_age]
+
+    # Rule 1: Beneficiary age recommendations
+    if any(18 <= age <= 25 for age in beneficiary_ages):
+        recommended_products.append("Student Account")
+        messages.append(
+            "Planning for your child's future? Our Student Account is perfect for "
+            "young adults aged 18-25. Start securing their educational journey today!"
+        )
+    if any(age < 18 for age in beneficiary_ages):
+        recommended_products.append("Junior Account")
+        messages.append(
+            "Give your child a head start with our Junior Account! It's specially designed "
+            "for children under 18 to help them develop good financial habits early."
+        )
+
+    # Rule 2: Age group recommendations
+    age_group_products = ranked_products(popularity_index, 'age_group', member_age_group)
+    for product in age_group_products:
+        if product not in member_current_products and product not in recommended_products:
+            recommended_products.append(product)
+            if len(recommended_products) >= n:
+                break
+
+    if age_group_products:
+        messages.append(
+            f"Members in your age group are enjoying these popular products: "
+            f"{', '.join(age_group_products[:3])}. Join them in making smart financial choices!"
+        )
+
+    # Rule 3: Location-based recommendations
+    town_products = ranked_products(popularity_index, 'town', member_town)
+    for product in town_products:
+        if product not in member_current_products and product not in recommended_products:
+            recommended_products.append(product)
+            if len(recommended_products) >= n:
+                break
+
+    if town_products:
+        messages.append(
+            f"Trending in {member_town}! Your neighbors are choosing "
+            f"{', '.join(town_products[:3])}. Discover why these products are popular in your community!"
+        )
+
+    # Rule 4: Profile-based recommendations from the nearest-neighbour model
+    if knn_products and len(recommended_products) < n:
+        knn_recommendations = []
+        for product in knn_products:
+            if product not in member_current_products and product not in recommended_products:
+                knn_recommendations.append(product)
+                if len(recommended_products) + len(knn_recommendations) >= n:
+                    break
+
+        if knn_recommendations:
+            messages.append(
+                f"Based on your profile, we think you'll love {', '.join(knn_recommendations)}. "
+                f"These products align perfectly with your financial journey!"
+            )
+        recommended_products.extend(knn_recommendations)
+
+    # Final personalized message
+    if recommended_products:
+        messages.append(
+            f"💡 Pro tip: Adding {', '.join(recommended_products[:n])} to your portfolio "
+            f"could help you achieve your financial goals faster!"
+        )
+
+    return recommended_products[:n], messages
+
+
+def recommend_members(artifacts, members_data, n=5, cache=None):
+    """
+    Recommendations and messages for a batch of member_data dicts, as the
+    app builds them. Profiles found in `cache` (a result_cache.ResultCache)
+    are served from it; the rest are featurized together and share one
+    neighbour search. Returns one (recommendations, messages) pair per member.
+    """
+    with timed('cache_lookup'):
+        keys = [profile_key(member_data, n) for member_data in members_data]
+        results = [cache.get(artifacts, key) if cache is not None else None for key in keys]
+        missing = [i for i, result in enumerate(results) if result is None]
+    if not missing:
+        return [(list(recommendations), list(messages)) for recommendations, messages in results]
+
+    with timed('featurize'):
+        features = member_data_features(artifacts, [members_data[i] for i in missing])
+    with timed('neighbour_search'):
+        knn_rankings = profile_rank_products(artifacts['profile_index'], features)
+    with timed('rules'):
+        for i, knn_products in zip(missing, knn_rankings):
+            recommendations, messages = get_recommendations_with_messages(
+                None, artifacts['popularity_index'], members_data[i], n=n, knn_products=knn_products
+            )
+            results[i] = (tuple(recommendations), tuple(messages))
+            if cache is not None:
+                cache.put(artifacts, keys[i], results[i])
+
+    return [(list(recommendations), list(messages)) for recommendations, messages in results]
+
+
+def _beneficiary_bucket(beneficiary_age):
+    """
+    Rule 1 outcome per row: 'Student Account', 'Junior Account' or '' (no product)
+    """
+    beneficiary_age = beneficiary_age.to_numpy(dtype=float)
+    return np.select(
+        [(beneficiary_age >= 18) & (beneficiary_age <= 25), beneficiary_age < 18],
+        ['Student Account', 'Junior Account'],
+        default=''
+    )
+
+
+def _current_product_masks(members):
+    """
+    Bitmask of the products each row's member already holds, across all of
+    that member's rows, plus the product list the bits refer to
+    """
+    products = pd.Categorical(members['portfolio_map'])
+    # One-hot rows; a missing product has code -1 and picks the all-zero last row
+    one_hot = np.eye(len(products.categories) + 1, dtype=np.uint8)[:, :-1]
+    holdings = pd.DataFrame(one_hot[products.codes], index=members.index)
+    held = holdings.groupby(members['member_no'].to_numpy()).transform('max').to_numpy()
+    weights = np.left_shift(1, np.arange(held.shape[1], dtype=np.int64))
+    return held @ weights, list(products.categories)
+
+
+def recommend_batch(members, popularity_index, n=5, knn_products=None):
+    """
+    Recommendations and messages for every row of a member table.
+
+    Rows are reduced to the few inputs the rules depend on (beneficiary
+    bucket, age group, town and the member's current products). The rules
+    then run once per distinct profile and the results are joined back onto
+    every row, so the cost scales with the number of profiles, not members.
+    `knn_products` optionally holds each row's KNN ranking as a tuple
+    (see knn_recommender.knn_rank_members).
+    """
+    profiles = pd.DataFrame({
+        'beneficiary_bucket': _beneficiary_bucket(members['beneficiery_age']),
+        'age_group': members['age_group'].astype(object).to_numpy(),
+        'town': members['town'].astype(object).to_numpy(),
+    }, index=members.index)
+    masks, products = _current_product_masks(members)
+    profiles['products_mask'] = masks
+    if knn_products is not None:
+        profiles['knn_products'] = knn_products
+
+    profile_keys = list(profiles.columns)
+    profile_ids = profiles.groupby(profile_keys, sort=False, dropna=False).ngroup().to_numpy()
+    first_rows = np.unique(profile_ids, return_index=True)[1]
+
+    bucket_age = {'Student Account': 18, 'Junior Account': 0, '': None}
+    results = []
+    for row in profiles.iloc[first_rows].itertuples(index=False):
+        member_data = {
+            'beneficiary_age': bucket_age[row.beneficiary_bucket],
+            'age_group': row.age_group,
+            'town': row.town,
+            'current_products': [
+                product for bit, product in enumerate(products) if row.products_mask >> bit & 1
+            ]
+        }
+        results.append(get_recommendations_with_messages(
+            None, popularity_index, member_data, n=n,
+            knn_products=getattr(row, 'knn_products', None)
+        ))
+
+    recommendations = np.empty(len(results), dtype=object)
+    messages = np.empty(len(results), dtype=object)
+    for i, (recommended, profile_messages) in enumerate(results):
+        recommendations[i] = recommended
+        messages[i] = profile_messages
+
+    output = members.copy()
+    output['recommended_products'] = recommendations[profile_ids]
+    output['messages'] = messages[profile_ids]
+    return output
+
+
+def recommend_store(store, popularity_index, n=5):
+    """
+    Recommendations and messages for every member of a member store, one
+    row per member rather than per member-table row.
+
+    The beneficiary rule is evaluated over all of each member's
+    beneficiaries at once (member_store.beneficiary_flags) and the product
+    rules skip everything in the member's product bitmask. As in
+    recommend_batch, the rules then run once per distinct profile.
+    """
+    student, junior = beneficiary_flags(store)
+    profiles = pd.DataFrame({
+        'student': student,
+        'junior': junior,
+        'age_group': store['age_group'],
+        'town': store['town'],
+        'products': store['products'],
+    })
+    profile_ids = profiles.groupby(list(profiles.columns), sort=False).ngroup().to_numpy()
+    first_rows = np.unique(profile_ids, return_index=True)[1]
+
+    categories = store['categories']
+    recommendations = np.empty(len(first_rows), dtype=object)
+    messages = np.empty(len(first_rows), dtype=object)
+    for i, row in enumerate(profiles.iloc[first_rows].itertuples(index=False)):
+        member_data = {
+            'beneficiary_ages': [18] * row.student + [0] * row.junior,
+            'age_group': categories['age_group'][row.age_group] if row.age_group >= 0 else None,
+            'town': categories['town'][row.town] if row.town >= 0 else None,
+            'current_products': [
+                product for bit, product in enumerate(categories['portfolio_map']) if int(row.products) >> bit & 1
+            ],
+        }
+        recommendations[i], messages[i] = get_recommendations_with_messages(None, popularity_index, member_data, n=n)
+
+    return pd.DataFrame({
+        'member_no': np.asarray(store['member_no']),
+        'recommended_products': recommendations[profile_ids],
+        'messages': messages[profile_ids],
+    })
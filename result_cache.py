@@ -0,0 +1,86 @@
+import threading
+from collections import OrderedDict
+
+# Default number of distinct profiles kept
+RESULT_CACHE_SIZE = 4096
+
+
+def profile_key(member_data, n):
+    """
+    Normalized cache key for one member_data dict: every input the
+    recommendations depend on, with current products as a sorted tuple
+    """
+    beneficiary_age = member_data.get('beneficiary_age')
+    beneficiary_ages = member_data.get('beneficiary_ages')
+    member_age = member_data.get('member_age')
+    return (
+        member_data.get('age_group'),
+        member_data.get('town'),
+        member_data.get('gender'),
+        None if beneficiary_age is None else float(beneficiary_age),
+        None if beneficiary_ages is None else tuple(sorted(set(float(age) for age in beneficiary_ages))),
+        None if member_age is None else float(member_age),
+        tuple(sorted(set(member_data.get('current_products', [])))),
+        n,
+    )
+
+
+class ResultCache:
+    """
+    LRU cache of existing-customer results keyed on the normalized profile.
+
+    Entries belong to one artifacts signature; looking up with artifacts
+    carrying a different signature (a new bundle, or changed legacy model
+    or member files) empties the cache first.
+    """
+
+    def __init__(self, maxsize=RESULT_CACHE_SIZE):
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1")
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._signature = None
+        self._lock = threading.Lock()
+
+    def _check_signature(self, artifacts):
+        if artifacts['signature'] != self._signature:
+            self._entries.clear()
+            self._signature = artifacts['signature']
+
+    def get(self, artifacts, key):
+        """
+        Cached result for `key`, or None
+        """
+        with self._lock:
+            self._check_signature(artifacts)
+            result = self._entries.get(key)
+            if result is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return result
+
+    def put(self, artifacts, key, result):
+        with self._lock:
+            self._check_signature(artifacts)
+            self._entries[key] = result
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
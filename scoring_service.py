@@ -0,0 +1,361 @@
+"""
+Headless JSON scoring service for both recommendation paths.
+
+A small asyncio HTTP/1.1 server (standard library only, keep-alive
+connections). Artifacts are loaded at start-up (and again only when a new
+bundle is published) and every request body may carry a batch, which is
+scored in one pass. Scoring and artifact reloads run in the loop's
+default thread pool, so a large batch or a bundle swap does not stall
+other connections. Existing-customer results are kept in an LRU cache
+keyed on the member profile.
+
+Endpoints:
+    GET  /health
+    GET  /metrics       per-stage latency histograms and cache counters (Prometheus text format)
+    POST /existing-customers/recommendations
+        {"age_group": "31-45", "town": "NAIROBI", "gender": "Male",
+         "beneficiary_age": 12, "current_products": ["Money Market"]}
+        or {"member_no": 1042}    (profile and current products from the member store)
+        or {"members": [...], "n": 3}
+    POST /new-customers/recommendations
+        {"investment_duration": "1-3 years", "emergency_fund": "No",
+         "withdrawal_frequency": "Rarely (yearly or less)", "risk_appetite": "High",
+         "investment_amount": 10000, "currency": "KES", "loan_access": false}
+        or {"requests": [...]}
+
+With --events, the age-group and town rankings follow a purchase event
+log (see popularity_events.py): new events are applied every
+--events-interval seconds and the counters are snapshotted for restarts.
+
+Usage:
+    python scoring_service.py --host 127.0.0.1 --port 8080 --cache-size 4096
+    python scoring_service.py --events popularity_events.jsonl --snapshot popularity_snapshot.pkl
+"""
+import argparse
+import asyncio
+import json
+import logging
+import threading
+from http import HTTPStatus
+
+from answer_table import answer_recommendations
+from artifacts import BUNDLE_ROOT, current_artifacts
+from market_data import market_snapshot
+from member_store import member_data, member_positions, parse_member_no
+from metrics import prometheus_text, register_cache, timed
+from popularity_events import SNAPSHOT_PATH, load_counters
+from recommender import recommend_members
+from result_cache import RESULT_CACHE_SIZE, ResultCache
+
+MAX_BODY_BYTES = 8 * 2**20
+
+MEMBER_FIELDS = ['age_group', 'town', 'gender']
+QUESTIONNAIRE_FIELDS = ['investment_duration', 'emergency_fund', 'withdrawal_frequency', 'risk_appetite']
+
+logger = logging.getLogger(__name__)
+
+
+class UnknownMemberError(LookupError):
+    """
+    A member_no the member store does not hold; answered with 404
+    """
+
+
+def _require(item, fields):
+    if not isinstance(item, dict):
+        raise ValueError("Each entry must be a JSON object")
+    missing = [field for field in fields if field not in item]
+    if missing:
+        raise ValueError(f"Missing fields: {', '.join(missing)}")
+
+
+def _check_types(item):
+    """
+    Refuse fields whose JSON type would be misread: a loan_access string
+    like "false" is truthy, and a current_products string would be taken
+    character by character
+    """
+    if 'loan_access' in item and not isinstance(item['loan_access'], bool):
+        raise ValueError("loan_access must be true or false")
+    products = item.get('current_products', [])
+    if not isinstance(products, list) or not all(isinstance(product, str) for product in products):
+        raise ValueError("current_products must be a list of product names")
+
+
+def resolve_members(artifacts, entries):
+    """
+    member_data dicts for request entries: an entry holding a member_no is
+    replaced by that member's record from the artifacts' member store.
+    Raises UnknownMemberError for member numbers the store does not hold.
+    """
+    lookups = [i for i, entry in enumerate(entries) if isinstance(entry, dict) and 'member_no' in entry]
+    if not lookups:
+        return entries
+    store = artifacts.get('member_store')
+    if store is None:
+        raise ValueError("Looking up by member_no needs an artifact bundle with a member store")
+
+    member_nos = [parse_member_no(entries[i]['member_no']) for i in lookups]
+    positions = member_positions(store, member_nos)
+    unknown = [member_no for member_no, position in zip(member_nos, positions) if position < 0]
+    if unknown:
+        raise UnknownMemberError(f"Unknown member_no: {', '.join(map(str, unknown))}")
+    members_data = list(entries)
+    for i, position in zip(lookups, positions):
+        members_data[i] = member_data(store, position)
+    return members_data
+
+
+def score_existing_customers(artifacts, members_data, n=5, cache=None):
+    """
+    Recommendations and messages for a batch of member_data dicts, as the
+    app builds them (see recommender.recommend_members), or member numbers
+    (see resolve_members)
+    """
+    members_data = resolve_members(artifacts, members_data)
+    for entry in members_data:
+        _require(entry, MEMBER_FIELDS)
+        _check_types(entry)
+    return [
+        {'recommendations': recommendations, 'messages': messages}
+        for recommendations, messages in recommend_members(artifacts, members_data, n=n, cache=cache)
+    ]
+
+
+def score_new_customers(requests):
+    """
+    Risk score and allocation for a batch of questionnaire answers, all
+    looked up in the answer table of the same market snapshot
+    """
+    snapshot = market_snapshot()
+    results = []
+    for request in requests:
+        _require(request, QUESTIONNAIRE_FIELDS + ['investment_amount', 'currency'])
+        _check_types(request)
+        risk_score, recommendations = answer_recommendations(
+            request, float(request['investment_amount']), request['currency'],
+            request.get('loan_access', False), snapshot=snapshot
+        )
+        results.append({'risk_score': risk_score, 'recommendations': recommendations})
+    return results
+
+
+def live_artifacts(service):
+    """
+    The current artifacts, with the popularity index replaced by the event
+    counters when the service follows an event log. The counters are
+    reseeded when a new bundle is published, from the log offset its member
+    table covers, and their version is part of the signature so cached
+    results never outlive the rankings they used.
+    """
+    artifacts = current_artifacts(service['root'])
+    if service.get('events') is None:
+        return artifacts
+    counters = service.get('counters')
+    if counters is None or counters.seed != artifacts['signature']:
+        with service['lock']:
+            counters = service.get('counters')
+            if counters is None or counters.seed != artifacts['signature']:
+                manifest = artifacts['manifest'] or {}
+                counters = service['counters'] = load_counters(
+                    artifacts['members'], artifacts['signature'], service['snapshot'],
+                    offset=manifest.get('events_offset', 0)
+                )
+    return dict(
+        artifacts,
+        popularity_index=counters.index,
+        signature=(artifacts['signature'], 'events', counters.offset),
+    )
+
+
+def consume_events(service):
+    """
+    Apply events appended to the service's log since the last call
+    """
+    artifacts = live_artifacts(service)
+    with service['lock']:
+        counters = service['counters']
+        counters.consume(service['events'], store=artifacts.get('member_store'))
+        counters.snapshot_if_due(service['snapshot'])
+
+
+def handle_request(service, method, path, body):
+    """
+    Route one request for `service` ({'root': artifacts root, 'cache': ResultCache},
+    plus 'events' and 'snapshot' paths and a 'lock' for the counters when
+    following an event log). Returns (status, payload): JSON-serialisable,
+    or text for /metrics. Called from executor threads, so it may block.
+    """
+    artifacts = live_artifacts(service)
+    cache = service['cache']
+    if path == '/health':
+        if method != 'GET':
+            return HTTPStatus.METHOD_NOT_ALLOWED, {'error': 'Use GET'}
+        manifest = artifacts['manifest']
+        health = {
+            'status': 'ok',
+            'artifact_version': manifest['version'] if manifest else None,
+            'result_cache': cache.stats(),
+        }
+        if service.get('counters') is not None:
+            counters = service['counters']
+            health['popularity_events'] = {
+                'applied': counters.events, 'rejected': counters.rejected, 'offset': counters.offset
+            }
+        return HTTPStatus.OK, health
+    if path == '/metrics':
+        if method != 'GET':
+            return HTTPStatus.METHOD_NOT_ALLOWED, {'error': 'Use GET'}
+        return HTTPStatus.OK, prometheus_text()
+
+    if path not in ('/existing-customers/recommendations', '/new-customers/recommendations'):
+        return HTTPStatus.NOT_FOUND, {'error': f"Unknown path {path}"}
+    if method != 'POST':
+        return HTTPStatus.METHOD_NOT_ALLOWED, {'error': 'Use POST'}
+
+    try:
+        with timed(f"http {path}"):
+            payload = json.loads(body or b'null')
+            if path == '/existing-customers/recommendations':
+                if isinstance(payload, dict) and 'members' in payload:
+                    results = score_existing_customers(
+                        artifacts, payload['members'], n=int(payload.get('n', 5)), cache=cache
+                    )
+                    return HTTPStatus.OK, {'results': results}
+                return HTTPStatus.OK, score_existing_customers(artifacts, [payload], cache=cache)[0]
+
+            if isinstance(payload, dict) and 'requests' in payload:
+                return HTTPStatus.OK, {'results': score_new_customers(payload['requests'])}
+            return HTTPStatus.OK, score_new_customers([payload])[0]
+    except UnknownMemberError as e:
+        return HTTPStatus.NOT_FOUND, {'error': str(e)}
+    except (ValueError, TypeError) as e:
+        return HTTPStatus.BAD_REQUEST, {'error': str(e)}
+
+
+async def _read_request(reader):
+    """
+    Parse one HTTP/1.1 request. Returns (method, path, headers, body), or
+    None when the client closed the connection.
+    """
+    request_line = await reader.readline()
+    if not request_line.strip():
+        return None
+    method, target, _ = request_line.decode('latin-1').split(' ', 2)
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    length = int(headers.get('content-length', 0))
+    if length > MAX_BODY_BYTES:
+        raise ValueError(f"Request body over {MAX_BODY_BYTES} bytes")
+    body = await reader.readexactly(length) if length else b''
+    return method, target.split('?', 1)[0], headers, body
+
+
+def _response(status, payload, keep_alive):
+    """
+    HTTP response bytes; a str payload is sent as plain text, anything else as JSON
+    """
+    if isinstance(payload, str):
+        body, content_type = payload.encode(), 'text/plain; version=0.0.4'
+    else:
+        body, content_type = json.dumps(payload).encode(), 'application/json'
+    head = (
+        f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+        f"Content-Type: {content_type}\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+    )
+    return head.encode('latin-1') + body
+
+
+def make_handler(service):
+    """
+    Connection handler for asyncio.start_server serving `service` (see handle_request)
+    """
+    async def handle_connection(reader, writer):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                try:
+                    request = await _read_request(reader)
+                except (ValueError, asyncio.IncompleteReadError):
+                    writer.write(_response(HTTPStatus.BAD_REQUEST, {'error': 'Malformed request'}, False))
+                    break
+                if request is None:
+                    break
+
+                method, path, headers, body = request
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                try:
+                    # Scoring and artifact reloads are CPU- and IO-bound; keep them off the event loop
+                    status, payload = await loop.run_in_executor(None, handle_request, service, method, path, body)
+                except Exception:
+                    # Answer instead of dropping the connection; the traceback goes to the log
+                    logger.exception("Error handling %s %s", method, path)
+                    status, payload = HTTPStatus.INTERNAL_SERVER_ERROR, {'error': 'Internal server error'}
+                    keep_alive = False
+                writer.write(_response(status, payload, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    return handle_connection
+
+
+async def follow_events(service, interval):
+    loop = asyncio.get_running_loop()
+    while True:
+        await loop.run_in_executor(None, consume_events, service)
+        await asyncio.sleep(interval)
+
+
+async def serve(host='127.0.0.1', port=8080, artifacts_root=BUNDLE_ROOT, cache_size=RESULT_CACHE_SIZE,
+                events_path=None, snapshot_path=SNAPSHOT_PATH, events_interval=1.0):
+    service = {
+        'root': artifacts_root, 'cache': ResultCache(cache_size), 'events': events_path, 'snapshot': snapshot_path,
+        'lock': threading.Lock(),
+    }
+    register_cache('result', service['cache'])
+    live_artifacts(service)
+    server = await asyncio.start_server(make_handler(service), host, port)
+    print(f"Serving recommendations on http://{host}:{port}")
+    async with server:
+        if events_path is not None:
+            # Keep a reference so the task is not garbage collected
+            service['events_task'] = asyncio.create_task(follow_events(service, events_interval))
+        await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve both recommendation paths as JSON over HTTP")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--artifacts', default=BUNDLE_ROOT, help="Artifact bundle root")
+    parser.add_argument('--cache-size', type=int, default=RESULT_CACHE_SIZE, help="Member profiles kept in the result cache")
+    parser.add_argument('--events', help="Purchase event log the popularity rankings follow")
+    parser.add_argument('--snapshot', default=SNAPSHOT_PATH, help="Popularity counter snapshot for restarts")
+    parser.add_argument('--events-interval', type=float, default=1.0, help="Seconds between reads of the event log")
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(
+            args.host, args.port, args.artifacts, args.cache_size,
+            events_path=args.events, snapshot_path=args.snapshot, events_interval=args.events_interval
+        ))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+"""
+Synthetic member tables with the schema of investment_member.csv, for load
+tests and benchmarks where the real member data cannot be used.
+
+Marginals follow the value counts printed in the notebook (relationship,
+gender, portfolio, the head of the town distribution and the beneficiary
+age quartiles). Each member gets one to a dozen rows sharing town, gender
+and age, with relationship, beneficiary and product drawn per row, as in
+the deduplicated extract. Beneficiary ages that the notebook's cleaning
+pushes to the upper clip (the 1899-12-30 placeholder dates and missing
+dates filled with the mode) are reproduced as a spike at AGE_UPPER_BOUND.
+
+Tables are generated in chunks of whole members and streamed to disk, so
+memory is bounded by the chunk size. The same seed and chunk size always
+give the same table.
+
+Usage:
+    python synthetic_data.py synthetic_member.csv --rows 20000000
+    python synthetic_data.py synthetic_member --table --rows 20000000
+"""
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+from numpy.lib.format import open_memmap
+
+from member_table import CATEGORICAL_COLUMNS, NUMERIC_DTYPES, code_dtype, schema_path
+from preprocessing import AGE_LOWER_BOUND, AGE_UPPER_BOUND, OUTPUT_COLUMNS, age_bins, age_labels
+
+DEFAULT_CHUNK_SIZE = 1_000_000
+
+# Value counts from the notebook, after mapping
+RELATIONSHIP_COUNTS = {
+    'child': 52152, 'parent': 26352, 'partner': 24578, 'sibling': 20240, 'relative': 1534,
+    'friends': 396, 'other': 392, 'guardian': 128, 'professional': 67, 'self': 49,
+}
+GENDER_COUNTS = {'Female': 83274, 'Male': 42532}
+PORTFOLIO_COUNTS = {
+    'Money Market': 119711, 'Equity Fund': 2014, 'Dollar Fund': 1480,
+    'Balanced Fund': 1180, 'Fixed Income': 1101, 'Wealth Fund': 398,
+}
+PRODUCTS = list(PORTFOLIO_COUNTS)
+
+# Head of the town distribution as printed, and the shape of the long tail:
+# 973 distinct spellings in all, ~50k rows outside the top five
+TOWN_COUNTS = {'NAIROBI': 56997, 'Nairobi': 10261, 'THIKA': 3000, 'NAKURU': 2608, 'MOMBASA': 2440}
+TAIL_TOWNS = [
+    'Unknown', 'KISUMU', 'ELDORET', 'KIAMBU', 'RUIRU', 'MACHAKOS', 'NYERI', 'KITENGELA', 'NAIVASHA',
+    'KERICHO', 'MERU', 'EMBU', 'KAKAMEGA', 'NANYUKI', 'JUJA', 'KITALE', 'MURANG\'A', 'NAROK', 'MALINDI',
+    'KAJIADO', 'NGONG', 'LIMURU', 'ATHI RIVER', 'KERUGOYA', 'BUNGOMA', 'KISII', 'NYAHURURU', 'KILIFI',
+]
+TOWN_COUNT = 973
+TAIL_ROWS = 50500
+
+# Piecewise-linear quantile functions (probability, age). Beneficiary
+# quartiles are the notebook's describe(); member ages are centred on the
+# modal birth years (1960s-1970s) since the notebook prints no summary.
+BENEFICIARY_AGE_QUANTILES = [(0.0, 0), (0.25, 24), (0.5, 36), (0.75, 53), (1.0, 95)]
+MEMBER_AGE_QUANTILES = [(0.0, 19), (0.1, 29), (0.25, 38), (0.5, 49), (0.75, 57), (0.95, 66), (1.0, 85)]
+# Share of rows whose beneficiary age ends up clipped to AGE_UPPER_BOUND
+BENEFICIARY_PLACEHOLDER_RATE = 0.125
+
+# Rows per member: geometric from 1, capped
+ROWS_PER_MEMBER_MEAN = 2.5
+ROWS_PER_MEMBER_MAX = 12
+
+
+def _town_weights():
+    """
+    Town names and probabilities: the printed head, then a 1/rank tail over
+    known and generated town names scaled to TAIL_ROWS
+    """
+    tail_size = TOWN_COUNT - len(TOWN_COUNTS)
+    tail = TAIL_TOWNS + [f"TOWN {i:03d}" for i in range(len(TAIL_TOWNS), tail_size)]
+    tail_weights = 1 / np.arange(len(TOWN_COUNTS) + 1, TOWN_COUNT + 1)
+    tail_weights *= TAIL_ROWS / tail_weights.sum()
+    weights = np.concatenate([list(TOWN_COUNTS.values()), tail_weights])
+    return list(TOWN_COUNTS) + tail, weights / weights.sum()
+
+
+TOWNS, TOWN_PROBABILITIES = _town_weights()
+
+
+def _probabilities(counts):
+    values = np.array(list(counts.values()), dtype=np.float64)
+    return values / values.sum()
+
+
+def _quantile_sample(rng, quantiles, size):
+    probabilities, ages = zip(*quantiles)
+    return np.interp(rng.random(size), probabilities, ages)
+
+
+def _categorical(codes, categories):
+    return pd.Categorical.from_codes(codes, categories=categories)
+
+
+def _member_rows(rng, rows):
+    """
+    Rows of each member, drawn until `rows` are covered; the last member is
+    cut short so the chunk is exactly `rows` long
+    """
+    # Enough members for the mean plus slack; redraw in the rare short case
+    while True:
+        counts = rng.geometric(1 / ROWS_PER_MEMBER_MEAN, size=int(rows / ROWS_PER_MEMBER_MEAN * 1.1) + 16)
+        counts = np.minimum(counts, ROWS_PER_MEMBER_MAX)
+        ends = np.cumsum(counts)
+        if ends[-1] >= rows:
+            break
+    members = int(np.searchsorted(ends, rows)) + 1
+    counts = counts[:members]
+    counts[-1] -= ends[members - 1] - rows
+    return counts
+
+
+def generate_chunk(rng, rows, first_member_no=1):
+    """
+    One synthetic member table of `rows` rows, member numbers starting at `first_member_no`
+    """
+    counts = _member_rows(rng, rows)
+    members = len(counts)
+
+    member_age = np.rint(_quantile_sample(rng, MEMBER_AGE_QUANTILES, members)).astype(np.int64)
+    beneficiary_age = np.rint(_quantile_sample(rng, BENEFICIARY_AGE_QUANTILES, rows))
+    beneficiary_age[rng.random(rows) < BENEFICIARY_PLACEHOLDER_RATE] = AGE_UPPER_BOUND
+    member_age = np.repeat(member_age, counts)
+
+    df = pd.DataFrame({
+        'member_no': np.repeat(np.arange(first_member_no, first_member_no + members, dtype=np.int64), counts),
+        'town': _categorical(np.repeat(rng.choice(len(TOWNS), size=members, p=TOWN_PROBABILITIES), counts), TOWNS),
+        'relationship': _categorical(
+            rng.choice(len(RELATIONSHIP_COUNTS), size=rows, p=_probabilities(RELATIONSHIP_COUNTS)),
+            list(RELATIONSHIP_COUNTS)
+        ),
+        'gender_mapped': _categorical(
+            np.repeat(rng.choice(len(GENDER_COUNTS), size=members, p=_probabilities(GENDER_COUNTS)), counts),
+            list(GENDER_COUNTS)
+        ),
+        'member_age': member_age,
+        'beneficiery_age': np.clip(beneficiary_age, AGE_LOWER_BOUND, AGE_UPPER_BOUND),
+        'portfolio_map': _categorical(
+            rng.choice(len(PRODUCTS), size=rows, p=_probabilities(PORTFOLIO_COUNTS)), PRODUCTS
+        ),
+        'age_group': pd.cut(member_age, bins=age_bins, labels=age_labels),
+    })
+    return df[OUTPUT_COLUMNS]
+
+
+def generate_members(rows, chunksize=DEFAULT_CHUNK_SIZE, seed=0):
+    """
+    Yield a synthetic member table of `rows` rows as DataFrames of at most
+    `chunksize` rows. Members do not span chunks.
+    """
+    if rows < 0 or chunksize < 1:
+        raise ValueError("rows must be non-negative and chunksize positive")
+    rng = np.random.default_rng(seed)
+    member_no = 1
+    for start in range(0, rows, chunksize):
+        chunk = generate_chunk(rng, min(chunksize, rows - start), first_member_no=member_no)
+        member_no = int(chunk['member_no'].iloc[-1]) + 1
+        yield chunk
+
+
+def synthetic_members(rows, seed=0, chunksize=DEFAULT_CHUNK_SIZE):
+    """
+    A whole synthetic member table in memory
+    """
+    chunks = list(generate_members(rows, chunksize=chunksize, seed=seed))
+    if not chunks:
+        return generate_chunk(np.random.default_rng(seed), 0)
+    return pd.concat(chunks, ignore_index=True)
+
+
+def write_synthetic_csv(path, rows, chunksize=DEFAULT_CHUNK_SIZE, seed=0):
+    """
+    Stream a synthetic table to a CSV at `path`, replacing it only once complete
+    """
+    tmp_path = f"{path}.tmp"
+    header = True
+    for chunk in generate_members(rows, chunksize=chunksize, seed=seed):
+        chunk.to_csv(tmp_path, mode='w' if header else 'a', header=header, index=False)
+        header = False
+    if header:
+        pd.DataFrame(columns=OUTPUT_COLUMNS).to_csv(tmp_path, index=False)
+    os.replace(tmp_path, path)
+    return rows
+
+
+def write_synthetic_table(path, rows, chunksize=DEFAULT_CHUNK_SIZE, seed=0):
+    """
+    Stream a synthetic table into the columnar member table format at `path`.
+    The categories are fixed up front, so every column file is preallocated
+    and filled chunk by chunk; the schema is written last, as in
+    write_member_table.
+    """
+    categories = {
+        'town': TOWNS,
+        'relationship': list(RELATIONSHIP_COUNTS),
+        'gender_mapped': list(GENDER_COUNTS),
+        'portfolio_map': PRODUCTS,
+        'age_group': age_labels,
+    }
+    os.makedirs(path, exist_ok=True)
+    schema = {'rows': rows, 'columns': {}}
+    files = {}
+    for column in OUTPUT_COLUMNS:
+        if column in CATEGORICAL_COLUMNS:
+            dtype = code_dtype(categories[column])
+            schema['columns'][column] = {'kind': 'categorical', 'categories': categories[column]}
+        else:
+            dtype = NUMERIC_DTYPES[column]
+            schema['columns'][column] = {'kind': 'numeric', 'dtype': np.dtype(dtype).str}
+        files[column] = open_memmap(os.path.join(path, f"{column}.npy"), mode='w+', dtype=dtype, shape=(rows,))
+
+    start = 0
+    for chunk in generate_members(rows, chunksize=chunksize, seed=seed):
+        end = start + len(chunk)
+        for column, values in files.items():
+            if column in CATEGORICAL_COLUMNS:
+                values[start:end] = chunk[column].cat.codes.to_numpy()
+            else:
+                values[start:end] = chunk[column].to_numpy()
+        start = end
+    for values in files.values():
+        values.flush()
+    del files
+
+    tmp_path = f"{schema_path(path)}.tmp"
+    with open(tmp_path, 'w') as file:
+        json.dump(schema, file)
+    os.replace(tmp_path, schema_path(path))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic member table like investment_member.csv")
+    parser.add_argument('output', nargs='?', default='synthetic_member.csv')
+    parser.add_argument('--rows', type=int, default=120_000)
+    parser.add_argument('--chunksize', type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--table', action='store_true', help="Write the columnar member table format instead of CSV")
+    args = parser.parse_args()
+
+    write = write_synthetic_table if args.table else write_synthetic_csv
+    rows = write(args.output, args.rows, chunksize=args.chunksize, seed=args.seed)
+    print(f"Wrote {rows:,} synthetic rows to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+import logging
+import os
+import shutil
+
+import pytest
+
+from market_data import DATA_DIR, MARKET_FILES, MMF_COLUMNS, _read_table, market_snapshot
+
+MMF_HEADER = "Rank,Fund Manager,Nominal Rate%,After Tax Return%,Real Return%\n"
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    for name in os.listdir(DATA_DIR):
+        shutil.copy(os.path.join(DATA_DIR, name), tmp_path / name)
+    return str(tmp_path)
+
+
+def _write(data_dir, text):
+    path = os.path.join(data_dir, MARKET_FILES['mmf'])
+    with open(path, 'w') as file:
+        file.write(text)
+    # Same-size rewrites within the clock's resolution must still look changed
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+@pytest.mark.parametrize('text', [
+    "Rank,Fund Man",
+    MMF_HEADER + "1,Cytonn Money Market Fund,18.07%,15.",
+    MMF_HEADER + "1,Cytonn Money Market Fund,18.07%,15.36%,n/a\n",
+    "",
+])
+def test_malformed_csv_keeps_the_previous_snapshot(data_dir, text, caplog):
+    previous = market_snapshot(data_dir)
+    _write(data_dir, text)
+    with caplog.at_level(logging.ERROR, logger='market_data'):
+        assert market_snapshot(data_dir) is previous
+        assert market_snapshot(data_dir) is previous
+    # Logged once, not on every call while the file stays broken
+    assert len(caplog.records) == 1
+
+    _write(data_dir, MMF_HEADER + "1,Etica Money Market Fund,17.5%,14.9%,13.4%\n")
+    snapshot = market_snapshot(data_dir)
+    assert snapshot is not previous
+    assert list(snapshot['tables']['mmf']['Fund']) == ['Etica Money Market Fund']
+
+
+def test_missing_columns_are_named(tmp_path):
+    path = tmp_path / 'mmf.csv'
+    path.write_text("Rank,Fund Manager,Nominal Rate%\n1,Etica,17.5%\n")
+    with pytest.raises(ValueError, match="missing columns: After Tax Return%, Real Return%"):
+        _read_table(str(path), MMF_COLUMNS)
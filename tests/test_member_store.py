@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+from artifacts import build_encoded_bundle, load_bundle
+from member_store import MISSING_AGE, beneficiary_flags, build_member_store, lookup_member, parse_member_no
+from synthetic_data import synthetic_members
+
+
+def _members_with_bad_ages():
+    members = synthetic_members(2000, seed=1)
+    # Ages as preprocessing leaves them for future and placeholder birth dates
+    members['member_age'] = members['member_age'].astype(np.int64)
+    members.loc[members['member_no'] == 1, 'member_age'] = -178
+    members.loc[members['member_no'] == 2, 'member_age'] = 329
+    members.loc[members['member_no'] == 3, 'member_age'] = 40000
+    members.loc[members['member_no'] == 4, 'beneficiery_age'] = -5.0
+    members.loc[members['member_no'] == 5, 'beneficiery_age'] = 200.0
+    return members
+
+
+def test_out_of_range_ages_are_kept_or_missing():
+    store = build_member_store(_members_with_bad_ages())
+
+    assert lookup_member(store, 1)['member_age'] == -178.0
+    assert lookup_member(store, 2)['member_age'] == 329.0
+    assert lookup_member(store, 3)['member_age'] is None
+    assert lookup_member(store, 4)['beneficiary_ages'] == [-5.0]
+    assert lookup_member(store, 5)['beneficiary_ages'] == []
+    assert lookup_member(store, 5)['beneficiary_age'] is None
+    assert MISSING_AGE in store['beneficiary_ages']
+
+
+def test_negative_beneficiary_age_is_junior_as_in_the_row_rule():
+    store = build_member_store(_members_with_bad_ages())
+    student, junior = beneficiary_flags(store)
+    position = int(np.flatnonzero(store['member_no'] == 4)[0])
+    assert junior[position] and not student[position]
+
+
+def test_bundle_publishes_with_negative_ages(tmp_path):
+    build_encoded_bundle(_members_with_bad_ages(), root=str(tmp_path))
+    bundle = load_bundle(str(tmp_path))
+    assert lookup_member(bundle['member_store'], 1)['member_age'] == -178.0
+
+
+def test_member_no_parsing_refuses_what_int64_keys_cannot_hold():
+    assert parse_member_no(' 1042 ') == 1042
+    # '²'.isdigit() is true, but int() cannot parse it
+    for value in ['²', '12.5', '', 2**63, 1042.0]:
+        with pytest.raises(ValueError):
+            parse_member_no(value)
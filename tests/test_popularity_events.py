@@ -0,0 +1,78 @@
+import threading
+
+import pandas as pd
+
+from artifacts import build_encoded_bundle
+from popularity_events import PopularityCounters, append_event, log_offset
+from popularity_index import build_popularity_index
+from result_cache import ResultCache
+from scoring_service import consume_events, live_artifacts
+from synthetic_data import synthetic_members
+
+
+def _event_rows(members, events):
+    """
+    Member-table rows the events stand for, as an export after them would hold
+    """
+    rows = members.iloc[[0] * len(events)].reset_index(drop=True)
+    for column in ['age_group', 'town']:
+        rows[column] = [event[column] for event in events]
+    rows['portfolio_map'] = [event['product'] for event in events]
+    return rows.astype(members.dtypes.to_dict())
+
+
+def test_log_offset_stops_before_a_partial_line(tmp_path):
+    path = str(tmp_path / 'events.jsonl')
+    assert log_offset(path) == 0
+    append_event({'product': 'Equity Fund'}, path)
+    complete = log_offset(path)
+    with open(path, 'a') as file:
+        file.write('{"product": "Dol')
+    assert log_offset(path) == complete
+
+
+def test_reads_rank_the_keys_counted_since_the_last_read():
+    members = synthetic_members(2000, seed=6)
+    counters = PopularityCounters(members)
+    held = counters.index['town']['NAKURU']
+    before = list(held)
+
+    # Enough purchases of the segment's last product to move it to the top
+    events = [{'product': before[-1], 'age_group': '31-45', 'town': 'NAKURU'}] * len(members)
+    for event in events:
+        counters.apply(event)
+    assert held == before
+    expected = build_popularity_index(pd.concat([members, _event_rows(members, events)], ignore_index=True))
+    assert counters.index == expected
+    assert counters.index['town']['NAKURU'][0] == before[-1]
+
+
+def test_bundle_events_are_not_counted_twice(tmp_path):
+    members = synthetic_members(2000, seed=5)
+    events_path = str(tmp_path / 'events.jsonl')
+    events = [
+        {'member_no': 1, 'product': 'Dollar Fund', 'age_group': '31-45', 'town': 'NAKURU'},
+        {'member_no': 2, 'product': 'Equity Fund', 'age_group': '19-30', 'town': 'NAIROBI'},
+    ]
+    for event in events:
+        append_event(event, events_path)
+
+    # The bundle's member table was exported after the two events
+    exported = pd.concat([members, _event_rows(members, events)], ignore_index=True)
+    root = str(tmp_path / 'artifacts')
+    build_encoded_bundle(exported, root=root, events_offset=log_offset(events_path))
+    service = {
+        'root': root, 'cache': ResultCache(4), 'events': events_path,
+        'snapshot': str(tmp_path / 'snapshot.pkl'), 'lock': threading.Lock(),
+    }
+
+    consume_events(service)
+    assert service['counters'].events == 0
+    assert live_artifacts(service)['popularity_index'] == build_popularity_index(exported)
+
+    later = {'member_no': 3, 'product': 'Dollar Fund', 'age_group': '19-30', 'town': 'NAIROBI'}
+    append_event(later, events_path)
+    consume_events(service)
+    assert service['counters'].events == 1
+    expected = build_popularity_index(pd.concat([exported, _event_rows(members, [later])], ignore_index=True))
+    assert live_artifacts(service)['popularity_index'] == expected
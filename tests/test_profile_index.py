@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+import scipy.sparse as sp
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.model_selection import train_test_split
+from sklearn.neighbors import NearestNeighbors
+
+from feature_encoder import encode_members, fit_feature_encoder
+from knn_recommender import knn_rank_products, member_feature_strings
+from profile_index import append_to_profile_index, profile_index_from_features, profile_rank_products
+from synthetic_data import synthetic_members
+
+
+@pytest.fixture(scope='module')
+def members():
+    return synthetic_members(20000, seed=3)
+
+
+def _featurize(members, kind):
+    if kind == 'tfidf':
+        # As the notebook fits it: on every row, before the split
+        features = TfidfVectorizer(max_features=1000).fit_transform(member_feature_strings(members))
+    else:
+        features = encode_members(fit_feature_encoder(members), members)
+    train_rows, test_rows = train_test_split(np.arange(len(members)), test_size=0.2, random_state=42)
+    labels = members['portfolio_map'].to_numpy()
+    return features[train_rows], labels[train_rows], features[test_rows[:1500]]
+
+
+@pytest.mark.parametrize('kind', ['tfidf', 'onehot'])
+def test_rankings_equal_brute_force(members, kind):
+    training, labels, queries = _featurize(members, kind)
+    model = NearestNeighbors(metric='cosine', algorithm='brute').fit(training)
+
+    expected = knn_rank_products(model, queries, labels)
+    ranked = profile_rank_products(profile_index_from_features(training, labels), queries)
+    assert ranked == expected
+
+
+def test_appended_rows_rank_like_a_rebuild(members):
+    training, labels, queries = _featurize(members, 'onehot')
+    split = len(labels) // 2
+    appended = append_to_profile_index(
+        profile_index_from_features(training[:split], labels[:split]), training[split:], labels[split:]
+    )
+    rebuilt = profile_index_from_features(training, labels)
+    assert profile_rank_products(appended, queries) == profile_rank_products(rebuilt, queries)
+
+
+@pytest.mark.parametrize('n_neighbors', [1, 50])
+def test_ties_across_profiles_take_the_earliest_rows(members, n_neighbors):
+    training, labels, queries = _featurize(members, 'onehot')
+    # An empty row is equidistant from every profile
+    queries = sp.vstack([queries[:300], sp.csr_matrix(queries.shape)[:2]], format='csr')
+    model = NearestNeighbors(metric='cosine', algorithm='brute').fit(training)
+
+    expected = knn_rank_products(model, queries, labels, n_neighbors=n_neighbors)
+    ranked = profile_rank_products(profile_index_from_features(training, labels), queries, n_neighbors=n_neighbors)
+    assert ranked == expected
@@ -0,0 +1,78 @@
+import asyncio
+import json
+
+import pytest
+
+import scoring_service
+from artifacts import build_encoded_bundle
+from result_cache import ResultCache
+from scoring_service import make_handler, resolve_members, score_existing_customers, score_new_customers
+from synthetic_data import synthetic_members
+
+
+def test_member_no_must_be_an_int64():
+    artifacts = {'member_store': {}}
+    for member_no in [1e30, 2**63, 'x', True, None]:
+        with pytest.raises(ValueError):
+            resolve_members(artifacts, [{'member_no': member_no}])
+
+
+def _exchange(service, request):
+    async def run():
+        server = await asyncio.start_server(make_handler(service), '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(request)
+            response = await reader.read()
+            writer.close()
+        return response
+    return asyncio.run(run())
+
+
+def _post(path, payload):
+    body = json.dumps(payload).encode()
+    return (
+        f"POST {path} HTTP/1.1\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+    )
+
+
+def test_unexpected_error_answers_500(tmp_path, monkeypatch):
+    # No bundle and no legacy pickles: loading the artifacts fails
+    monkeypatch.chdir(tmp_path)
+    service = {'root': str(tmp_path / 'artifacts'), 'cache': ResultCache(4), 'events': None}
+    response = _exchange(service, _post(
+        '/existing-customers/recommendations', {'age_group': '31-45', 'town': 'NAIROBI', 'gender': 'Male'}
+    ))
+    assert response.startswith(b"HTTP/1.1 500 ")
+    assert json.loads(response.split(b"\r\n\r\n", 1)[1]) == {'error': 'Internal server error'}
+
+
+def test_only_unknown_members_answer_404(tmp_path, monkeypatch):
+    members = synthetic_members(2000, seed=2)
+    root = str(tmp_path / 'artifacts')
+    build_encoded_bundle(members, root=root)
+    service = {'root': root, 'cache': ResultCache(4), 'events': None}
+    path = '/existing-customers/recommendations'
+
+    unknown = int(members['member_no'].max()) + 1
+    assert _exchange(service, _post(path, {'member_no': unknown})).startswith(b"HTTP/1.1 404 ")
+
+    def broken(*args, **kwargs):
+        raise KeyError('portfolio_map')
+    monkeypatch.setattr(scoring_service, 'recommend_members', broken)
+    member_no = int(members['member_no'].iloc[0])
+    assert _exchange(service, _post(path, {'member_no': member_no})).startswith(b"HTTP/1.1 500 ")
+
+
+def test_field_types_are_checked():
+    with pytest.raises(ValueError, match='loan_access'):
+        score_new_customers([{
+            'investment_duration': '1-3 years', 'emergency_fund': 'No',
+            'withdrawal_frequency': 'Rarely (yearly or less)', 'risk_appetite': 'High',
+            'investment_amount': 10000, 'currency': 'KES', 'loan_access': 'false',
+        }])
+    with pytest.raises(ValueError, match='current_products'):
+        score_existing_customers({}, [{
+            'age_group': '31-45', 'town': 'NAIROBI', 'gender': 'Male', 'current_products': 'Money Market',
+        }])